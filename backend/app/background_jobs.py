@@ -0,0 +1,101 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Any, Callable, Dict, Set
+
+logger = logging.getLogger(__name__)
+
+
+class BackgroundJobRunner:
+    """Runs post-response bookkeeping with retries and per-job metrics.
+
+    Jobs are handed to FastAPI's BackgroundTasks, so they run after the
+    response has been sent. A failing job is retried with exponential
+    backoff up to max_attempts times before it is counted as failed. Each
+    attempt runs in a worker thread; the backoff waits on the event loop,
+    so a retrying job holds no thread between attempts.
+    """
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5):
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.lock = threading.Lock()
+        self.jobs: Dict[str, Dict[str, Any]] = {}
+        # Jobs started by spawn(), referenced until they finish
+        self._tasks: Set[asyncio.Task] = set()
+
+    def _stats(self, name: str) -> Dict[str, Any]:
+        stats = self.jobs.get(name)
+        if stats is None:
+            stats = self.jobs[name] = {
+                "scheduled": 0,
+                "succeeded": 0,
+                "failed": 0,
+                "retries": 0,
+                "run_seconds": 0.0,
+                "last_error": None,
+            }
+        return stats
+
+    def schedule(self, background_tasks: Any, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """Queue fn to run after the response under the given job name"""
+        with self.lock:
+            self._stats(name)["scheduled"] += 1
+        background_tasks.add_task(self.arun, name, fn, *args, **kwargs)
+
+    def spawn(self, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any):
+        """Start fn on the running event loop right away, for error
+        responses, which are raised and so carry no BackgroundTasks"""
+        with self.lock:
+            self._stats(name)["scheduled"] += 1
+        task = asyncio.get_running_loop().create_task(self.arun(name, fn, *args, **kwargs))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def arun(self, name: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> bool:
+        """Run a job, retrying on failure; return whether it succeeded"""
+        start = time.perf_counter()
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await asyncio.to_thread(fn, *args, **kwargs)
+            except Exception as e:
+                if attempt < self.max_attempts:
+                    with self.lock:
+                        self._stats(name)["retries"] += 1
+                    logger.warning(f"Background job '{name}' failed (attempt {attempt}), retrying: {e}")
+                    await asyncio.sleep(self.base_delay * 2 ** (attempt - 1))
+                    continue
+                with self.lock:
+                    stats = self._stats(name)
+                    stats["failed"] += 1
+                    stats["last_error"] = str(e)
+                    stats["run_seconds"] += time.perf_counter() - start
+                logger.error(f"Background job '{name}' failed after {attempt} attempts: {e}")
+                return False
+            with self.lock:
+                stats = self._stats(name)
+                stats["succeeded"] += 1
+                stats["run_seconds"] += time.perf_counter() - start
+            return True
+        return False
+
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self.lock:
+            result = {}
+            for name, stats in self.jobs.items():
+                finished = stats["succeeded"] + stats["failed"]
+                result[name] = {
+                    **stats,
+                    "pending": stats["scheduled"] - finished,
+                    "avg_seconds": round(stats["run_seconds"] / finished, 4) if finished else 0.0,
+                }
+            return result
+
+
+# Global instance
+background_jobs = BackgroundJobRunner(
+    max_attempts=int(os.getenv("BACKGROUND_JOB_ATTEMPTS", "3")),
+    base_delay=float(os.getenv("BACKGROUND_JOB_RETRY_DELAY", "0.5"))
+)
@@ -0,0 +1,155 @@
+import os
+import json
+import logging
+import threading
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Message categories the classifier chooses between
+CATEGORIES = ("greeting", "islamic_question", "haram_content", "emotional_distress", "neutral")
+
+# Specific emotions for emotional_distress; "none" for every other category
+DISTRESS_EMOTIONS = (
+    "sad", "angry", "anxious", "tired", "lonely", "guilty", "empty", "hopeless",
+    "happy", "confused", "overwhelmed", "peaceful", "grateful"
+)
+NO_EMOTION = "none"
+
+# The whole answer is one small JSON object (~20 tokens); the cap only
+# stops a model that ignores the schema from rambling
+CLASSIFY_MAX_OUTPUT_TOKENS = int(os.getenv("CLASSIFY_MAX_OUTPUT_TOKENS", "48"))
+
+# Thinking models spend output tokens on thinking before the answer, and
+# google-generativeai cannot turn thinking off, so their cap covers both
+THINKING_MODELS = ("gemini-2.5",)
+CLASSIFY_THINKING_MAX_OUTPUT_TOKENS = int(os.getenv("CLASSIFY_THINKING_MAX_OUTPUT_TOKENS", "1024"))
+
+# Enum-constrained response schema; the model can only emit a valid pair
+CLASSIFY_RESPONSE_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "category": {"type": "STRING", "format": "enum", "enum": list(CATEGORIES)},
+        "emotion": {"type": "STRING", "format": "enum", "enum": list(DISTRESS_EMOTIONS) + [NO_EMOTION]},
+    },
+    "required": ["category", "emotion"],
+}
+
+# Output instruction appended to the classification prompt
+CLASSIFY_OUTPUT_FORMAT = (
+    'Respond with JSON only, no explanation: {"category": "<category>", "emotion": "<emotion>"}\n'
+    f'Use "{NO_EMOTION}" as the emotion unless the category is "emotional_distress".'
+)
+
+
+def classify_max_output_tokens(model_name: str) -> int:
+    """Output cap for the classifier on the given model"""
+    if any(prefix in model_name for prefix in THINKING_MODELS):
+        return CLASSIFY_THINKING_MAX_OUTPUT_TOKENS
+    return CLASSIFY_MAX_OUTPUT_TOKENS
+
+
+def classify_generation_config(model_name: str = "", max_output_tokens: Optional[int] = None) -> Dict[str, Any]:
+    """Deterministic, schema-constrained generation config for classification"""
+    return {
+        "temperature": 0.0,
+        "max_output_tokens": max_output_tokens or classify_max_output_tokens(model_name),
+        "response_mime_type": "application/json",
+        "response_schema": CLASSIFY_RESPONSE_SCHEMA,
+    }
+
+
+def parse_classification(text: str) -> str:
+    """Label for a classifier answer: the category, or the specific emotion
+    for emotional_distress. Raises ValueError on anything outside the schema,
+    including answers truncated by the token cap."""
+    try:
+        answer = json.loads(text)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Classifier answer is not JSON: {text[:80]!r}") from e
+    if not isinstance(answer, dict):
+        raise ValueError(f"Classifier answer is not an object: {text[:80]!r}")
+
+    category = answer.get("category")
+    if category not in CATEGORIES:
+        raise ValueError(f"Unknown category: {category!r}")
+    if category != "emotional_distress":
+        return category
+
+    emotion = answer.get("emotion")
+    if emotion not in DISTRESS_EMOTIONS:
+        raise ValueError(f"Unknown emotion for emotional_distress: {emotion!r}")
+    return emotion
+
+
+class ClassificationFailed(ValueError):
+    """The classifier gave no usable answer; reason is one of truncated,
+    empty or invalid"""
+
+    def __init__(self, reason: str, message: str):
+        super().__init__(message)
+        self.reason = reason
+
+
+def _finish_reason(response: Any) -> Optional[str]:
+    candidates = getattr(response, "candidates", None) or []
+    if not candidates:
+        return None
+    reason = getattr(candidates[0], "finish_reason", None)
+    return getattr(reason, "name", None) or (str(reason) if reason is not None else None)
+
+
+def read_classification(response: Any) -> str:
+    """Label from a classifier response. An answer cut off by the token cap
+    or without text is a failure, like one outside the schema."""
+    if _finish_reason(response) in ("MAX_TOKENS", "2"):
+        raise ClassificationFailed("truncated", "Classifier answer hit max_output_tokens")
+    try:
+        text = response.text.strip()
+    except ValueError:
+        # No text parts, e.g. everything was spent on thinking
+        text = ""
+    if not text:
+        raise ClassificationFailed("empty", "Classifier returned no text")
+    try:
+        return parse_classification(text)
+    except ValueError as e:
+        raise ClassificationFailed("invalid", str(e)) from e
+
+
+class ClassificationStats:
+    """Classifier answers and failures, so keyword fallbacks are visible"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.answered = 0
+        self.failures: Dict[str, int] = {}
+
+    def read(self, response: Any) -> str:
+        """read_classification, counting the outcome"""
+        try:
+            label = read_classification(response)
+        except ClassificationFailed as e:
+            self.record_failure(e.reason)
+            raise
+        with self.lock:
+            self.answered += 1
+        return label
+
+    def record_failure(self, reason: str):
+        with self.lock:
+            self.failures[reason] = self.failures.get(reason, 0) + 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            failed = sum(self.failures.values())
+            total = self.answered + failed
+            return {
+                "answered": self.answered,
+                "failures": dict(self.failures),
+                "fallback_rate": round(failed / total, 3) if total else 0.0,
+            }
+
+
+# Global instance
+classification_stats = ClassificationStats()
@@ -0,0 +1,393 @@
+import sys
+import binascii
+from abc import ABC, abstractmethod
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Union
+
+# Default ring capacities (the limits the context manager always applied)
+CONVERSATION_HISTORY_SIZE = 20
+EMOTION_HISTORY_SIZE = 15
+
+# Past this many symbols (or groups) a history drops the ones no live row uses
+MAX_SYMBOLS = 256
+
+# Packed columns are little-endian on disk
+_SWAP_BYTES = sys.byteorder == "big"
+
+# Interned symbol-code tuples, so identical groups share one object
+_code_tuples: Dict[Tuple[int, ...], Tuple[int, ...]] = {(): ()}
+
+
+def _code_tuple(codes: Iterable[int]) -> Tuple[int, ...]:
+    key = tuple(codes)
+    return _code_tuples.setdefault(key, key)
+
+
+class EmotionRecord:
+    __slots__ = ("emotion", "timestamp")
+
+    def __init__(self, emotion: str, timestamp: float):
+        self.emotion = emotion
+        self.timestamp = timestamp
+
+    def __getitem__(self, key: str) -> Any:
+        """Dict-style access, so callers written for the JSON view keep working"""
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {"emotion": self.emotion, "timestamp": self.timestamp}
+
+
+class ConversationRecord:
+    __slots__ = ("timestamp", "message", "emotion", "response_length",
+                 "topics_detected", "urgency_level", "spiritual_themes")
+
+    def __init__(self, timestamp: float, message: str, emotion: str, response_length: int,
+                 topics_detected: List[str], urgency_level: str, spiritual_themes: List[str]):
+        self.timestamp = timestamp
+        self.message = message
+        self.emotion = emotion
+        self.response_length = response_length
+        self.topics_detected = topics_detected
+        self.urgency_level = urgency_level
+        self.spiritual_themes = spiritual_themes
+
+    def __getitem__(self, key: str) -> Any:
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {slot: getattr(self, slot) for slot in self.__slots__}
+
+
+class _Ring(ABC):
+    """Fixed-capacity ring of typed columns; appending to a full ring drops the oldest row.
+
+    Repeated strings (emotions, urgency levels) are stored as small integer
+    codes into the ring's own symbol table, whose strings are interned so
+    all users share one copy; lists of them (topics, themes) are codes into
+    a table of symbol-code groups. Numeric columns are `array`s, stored
+    packed into one base64 blob next to the tables, so serializing and
+    loading never touch individual rows.
+    """
+
+    __slots__ = ("capacity", "symbols", "groups", "_start", "_len")
+
+    # (slot name, array typecode) of the numeric columns, in packed order
+    NUMERIC_COLUMNS: Tuple[Tuple[str, str], ...] = ()
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.symbols: List[str] = []
+        self.groups: List[Tuple[int, ...]] = []
+        self._start = 0
+        self._len = 0
+        for name, typecode in self.NUMERIC_COLUMNS:
+            setattr(self, name, array(typecode, [0]) * capacity)
+
+    def _reserve(self, symbols: Sequence[str], groups: Sequence[Sequence[str]] = ()):
+        """Make room for a row's symbols and groups before any is encoded.
+
+        Dropping unused codes renumbers the tables, so it must happen before
+        encoding starts; codes handed out during one add() stay valid.
+        """
+        known = set(self.symbols)
+        new_symbols = {symbol for symbol in symbols if symbol not in known}
+        new_groups = 0
+        for group in groups:
+            if any(symbol not in known for symbol in group):
+                new_symbols.update(symbol for symbol in group if symbol not in known)
+                new_groups += 1
+            elif _code_tuple(self.symbols.index(symbol) for symbol in group) not in self.groups:
+                new_groups += 1
+        if (len(self.symbols) + len(new_symbols) > MAX_SYMBOLS
+                or len(self.groups) + new_groups > MAX_SYMBOLS):
+            self._drop_unused_codes()
+
+    def _code(self, symbol: str) -> int:
+        try:
+            return self.symbols.index(symbol)
+        except ValueError:
+            self.symbols.append(sys.intern(symbol))
+            return len(self.symbols) - 1
+
+    def _group(self, symbols: Sequence[str]) -> int:
+        codes = _code_tuple(self._code(symbol) for symbol in symbols)
+        try:
+            return self.groups.index(codes)
+        except ValueError:
+            self.groups.append(codes)
+            return len(self.groups) - 1
+
+    @abstractmethod
+    def _code_columns(self) -> Tuple[List[array], List[array]]:
+        """(columns indexing self.symbols, columns indexing self.groups)"""
+
+    def _drop_unused_codes(self):
+        symbol_columns, group_columns = self._code_columns()
+        slots = list(self._slots())
+        kept_groups = sorted({column[slot] for column in group_columns for slot in slots})
+        groups = [self.groups[old] for old in kept_groups]
+        kept_symbols = sorted({column[slot] for column in symbol_columns for slot in slots}
+                              | {code for group in groups for code in group})
+        symbol_remap = {old: new for new, old in enumerate(kept_symbols)}
+        group_remap = {old: new for new, old in enumerate(kept_groups)}
+        self.symbols = [self.symbols[old] for old in kept_symbols]
+        self.groups = [_code_tuple(symbol_remap[code] for code in group) for group in groups]
+        for slot in slots:
+            for column in symbol_columns:
+                column[slot] = symbol_remap[column[slot]]
+            for column in group_columns:
+                column[slot] = group_remap[column[slot]]
+
+    def _next_slot(self) -> int:
+        if self._len < self.capacity:
+            slot = (self._start + self._len) % self.capacity
+            self._len += 1
+        else:
+            slot = self._start
+            self._start = (self._start + 1) % self.capacity
+        return slot
+
+    def _slots(self, start: int = 0, stop: Optional[int] = None) -> Iterator[int]:
+        """Physical slots of logical rows start..stop, oldest first"""
+        stop = self._len if stop is None else stop
+        for i in range(start, stop):
+            yield (self._start + i) % self.capacity
+
+    def _ordered(self, column: Union[array, list]) -> Union[array, list]:
+        """A column's live rows, oldest first"""
+        if self._len < self.capacity:
+            return column[:self._len]
+        return column[self._start:] + column[:self._start]
+
+    def _pack(self) -> str:
+        """Live rows of every numeric column, as one base64 string"""
+        parts = []
+        for name, _ in self.NUMERIC_COLUMNS:
+            rows = self._ordered(getattr(self, name))
+            if _SWAP_BYTES:
+                rows.byteswap()
+            parts.append(rows.tobytes())
+        return binascii.b2a_base64(b"".join(parts), newline=False).decode("ascii")
+
+    def _unpack(self, packed: str) -> int:
+        """Load _pack() output into the leading slots; return the row count"""
+        data = binascii.a2b_base64(packed)
+        columns = [getattr(self, name) for name, _ in self.NUMERIC_COLUMNS]
+        rows, extra = divmod(len(data), sum(column.itemsize for column in columns))
+        if extra or rows > self.capacity:
+            raise ValueError(f"Packed history does not fit {type(self).__name__}({self.capacity})")
+        offset = 0
+        for column in columns:
+            size = rows * column.itemsize
+            part = array(column.typecode, data[offset:offset + size])
+            if _SWAP_BYTES:
+                part.byteswap()
+            column[:rows] = part
+            offset += size
+        self._start = 0
+        self._len = rows
+        return rows
+
+    @abstractmethod
+    def _record(self, slot: int) -> Any:
+        """The row in a physical slot, as a record object"""
+
+    def to_records(self) -> List[Dict[str, Any]]:
+        return [self._record(slot).to_dict() for slot in self._slots()]
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __iter__(self) -> Iterator[Any]:
+        return (self._record(slot) for slot in self._slots())
+
+    def __getitem__(self, index: Union[int, slice]) -> Any:
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._len)
+            if step != 1:
+                return list(self)[index]
+            return [self._record(slot) for slot in self._slots(start, max(start, stop))]
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("history index out of range")
+        return self._record((self._start + index) % self.capacity)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, _Ring):
+            return self.to_records() == other.to_records()
+        if isinstance(other, list):
+            return self.to_records() == [item.to_dict() if hasattr(item, "to_dict") else item for item in other]
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.to_records()!r})"
+
+
+class EmotionHistory(_Ring):
+    """Last `capacity` emotions as a symbol-code column plus a timestamp column"""
+
+    __slots__ = ("_times", "_codes")
+
+    NUMERIC_COLUMNS = (("_times", "d"), ("_codes", "H"))
+
+    def __init__(self, capacity: int = EMOTION_HISTORY_SIZE):
+        super().__init__(capacity)
+
+    def add(self, emotion: str, timestamp: float):
+        self._reserve([emotion])
+        code = self._code(emotion)
+        slot = self._next_slot()
+        self._codes[slot] = code
+        self._times[slot] = timestamp
+
+    def append(self, entry: Dict[str, Any]):
+        self.add(entry["emotion"], entry["timestamp"])
+
+    def recent_emotions(self, n: int) -> List[str]:
+        """The last n emotions, oldest first, without building records"""
+        symbols = self.symbols
+        return [symbols[self._codes[slot]] for slot in self._slots(max(0, self._len - n))]
+
+    def _code_columns(self) -> Tuple[List[array], List[array]]:
+        return [self._codes], []
+
+    def _record(self, slot: int) -> EmotionRecord:
+        return EmotionRecord(self.symbols[self._codes[slot]], self._times[slot])
+
+    def to_json(self) -> Dict[str, Any]:
+        """Columnar form, for storage"""
+        return {"capacity": self.capacity, "symbols": self.symbols, "rows": self._pack()}
+
+    @classmethod
+    def from_json(cls, value: Any, capacity: int = EMOTION_HISTORY_SIZE) -> "EmotionHistory":
+        """Build from the columnar form or a legacy list of record dicts"""
+        if isinstance(value, EmotionHistory):
+            return value
+        if isinstance(value, dict):
+            history = cls(value.get("capacity", capacity))
+            history.symbols = [sys.intern(symbol) for symbol in value["symbols"]]
+            history._unpack(value["rows"])
+            return history
+        history = cls(capacity)
+        for entry in value[-capacity:]:
+            history.add(entry["emotion"], entry["timestamp"])
+        return history
+
+
+class ConversationHistory(_Ring):
+    """Last `capacity` conversation turns in typed columns with symbol and group codes"""
+
+    __slots__ = ("_times", "_lengths", "_emotions", "_urgency", "_topics", "_themes", "_messages")
+
+    NUMERIC_COLUMNS = (("_times", "d"), ("_lengths", "I"), ("_emotions", "H"),
+                       ("_urgency", "H"), ("_topics", "H"), ("_themes", "H"))
+
+    def __init__(self, capacity: int = CONVERSATION_HISTORY_SIZE):
+        super().__init__(capacity)
+        self._messages: List[str] = [""] * capacity
+
+    def add(self, timestamp: float, message: str, emotion: str, response_length: int,
+            topics_detected: Sequence[str], urgency_level: str, spiritual_themes: Sequence[str]):
+        # Reserve before claiming a slot: dropping unused codes scans live
+        # rows and renumbers them, so it must not happen mid-encoding
+        self._reserve([emotion, urgency_level], [topics_detected, spiritual_themes])
+        topics = self._group(topics_detected)
+        themes = self._group(spiritual_themes)
+        emotion_code = self._code(emotion)
+        urgency_code = self._code(urgency_level)
+        slot = self._next_slot()
+        self._times[slot] = timestamp
+        self._messages[slot] = message
+        self._emotions[slot] = emotion_code
+        self._lengths[slot] = response_length
+        self._topics[slot] = topics
+        self._urgency[slot] = urgency_code
+        self._themes[slot] = themes
+
+    def append(self, entry: Dict[str, Any]):
+        self.add(entry["timestamp"], entry["message"], entry["emotion"], entry.get("response_length", 0),
+                 entry.get("topics_detected", []), entry.get("urgency_level", "low"),
+                 entry.get("spiritual_themes", []))
+
+    def _code_columns(self) -> Tuple[List[array], List[array]]:
+        return [self._emotions, self._urgency], [self._topics, self._themes]
+
+    def _record(self, slot: int) -> ConversationRecord:
+        symbols = self.symbols
+        return ConversationRecord(
+            self._times[slot],
+            self._messages[slot],
+            symbols[self._emotions[slot]],
+            self._lengths[slot],
+            [symbols[code] for code in self.groups[self._topics[slot]]],
+            symbols[self._urgency[slot]],
+            [symbols[code] for code in self.groups[self._themes[slot]]],
+        )
+
+    def to_json(self) -> Dict[str, Any]:
+        return {
+            "capacity": self.capacity,
+            "symbols": self.symbols,
+            "groups": self.groups,
+            "rows": self._pack(),
+            "message": self._ordered(self._messages),
+        }
+
+    @classmethod
+    def from_json(cls, value: Any, capacity: int = CONVERSATION_HISTORY_SIZE) -> "ConversationHistory":
+        if isinstance(value, ConversationHistory):
+            return value
+        if isinstance(value, dict):
+            history = cls(value.get("capacity", capacity))
+            history.symbols = [sys.intern(symbol) for symbol in value["symbols"]]
+            history.groups = [_code_tuple(group) for group in value["groups"]]
+            rows = history._unpack(value["rows"])
+            if len(value["message"]) != rows:
+                raise ValueError("Conversation history messages do not match its rows")
+            history._messages[:rows] = value["message"]
+            return history
+        history = cls(capacity)
+        for entry in value[-capacity:]:
+            history.append(entry)
+        return history
+
+
+# --- CONTEXT HELPERS --- #
+def inflate_histories(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace stored or legacy history values in a context with compact rings.
+
+    Raises ValueError for malformed histories, like a failed JSON parse.
+    """
+    try:
+        if "conversation_history" in context:
+            context["conversation_history"] = ConversationHistory.from_json(context["conversation_history"])
+        if "emotional_history" in context:
+            context["emotional_history"] = EmotionHistory.from_json(context["emotional_history"])
+    except (KeyError, TypeError, IndexError) as e:
+        raise ValueError(f"Malformed history: {e!r}") from e
+    return context
+
+
+def encode_history(obj: Any) -> Any:
+    """json/orjson `default` hook: store histories in columnar form"""
+    if isinstance(obj, _Ring):
+        return obj.to_json()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def encode_history_records(obj: Any) -> Any:
+    """json `default` hook for the readable view: histories as lists of records"""
+    if isinstance(obj, _Ring):
+        return obj.to_records()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def context_view(context: Dict[str, Any]) -> Dict[str, Any]:
+    """Plain-JSON view of a context for API responses"""
+    view = dict(context)
+    for key, value in context.items():
+        if isinstance(value, _Ring):
+            view[key] = value.to_records()
+    return view
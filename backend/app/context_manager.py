@@ -1,22 +1,63 @@
 import os
 import json
 import time
+import asyncio
 import logging
-from typing import Dict, List, Any, Optional
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Any, Optional
 from datetime import datetime, timedelta
 from pathlib import Path
 
+from app.compact_history import ConversationHistory, EmotionHistory, context_view, inflate_histories
+from app.context_store import CONTEXT_SCHEMA_VERSION, ContextEventLog, create_context_store
+from app.user_locks import AsyncUserLocks, UserLocks
+
 logger = logging.getLogger(__name__)
 
 class AdvancedContextManager:
     """Advanced context manager for intelligent conversation tracking"""
     
-    def __init__(self, data_dir: str = "data/user_context"):
+    def __init__(
+        self,
+        data_dir: str = "data/user_context",
+        store=None,
+        flush_interval: float = 5.0,
+        session_ttl: float = 1800,
+        max_sessions: int = 10000,
+        event_log=None,
+        compact_threshold: int = 20
+    ):
         self.data_dir = Path(data_dir)
-        self.data_dir.mkdir(parents=True, exist_ok=True)
         
-        # In-memory cache for active sessions
-        self.active_sessions = {}
+        # Persistent storage backend (JSON files by default, SQLite optional)
+        self.store = store if store is not None else create_context_store(data_dir=data_dir)
+        
+        # Write-behind cache for active sessions, least recently used first:
+        # user_id -> {"context": dict, "dirty": bool, "last_access": float}
+        # A flush_interval of 0 disables caching and writes through to the store
+        self.active_sessions = OrderedDict()
+        self.flush_interval = flush_interval
+        self.session_ttl = session_ttl
+        self.max_sessions = max_sessions
+        # Guards only the session table; a user's context is read, modified
+        # and persisted under that user's lock, so users never contend
+        self.sessions_lock = threading.RLock()
+        self.user_locks = UserLocks()
+        self.async_user_locks = AsyncUserLocks(self.user_locks)
+        
+        # Optional append-only event log; with it, updates are O(1) appends
+        # and snapshots are rewritten only by compaction
+        self.event_log = event_log if flush_interval > 0 else None
+        if event_log is not None and flush_interval <= 0:
+            logger.warning("Context event log requires the session cache; ignoring it")
+        self.compact_threshold = compact_threshold
+        
+        self._stop_flusher = threading.Event()
+        self._flusher = None
+        if flush_interval > 0:
+            self._flusher = threading.Thread(target=self._flush_loop, name="context-flusher", daemon=True)
+            self._flusher.start()
         
         # Pattern recognition
         self.emotional_patterns = {
@@ -30,42 +71,305 @@ class AdvancedContextManager:
         # Response variation tracking
         self.response_history = {}
         
-    def get_user_file_path(self, user_id: str) -> Path:
-        """Get file path for user's context data"""
-        return self.data_dir / f"{user_id}.json"
-    
     def load_user_context(self, user_id: str) -> Dict[str, Any]:
-        """Load user context from file"""
-        file_path = self.get_user_file_path(user_id)
-        
-        if file_path.exists():
+        """Load user context, from the session cache when active.
+
+        The cached context is shared; mutate it only inside user_lock().
+        """
+        with self.user_locks.hold(user_id):
+            return self._load_locked(user_id)
+    
+    def get_user_context_view(self, user_id: str) -> Dict[str, Any]:
+        """Plain-JSON copy of a user's context (histories as lists of records) for the API"""
+        with self.user_locks.hold(user_id):
+            return json.loads(json.dumps(context_view(self._load_locked(user_id))))
+    
+    def _load_locked(self, user_id: str) -> Dict[str, Any]:
+        if self.flush_interval <= 0:
+            context = self.store.load(user_id)
+            return context if context is not None else self._create_default_context()
+        return self._session(user_id)["context"]
+    
+    def save_user_context(self, user_id: str, context: Dict[str, Any]):
+        """Save user context (written to the store on the next flush)"""
+        # The caller may have changed any field the summary depends on
+        inflate_histories(context)
+        self._build_summary(context)
+        with self.user_locks.hold(user_id):
+            if self.flush_interval <= 0:
+                self.store.save(user_id, context)
+                return
+            self._replace_context(self._session(user_id), context)
+    
+    def user_lock(self, user_id: str):
+        """Hold a user's lock around a load_user_context/save_user_context sequence"""
+        return self.user_locks.hold(user_id)
+    
+    def get_active_users(self, since: float) -> List[str]:
+        """Get ids of users seen at or after the given timestamp.
+
+        Cached sessions may be ahead of the store, so their users are
+        checked in memory rather than flushed first; last_seen only moves
+        forward, so a user the store counts stays counted.
+        """
+        with self.sessions_lock:
+            cached = [
+                user_id for user_id, session in self.active_sessions.items()
+                if session["context"].get("last_seen", 0) >= since
+            ]
+        users = self.store.active_users(since)
+        seen = set(users)
+        return users + [user_id for user_id in cached if user_id not in seen]
+    
+    # --- ASYNC API --- #
+    # Same semantics as the sync methods, but store and event-log I/O is
+    # awaited instead of blocking the event loop
+    async def aload_user_context(self, user_id: str) -> Dict[str, Any]:
+        async with self.async_user_locks.hold(user_id):
+            if self.flush_interval <= 0:
+                context = await self.store.aload(user_id)
+                return context if context is not None else self._create_default_context()
+            return (await self._asession(user_id))["context"]
+    
+    async def asave_user_context(self, user_id: str, context: Dict[str, Any]):
+        inflate_histories(context)
+        self._build_summary(context)
+        async with self.async_user_locks.hold(user_id):
+            if self.flush_interval <= 0:
+                await self.store.asave(user_id, context)
+                return
+            self._replace_context(await self._asession(user_id), context)
+    
+    def auser_lock(self, user_id: str):
+        """Async variant of user_lock(); also excludes threads holding it"""
+        return self.async_user_locks.hold(user_id)
+    
+    async def aupdate_conversation(self, user_id: str, message: str, emotion: str, response: str) -> Dict[str, Any]:
+        return await self._arecord(user_id, {
+            "type": "conversation",
+            "ts": time.time(),
+            "message": message,
+            "emotion": emotion,
+            "response_length": len(response)
+        })
+    
+    async def atrack_response_usage(self, user_id: str, emotion: str, response_type: str):
+        await self._arecord(user_id, {
+            "type": "response_usage",
+            "ts": time.time(),
+            "emotion": emotion,
+            "response_type": response_type
+        })
+    
+    async def aget_active_users(self, since: float) -> List[str]:
+        return await asyncio.to_thread(self.get_active_users, since)
+    
+    async def _arecord(self, user_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        async with self.async_user_locks.hold(user_id):
+            if self.flush_interval <= 0:
+                return await self.store.aupdate(user_id, lambda context: self._apply_event(context, event), self._create_default_context)
+            
+            context = self._apply_to_session(await self._asession(user_id), event)
+            if self.event_log is not None:
+                await self.event_log.aappend(user_id, event)
+            return context
+    
+    async def _asession(self, user_id: str) -> Dict[str, Any]:
+        """Async _session(); the caller holds the user's lock"""
+        with self.sessions_lock:
+            session = self._cached_session(user_id)
+        if session is None:
+            context = await self.store.aload(user_id)
+            events = []
+            if self.event_log is not None:
+                events = await self.event_log.aread(user_id, after_seq=(context or {}).get("event_seq", 0))
+            with self.sessions_lock:
+                session = self._install_session(user_id, context, events)
+                overflow = len(self.active_sessions) > self.max_sessions
+            if overflow:
+                await asyncio.to_thread(self._evict_overflow)
+        return session
+    
+    # --- WRITE-BEHIND SESSION CACHE --- #
+    def _session(self, user_id: str) -> Dict[str, Any]:
+        """Return the cached session, loading it from the store once.
+        
+        The caller holds the user's lock, so no other caller can load,
+        mutate or evict this user's session meanwhile.
+        """
+        with self.sessions_lock:
+            session = self._cached_session(user_id)
+        if session is None:
+            context = self.store.load(user_id)
+            events = []
+            if self.event_log is not None:
+                events = self.event_log.read(user_id, after_seq=(context or {}).get("event_seq", 0))
+            with self.sessions_lock:
+                session = self._install_session(user_id, context, events)
+            self._evict_overflow()
+        return session
+    
+    def _cached_session(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return and touch the cached session, if any (sessions_lock held)"""
+        session = self.active_sessions.get(user_id)
+        if session is not None:
+            session["last_access"] = time.time()
+            self.active_sessions.move_to_end(user_id)
+        return session
+    
+    def _install_session(self, user_id: str, context: Optional[Dict[str, Any]], events: List[Dict[str, Any]]) -> Dict[str, Any]:
+        """Cache a loaded snapshot, replaying newer logged events onto it (sessions_lock held)"""
+        is_new = context is None
+        if is_new:
+            context = self._create_default_context()
+        session = {
+            "context": context,
+            "dirty": False,
+            "last_access": time.time(),
+            "seq": context.get("event_seq", 0),
+            "pending_events": 0
+        }
+        # Materialize the current view: snapshot plus newer events
+        for event in events:
+            if is_new and not session["pending_events"]:
+                # The user was created by their first logged event
+                context["created_at"] = event["ts"]
+            self._apply_event(context, event)
+            session["seq"] = event["seq"]
+            session["pending_events"] += 1
+        if self.event_log is not None:
+            context["event_seq"] = session["seq"]
+        self.active_sessions[user_id] = session
+        return session
+    
+    def _evict_overflow(self):
+        with self.sessions_lock:
+            overflow = len(self.active_sessions) - self.max_sessions
+        if overflow > 0:
+            self._evict_sessions(force_count=overflow)
+    
+    def _replace_context(self, session: Dict[str, Any], context: Dict[str, Any]):
+        context["event_seq"] = session["seq"]
+        session["context"] = context
+        session["dirty"] = True
+    
+    def _apply_to_session(self, session: Dict[str, Any], event: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply an event to a cached session, sequencing it when logging (user lock held)"""
+        context = session["context"]
+        if self.event_log is not None:
+            event["seq"] = session["seq"] + 1
+            session["seq"] = event["seq"]
+            session["pending_events"] += 1
+            self._apply_event(context, event)
+            context["event_seq"] = event["seq"]
+        else:
+            self._apply_event(context, event)
+            session["dirty"] = True
+        return context
+    
+    def _record(self, user_id: str, event: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply an update event to a user's context, via the cache or the store"""
+        with self.user_locks.hold(user_id):
+            if self.flush_interval <= 0:
+                return self.store.update(user_id, lambda context: self._apply_event(context, event), self._create_default_context)
+            
+            context = self._apply_to_session(self._session(user_id), event)
+            if self.event_log is not None:
+                self.event_log.append(user_id, event)
+            return context
+    
+    def _persist(self, user_id: str, session: Dict[str, Any]):
+        """Write a session snapshot and drop the events it covers (user lock held)"""
+        self.store.save(user_id, session["context"])
+        if self.event_log is not None and session["pending_events"]:
+            self.event_log.truncate(user_id, session["seq"])
+        session["pending_events"] = 0
+        session["dirty"] = False
+    
+    def _is_current(self, user_id: str, session: Dict[str, Any]) -> bool:
+        with self.sessions_lock:
+            return self.active_sessions.get(user_id) is session
+    
+    def _evict_sessions(self, force_count: int = 0):
+        """Flush and drop idle sessions, plus the force_count least recently used"""
+        cutoff = time.time() - self.session_ttl
+        with self.sessions_lock:
+            candidates = []
+            for user_id, session in self.active_sessions.items():
+                if force_count <= 0 and session["last_access"] > cutoff:
+                    break
+                candidates.append((user_id, session))
+                force_count -= 1
+        
+        for user_id, session in candidates:
+            # A session whose user lock is taken is in use, not idle
+            if not self.user_locks.acquire(user_id, blocking=False):
+                continue
+            try:
+                if not self._is_current(user_id, session):
+                    continue
+                if session["dirty"] or session["pending_events"]:
+                    self._persist(user_id, session)
+                with self.sessions_lock:
+                    del self.active_sessions[user_id]
+            finally:
+                self.user_locks.release(user_id)
+    
+    def flush(self):
+        """Write every dirty session to the store"""
+        self._persist_where(lambda session: session["dirty"])
+    
+    def compact(self, min_events: int = 1):
+        """Fold logged events into snapshots for sessions with enough of them"""
+        self._persist_where(lambda session: session["pending_events"] >= min_events)
+    
+    def _persist_where(self, predicate: Callable[[Dict[str, Any]], bool]):
+        with self.sessions_lock:
+            sessions = list(self.active_sessions.items())
+        for user_id, session in sessions:
+            if not predicate(session):
+                continue
+            with self.user_locks.hold(user_id):
+                if self._is_current(user_id, session) and predicate(session):
+                    self._persist(user_id, session)
+    
+    def _flush_loop(self):
+        while not self._stop_flusher.wait(self.flush_interval):
             try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                self.flush()
+                self.compact(self.compact_threshold)
+                self._evict_sessions()
             except Exception as e:
-                logger.error(f"Error loading user context: {e}")
-                return self._create_default_context()
-        
-        return self._create_default_context()
+                logger.error(f"Error flushing user contexts: {e}")
     
-    def save_user_context(self, user_id: str, context: Dict[str, Any]):
-        """Save user context to file"""
-        file_path = self.get_user_file_path(user_id)
-        
-        try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                json.dump(context, f, ensure_ascii=False, indent=2)
-        except Exception as e:
-            logger.error(f"Error saving user context: {e}")
+    def close(self):
+        """Stop the background flusher and durably flush all sessions"""
+        self._stop_flusher.set()
+        if self._flusher is not None:
+            self._flusher.join(timeout=self.flush_interval + 1)
+        self.flush()
+        self.compact()
+    
+    def get_session_stats(self) -> Dict[str, Any]:
+        """Get write-behind cache statistics"""
+        with self.sessions_lock:
+            return {
+                "active_sessions": len(self.active_sessions),
+                "dirty_sessions": sum(1 for session in self.active_sessions.values() if session["dirty"]),
+                "pending_events": sum(session["pending_events"] for session in self.active_sessions.values()),
+                "locked_users": len(self.user_locks),
+                "flush_interval_seconds": self.flush_interval
+            }
     
     def _create_default_context(self) -> Dict[str, Any]:
         """Create default user context"""
         return {
+            "schema_version": CONTEXT_SCHEMA_VERSION,
             "name": "Friend",
             "created_at": time.time(),
             "last_seen": time.time(),
-            "conversation_history": [],
-            "emotional_history": [],
+            "conversation_history": ConversationHistory(),
+            "emotional_history": EmotionHistory(),
             "topic_patterns": {},
             "response_patterns": {},
             "therapeutic_progress": {
@@ -94,42 +398,54 @@ class AdvancedContextManager:
     
     def update_conversation(self, user_id: str, message: str, emotion: str, response: str):
         """Update conversation history with intelligent analysis"""
-        context = self.load_user_context(user_id)
-        
+        return self._record(user_id, {
+            "type": "conversation",
+            "ts": time.time(),
+            "message": message,
+            "emotion": emotion,
+            "response_length": len(response)
+        })
+    
+    def _apply_event(self, context: Dict[str, Any], event: Dict[str, Any]):
+        """Apply a recorded event to a loaded context in place"""
+        if event["type"] == "conversation":
+            self._apply_conversation(context, event["message"], event["emotion"], event["response_length"], event["ts"])
+        elif event["type"] == "response_usage":
+            self._apply_response_usage(context, event["emotion"], event["response_type"], event["ts"])
+        else:
+            logger.warning(f"Skipping unknown context event type: {event['type']}")
+    
+    def _apply_conversation(self, context: Dict[str, Any], message: str, emotion: str, response_length: int, now: float):
+        """Apply one conversation turn to a loaded context in place"""
         # Add to conversation history
         conversation_entry = {
-            "timestamp": time.time(),
+            "timestamp": now,
             "message": message,
             "emotion": emotion,
-            "response_length": len(response),
+            "response_length": response_length,
             "topics_detected": self._extract_topics(message),
             "urgency_level": self._assess_urgency(message, emotion),
             "spiritual_themes": self._extract_spiritual_themes(message)
         }
         
+        # The ring keeps only the last 20 conversations
         context["conversation_history"].append(conversation_entry)
         
-        # Keep only last 20 conversations
-        if len(context["conversation_history"]) > 20:
-            context["conversation_history"] = context["conversation_history"][-20:]
-        
         # Update emotional history
-        self._update_emotional_patterns(context, emotion)
+        self._update_emotional_patterns(context, emotion, now)
         
         # Update topic patterns
-        self._update_topic_patterns(context, message)
+        self._update_topic_patterns(context, message, now)
         
         # Assess therapeutic progress
-        self._assess_progress(context, message, emotion)
+        self._assess_progress(context, message, emotion, now)
         
         # Update last seen
-        context["last_seen"] = time.time()
+        context["last_seen"] = now
         context["therapeutic_progress"]["sessions_count"] += 1
         
-        # Save context
-        self.save_user_context(user_id, context)
-        
-        return context
+        # Keep the prompt summary current without rescanning the context
+        self._update_summary(context, conversation_entry["topics_detected"])
     
     def _extract_topics(self, message: str) -> List[str]:
         """Extract topics from message"""
@@ -197,19 +513,13 @@ class AdvancedContextManager:
         
         return themes
     
-    def _update_emotional_patterns(self, context: Dict, emotion: str):
+    def _update_emotional_patterns(self, context: Dict, emotion: str, now: float):
         """Update emotional patterns analysis"""
-        context["emotional_history"].append({
-            "emotion": emotion,
-            "timestamp": time.time()
-        })
-        
-        # Keep only last 15 emotions
-        if len(context["emotional_history"]) > 15:
-            context["emotional_history"] = context["emotional_history"][-15:]
+        # The ring keeps only the last 15 emotions
+        context["emotional_history"].add(emotion, now)
         
         # Analyze patterns
-        recent_emotions = [e["emotion"] for e in context["emotional_history"][-5:]]
+        recent_emotions = context["emotional_history"].recent_emotions(5)
         
         # Check for recurring patterns
         for pattern_name, pattern_emotions in self.emotional_patterns.items():
@@ -217,7 +527,7 @@ class AdvancedContextManager:
                 if pattern_name not in context["therapeutic_progress"]["recurring_issues"]:
                     context["therapeutic_progress"]["recurring_issues"].append(pattern_name)
     
-    def _update_topic_patterns(self, context: Dict, message: str):
+    def _update_topic_patterns(self, context: Dict, message: str, now: float):
         """Update topic patterns"""
         topics = self._extract_topics(message)
         
@@ -225,14 +535,14 @@ class AdvancedContextManager:
             if topic not in context["topic_patterns"]:
                 context["topic_patterns"][topic] = {
                     "count": 0,
-                    "first_mentioned": time.time(),
-                    "last_mentioned": time.time()
+                    "first_mentioned": now,
+                    "last_mentioned": now
                 }
             
             context["topic_patterns"][topic]["count"] += 1
-            context["topic_patterns"][topic]["last_mentioned"] = time.time()
+            context["topic_patterns"][topic]["last_mentioned"] = now
     
-    def _assess_progress(self, context: Dict, message: str, emotion: str):
+    def _assess_progress(self, context: Dict, message: str, emotion: str, now: float):
         """Assess therapeutic progress"""
         # Check for positive indicators
         positive_indicators = [
@@ -243,7 +553,7 @@ class AdvancedContextManager:
         if any(indicator in message.lower() for indicator in positive_indicators):
             context["therapeutic_progress"]["improvement_indicators"].append({
                 "indicator": "positive_language",
-                "timestamp": time.time(),
+                "timestamp": now,
                 "message_excerpt": message[:100]
             })
         
@@ -255,48 +565,95 @@ class AdvancedContextManager:
         
         if any(indicator in message.lower() for indicator in breakthrough_indicators):
             context["therapeutic_progress"]["breakthrough_moments"].append({
-                "timestamp": time.time(),
+                "timestamp": now,
                 "message_excerpt": message[:100]
             })
     
+    # --- MATERIALIZED PROMPT SUMMARY --- #
+    # context["summary"] holds the inputs of the prompt enhancement and its
+    # rendered text; it is updated per conversation turn and stored with
+    # the context, so reading it never sorts or rescans histories
     def get_contextual_prompt_enhancement(self, user_id: str) -> str:
         """Get contextual information to enhance prompts"""
-        context = self.load_user_context(user_id)
+        with self.user_locks.hold(user_id):
+            context = self._load_locked(user_id)
+            summary = context.get("summary")
+            if summary is None:
+                # Contexts stored before summaries existed
+                summary = self._build_summary(context)
+            return summary["text"]
+    
+    def _build_summary(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Compute the summary from scratch (legacy or replaced contexts)"""
+        # sorted() is stable, so ties keep first-mentioned order
+        top_topics = sorted(context["topic_patterns"].items(),
+                            key=lambda x: x[1]["count"], reverse=True)[:3]
+        context["summary"] = {
+            "top_topics": [[topic, stats["count"]] for topic, stats in top_topics]
+        }
+        return self._render_summary(context)
+    
+    def _update_summary(self, context: Dict[str, Any], changed_topics: List[str]):
+        """Fold one conversation turn into the summary.
+        
+        Topic counts only grow, so a topic can enter the top three only
+        when its own count changes: merging the changed topics into the
+        current top three gives the exact new ranking.
+        """
+        summary = context.get("summary")
+        if summary is None:
+            self._build_summary(context)
+            return
+        
+        if changed_topics:
+            topic_patterns = context["topic_patterns"]
+            candidates = dict.fromkeys([topic for topic, _ in summary["top_topics"]] + changed_topics)
+            order = {topic: i for i, topic in enumerate(topic_patterns)}
+            ranked = sorted(candidates, key=lambda topic: (-topic_patterns[topic]["count"], order[topic]))[:3]
+            summary["top_topics"] = [[topic, topic_patterns[topic]["count"]] for topic in ranked]
+        
+        self._render_summary(context)
+    
+    def _render_summary(self, context: Dict[str, Any]) -> Dict[str, Any]:
+        """Refresh the cheap summary fields and its text"""
+        summary = context["summary"]
+        progress = context["therapeutic_progress"]
+        summary["sessions_count"] = progress["sessions_count"]
+        summary["recurring_issues"] = list(progress["recurring_issues"])
+        summary["recent_emotions"] = context["emotional_history"].recent_emotions(3)
+        summary["has_improvement"] = bool(progress["improvement_indicators"])
+        summary["has_disclosed_haram"] = bool(context["relationship_context"]["has_disclosed_haram"])
         
         # Build contextual enhancement
         enhancement = []
         
         # User background
-        sessions_count = context["therapeutic_progress"]["sessions_count"]
-        if sessions_count > 1:
-            enhancement.append(f"This user has had {sessions_count} sessions with you.")
+        if summary["sessions_count"] > 1:
+            enhancement.append(f"This user has had {summary['sessions_count']} sessions with you.")
         
         # Recurring issues
-        recurring_issues = context["therapeutic_progress"]["recurring_issues"]
-        if recurring_issues:
-            enhancement.append(f"Recurring emotional patterns: {', '.join(recurring_issues)}")
+        if summary["recurring_issues"]:
+            enhancement.append(f"Recurring emotional patterns: {', '.join(summary['recurring_issues'])}")
         
         # Recent emotional trend
-        recent_emotions = [e["emotion"] for e in context["emotional_history"][-3:]]
-        if recent_emotions:
-            enhancement.append(f"Recent emotional states: {' → '.join(recent_emotions)}")
+        if summary["recent_emotions"]:
+            enhancement.append(f"Recent emotional states: {' → '.join(summary['recent_emotions'])}")
         
         # Main topics of concern
-        top_topics = sorted(context["topic_patterns"].items(), 
-                          key=lambda x: x[1]["count"], reverse=True)[:3]
-        if top_topics:
-            topic_names = [topic[0] for topic in top_topics]
+        if summary["top_topics"]:
+            topic_names = [topic for topic, _ in summary["top_topics"]]
             enhancement.append(f"Main areas of concern: {', '.join(topic_names)}")
         
         # Progress indicators
-        if context["therapeutic_progress"]["improvement_indicators"]:
+        if summary["has_improvement"]:
             enhancement.append("User has shown signs of improvement in recent sessions.")
         
         # Relationship context
-        if context["relationship_context"]["has_disclosed_haram"]:
+        if summary["has_disclosed_haram"]:
             enhancement.append("User has previously discussed haram relationship issues.")
         
-        return "\n".join(enhancement) if enhancement else "New user with no prior context."
+        summary["text"] = "\n".join(enhancement) if enhancement else "New user with no prior context."
+        return summary
     
     def should_vary_response(self, user_id: str, emotion: str, response_type: str) -> bool:
         """Determine if response should be varied based on history"""
@@ -320,8 +677,15 @@ class AdvancedContextManager:
     
     def track_response_usage(self, user_id: str, emotion: str, response_type: str):
         """Track response usage for variation"""
-        context = self.load_user_context(user_id)
-        
+        self._record(user_id, {
+            "type": "response_usage",
+            "ts": time.time(),
+            "emotion": emotion,
+            "response_type": response_type
+        })
+    
+    def _apply_response_usage(self, context: Dict[str, Any], emotion: str, response_type: str, now: float):
+        """Record one use of a response type in a loaded context"""
         if "response_patterns" not in context:
             context["response_patterns"] = {}
         
@@ -330,9 +694,13 @@ class AdvancedContextManager:
             context["response_patterns"][key] = {"count": 0, "last_used": 0}
         
         context["response_patterns"][key]["count"] += 1
-        context["response_patterns"][key]["last_used"] = time.time()
-        
-        self.save_user_context(user_id, context)
+        context["response_patterns"][key]["last_used"] = now
 
 # Global instance
-context_manager = AdvancedContextManager()
+context_manager = AdvancedContextManager(
+    flush_interval=float(os.getenv("CONTEXT_FLUSH_INTERVAL", "5")),
+    session_ttl=float(os.getenv("CONTEXT_SESSION_TTL", "1800")),
+    max_sessions=int(os.getenv("CONTEXT_MAX_SESSIONS", "10000")),
+    event_log=ContextEventLog(os.getenv("CONTEXT_EVENT_LOG_DIR")) if os.getenv("CONTEXT_EVENT_LOG_DIR") else None,
+    compact_threshold=int(os.getenv("CONTEXT_COMPACT_THRESHOLD", "20"))
+)
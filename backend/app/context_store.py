@@ -0,0 +1,549 @@
+import os
+import json
+import asyncio
+import hashlib
+import itertools
+import sqlite3
+import time
+import logging
+import threading
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote
+
+import aiofiles
+import aiofiles.os
+
+from app.compact_history import encode_history, encode_history_records, inflate_histories
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ContextMutator = Callable[[Dict[str, Any]], None]
+
+# Bumped when the stored context layout changes; files without the field
+# are legacy (pretty-printed, version 1) and are rewritten on first read.
+# Version 3 stores histories in columnar form (see compact_history)
+CONTEXT_SCHEMA_VERSION = 3
+
+# Distinguishes temp files of concurrent writers within one process
+_temp_counter = itertools.count()
+
+# --- SHARDED LAYOUT --- #
+# Files live at <data_dir>/<h0h1>/<h2h3>/<encoded id><suffix>, where the
+# shard names are the first hex digits of sha1(user_id): 65536 directories
+# keep each one small even with millions of users
+SHARD_LEVELS = 2
+SAFE_ID_CHARS = frozenset("abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789-_")
+# Leaves room for suffixes and temp-file decorations within NAME_MAX (255)
+MAX_ENCODED_ID_LENGTH = 200
+
+
+def encode_user_id(user_id: str) -> str:
+    """Reversible, path-safe file name for an arbitrary user id"""
+    if not user_id:
+        raise ValueError("Empty user id")
+    encoded = "".join(
+        ch if ch in SAFE_ID_CHARS else "".join(f"%{b:02X}" for b in ch.encode("utf-8"))
+        for ch in user_id
+    )
+    if len(encoded) > MAX_ENCODED_ID_LENGTH:
+        raise ValueError(f"User id too long to store ({len(user_id)} characters)")
+    return encoded
+
+
+def decode_user_id(name: str) -> str:
+    return unquote(name, errors="strict")
+
+
+def shard_path(data_dir: Path, user_id: str, suffix: str) -> Path:
+    digest = hashlib.sha1(user_id.encode("utf-8")).hexdigest()
+    shards = [digest[2 * i:2 * i + 2] for i in range(SHARD_LEVELS)]
+    return data_dir.joinpath(*shards, encode_user_id(user_id) + suffix)
+
+
+def legacy_flat_path(data_dir: Path, user_id: str, suffix: str) -> Optional[Path]:
+    """Pre-sharding location of a user's file, if the id could have been one"""
+    if not user_id or user_id.startswith(".") or any(sep in user_id for sep in ("/", "\\", "\0")):
+        return None
+    return data_dir / f"{user_id}{suffix}"
+
+
+def move_without_clobber(source: Path, target: Path) -> str:
+    """Move a flat-layout file into its shard without overwriting newer data.
+
+    Returns "moved", "superseded" (the target already existed, so the stale
+    source was removed) or "missing".
+    """
+    target.parent.mkdir(parents=True, exist_ok=True)
+    try:
+        # link() fails if the target exists, unlike rename()
+        os.link(source, target)
+    except FileExistsError:
+        source.unlink(missing_ok=True)
+        return "superseded"
+    except FileNotFoundError:
+        return "missing"
+    source.unlink(missing_ok=True)
+    return "moved"
+
+
+def migrate_context(context: Dict[str, Any]) -> bool:
+    """Upgrade a loaded context in place; return True if it changed"""
+    version = context.get("schema_version", 1)
+    if version == CONTEXT_SCHEMA_VERSION:
+        return False
+    if version > CONTEXT_SCHEMA_VERSION:
+        logger.warning(f"User context has newer schema version {version}")
+        return False
+    # 1 -> 2 only changes the encoding; 2 -> 3 only the history layout,
+    # which loads_context already converted
+    context["schema_version"] = CONTEXT_SCHEMA_VERSION
+    return True
+
+
+def dumps_context(context: Dict[str, Any], pretty: bool = False) -> bytes:
+    """Serialize a context compactly (orjson when installed)"""
+    if context.get("schema_version") != CONTEXT_SCHEMA_VERSION:
+        context = {**context, "schema_version": CONTEXT_SCHEMA_VERSION}
+    if pretty:
+        # Readable files keep histories as lists of records
+        return json.dumps(context, ensure_ascii=False, indent=2, default=encode_history_records).encode("utf-8")
+    if ORJSON_AVAILABLE:
+        return orjson.dumps(context, default=encode_history)
+    return json.dumps(context, ensure_ascii=False, separators=(",", ":"), default=encode_history).encode("utf-8")
+
+
+def loads_context(data) -> Dict[str, Any]:
+    """Parse any context encoding written by dumps_context or legacy json.dump"""
+    context = orjson.loads(data) if ORJSON_AVAILABLE else json.loads(data)
+    return inflate_histories(context)
+
+
+class JsonFileContextStore:
+    """One JSON file per user in a sharded directory tree under data_dir.
+
+    Files are written compactly to a temporary file and renamed over the
+    target, so a crash mid-write leaves the previous version intact. Files
+    still in the old flat layout are moved into their shard when first
+    read (or by scripts/migrate_context_layout.py).
+    """
+
+    def __init__(self, data_dir: str = "data/user_context", pretty: bool = False, fsync: bool = False):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self.pretty = pretty
+        # Also survive power loss, at the cost of one fsync per write
+        self.fsync = fsync
+        # Shard directories known to exist, to skip repeated mkdir calls
+        self._shard_dirs = set()
+
+    def get_user_file_path(self, user_id: str) -> Path:
+        """Get file path for user's context data"""
+        return shard_path(self.data_dir, user_id, ".json")
+
+    def _ensure_parent(self, file_path: Path):
+        parent = file_path.parent
+        if parent not in self._shard_dirs:
+            parent.mkdir(parents=True, exist_ok=True)
+            self._shard_dirs.add(parent)
+
+    def iter_user_files(self):
+        """Yield (user_id, path) for every stored context, sharded or flat"""
+        for file_path in self.data_dir.glob("/".join(["*"] * SHARD_LEVELS) + "/*.json"):
+            if file_path.name.startswith("."):
+                continue
+            try:
+                yield decode_user_id(file_path.stem), file_path
+            except UnicodeDecodeError:
+                logger.warning(f"Skipping undecodable context file {file_path}")
+        # Flat files not migrated yet are named by the raw id
+        for file_path in self.data_dir.glob("*.json"):
+            if not file_path.name.startswith("."):
+                yield file_path.stem, file_path
+
+    def migrate_legacy_file(self, legacy_path: Path, user_id: Optional[str] = None) -> str:
+        """Move one flat-layout file into its shard (see move_without_clobber)"""
+        user_id = user_id if user_id is not None else legacy_path.stem
+        return move_without_clobber(legacy_path, self.get_user_file_path(user_id))
+
+    def _load_legacy(self, user_id: str) -> Optional[Dict[str, Any]]:
+        legacy_path = legacy_flat_path(self.data_dir, user_id, ".json")
+        if legacy_path is None or not legacy_path.exists():
+            return None
+        if self.migrate_legacy_file(legacy_path, user_id) == "missing":
+            return None
+        return self.load(user_id)
+
+    def _temp_path(self, file_path: Path) -> Path:
+        # Unique per writer so concurrent saves never share a temp file
+        return file_path.with_name(f".{file_path.name}.{os.getpid()}.{next(_temp_counter)}.tmp")
+
+    def _decode(self, user_id: str, data: bytes) -> Optional[Dict[str, Any]]:
+        """Parse file contents; unreadable files are set aside, not overwritten"""
+        try:
+            return loads_context(data)
+        except ValueError as e:
+            file_path = self.get_user_file_path(user_id)
+            logger.error(f"Corrupt user context for {user_id}, moving it aside: {e}")
+            try:
+                os.replace(file_path, file_path.with_suffix(".json.corrupt"))
+            except OSError:
+                pass
+            return None
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stored context, or None if the user has none"""
+        try:
+            with open(self.get_user_file_path(user_id), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return self._load_legacy(user_id)
+        except Exception as e:
+            logger.error(f"Error loading user context: {e}")
+            return None
+        context = self._decode(user_id, data)
+        if context is not None and migrate_context(context):
+            self.save(user_id, context)
+        return context
+
+    def save(self, user_id: str, context: Dict[str, Any]):
+        try:
+            file_path = self.get_user_file_path(user_id)
+        except ValueError as e:
+            logger.error(f"Error saving user context: {e}")
+            return
+        tmp_path = self._temp_path(file_path)
+        try:
+            self._ensure_parent(file_path)
+            with open(tmp_path, 'wb') as f:
+                f.write(dumps_context(context, self.pretty))
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Error saving user context: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    def update(self, user_id: str, mutate: ContextMutator, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Load, mutate in place and save a user's context"""
+        context = self.load(user_id) or default_factory()
+        mutate(context)
+        self.save(user_id, context)
+        return context
+
+    async def aload(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Async load; file reads run off the event loop"""
+        try:
+            async with aiofiles.open(self.get_user_file_path(user_id), 'rb') as f:
+                data = await f.read()
+        except FileNotFoundError:
+            return await asyncio.to_thread(self._load_legacy, user_id)
+        except Exception as e:
+            logger.error(f"Error loading user context: {e}")
+            return None
+        context = self._decode(user_id, data)
+        if context is not None and migrate_context(context):
+            await self.asave(user_id, context)
+        return context
+
+    async def asave(self, user_id: str, context: Dict[str, Any]):
+        """Async save; file writes run off the event loop"""
+        try:
+            file_path = self.get_user_file_path(user_id)
+        except ValueError as e:
+            logger.error(f"Error saving user context: {e}")
+            return
+        tmp_path = self._temp_path(file_path)
+        try:
+            self._ensure_parent(file_path)
+            data = dumps_context(context, self.pretty)
+            async with aiofiles.open(tmp_path, 'wb') as f:
+                await f.write(data)
+                if self.fsync:
+                    await f.flush()
+                    await asyncio.to_thread(os.fsync, f.fileno())
+            await aiofiles.os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Error saving user context: {e}")
+            try:
+                tmp_path.unlink(missing_ok=True)
+            except OSError:
+                pass
+
+    async def aupdate(self, user_id: str, mutate: ContextMutator, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        context = await self.aload(user_id) or default_factory()
+        mutate(context)
+        await self.asave(user_id, context)
+        return context
+
+    def active_users(self, since: float) -> List[str]:
+        """User ids seen at or after `since` (opens every file)"""
+        users = []
+        for user_id, _ in list(self.iter_user_files()):
+            context = self.load(user_id)
+            if context and context.get("last_seen", 0) >= since:
+                users.append(user_id)
+        return users
+
+    def count(self) -> int:
+        return sum(1 for _ in self.iter_user_files())
+
+
+class SQLiteContextStore:
+    """User contexts as rows of a WAL-mode SQLite database.
+
+    last_seen and sessions_count are kept in indexed columns so user scans
+    do not need to parse the context blobs.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS user_context (
+            user_id TEXT PRIMARY KEY,
+            last_seen REAL NOT NULL DEFAULT 0,
+            sessions_count INTEGER NOT NULL DEFAULT 0,
+            context TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_user_context_last_seen ON user_context(last_seen);
+        CREATE INDEX IF NOT EXISTS idx_user_context_sessions ON user_context(sessions_count);
+        CREATE TABLE IF NOT EXISTS user_context_corrupt (
+            user_id TEXT NOT NULL,
+            found_at REAL NOT NULL,
+            context TEXT NOT NULL
+        );
+    """
+
+    def __init__(self, db_path: str = "data/user_context.db"):
+        self.db_path = Path(db_path)
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        # sqlite3 connections must not be shared across threads
+        self._local = threading.local()
+        self._connect().executescript(self.SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit mode; transactions are opened explicitly
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _columns(context: Dict[str, Any]):
+        return (
+            context.get("last_seen", 0),
+            context.get("therapeutic_progress", {}).get("sessions_count", 0),
+            dumps_context(context).decode("utf-8"),
+        )
+
+    def _decode(self, conn: sqlite3.Connection, user_id: str, data: str) -> Optional[Dict[str, Any]]:
+        """Parse a context row; unreadable rows are copied aside before the
+        next save replaces them"""
+        try:
+            return loads_context(data)
+        except ValueError as e:
+            logger.error(f"Corrupt user context for {user_id}, moving it aside: {e}")
+            try:
+                conn.execute(
+                    "INSERT INTO user_context_corrupt (user_id, found_at, context) VALUES (?, ?, ?)",
+                    (user_id, time.time(), data),
+                )
+            except Exception as e:
+                logger.error(f"Error setting aside corrupt user context: {e}")
+            return None
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return the stored context, or None if the user has none"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT context FROM user_context WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        except Exception as e:
+            logger.error(f"Error loading user context: {e}")
+            return None
+        if not row:
+            return None
+        context = self._decode(conn, user_id, row[0])
+        if context is not None and migrate_context(context):
+            self.save(user_id, context)
+        return context
+
+    def save(self, user_id: str, context: Dict[str, Any]):
+        try:
+            self._connect().execute(
+                "INSERT OR REPLACE INTO user_context (user_id, last_seen, sessions_count, context) VALUES (?, ?, ?, ?)",
+                (user_id, *self._columns(context)),
+            )
+        except Exception as e:
+            logger.error(f"Error saving user context: {e}")
+
+    def update(self, user_id: str, mutate: ContextMutator, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        """Read-modify-write a user's context inside one write transaction"""
+        conn = self._connect()
+        # IMMEDIATE takes the write lock up front so concurrent updates serialize
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT context FROM user_context WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            context = self._decode(conn, user_id, row[0]) if row else None
+            if context is None:
+                context = default_factory()
+            mutate(context)
+            conn.execute(
+                "INSERT OR REPLACE INTO user_context (user_id, last_seen, sessions_count, context) VALUES (?, ?, ?, ?)",
+                (user_id, *self._columns(context)),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return context
+
+    # sqlite3 has no async driver here; run the blocking calls in worker threads
+    async def aload(self, user_id: str) -> Optional[Dict[str, Any]]:
+        return await asyncio.to_thread(self.load, user_id)
+
+    async def asave(self, user_id: str, context: Dict[str, Any]):
+        await asyncio.to_thread(self.save, user_id, context)
+
+    async def aupdate(self, user_id: str, mutate: ContextMutator, default_factory: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+        return await asyncio.to_thread(self.update, user_id, mutate, default_factory)
+
+    def active_users(self, since: float) -> List[str]:
+        """User ids seen at or after `since` (index range scan)"""
+        rows = self._connect().execute(
+            "SELECT user_id FROM user_context WHERE last_seen >= ?", (since,)
+        ).fetchall()
+        return [row[0] for row in rows]
+
+    def count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM user_context").fetchone()[0]
+
+
+class ContextEventLog:
+    """Append-only per-user JSONL log of context update events.
+
+    Each event carries a per-user sequence number; snapshots record the
+    last sequence they include, and truncate() drops the covered prefix
+    once a snapshot has been written (compaction).
+    """
+
+    def __init__(self, data_dir: str = "data/user_events"):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+        self._shard_dirs = set()
+
+    def get_user_file_path(self, user_id: str) -> Path:
+        return shard_path(self.data_dir, user_id, ".jsonl")
+
+    def _writable_path(self, user_id: str) -> Path:
+        file_path = self.get_user_file_path(user_id)
+        if file_path.parent not in self._shard_dirs:
+            file_path.parent.mkdir(parents=True, exist_ok=True)
+            self._shard_dirs.add(file_path.parent)
+        return file_path
+
+    def append(self, user_id: str, event: Dict[str, Any]):
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        try:
+            with open(self._writable_path(user_id), 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"Error appending context event: {e}")
+
+    async def aappend(self, user_id: str, event: Dict[str, Any]):
+        line = json.dumps(event, ensure_ascii=False, separators=(",", ":"))
+        try:
+            async with aiofiles.open(self._writable_path(user_id), 'a', encoding='utf-8') as f:
+                await f.write(line + "\n")
+        except Exception as e:
+            logger.error(f"Error appending context event: {e}")
+
+    def read(self, user_id: str, after_seq: int = 0) -> List[Dict[str, Any]]:
+        """Events with seq > after_seq, in order; a torn last line is skipped"""
+        try:
+            with open(self.get_user_file_path(user_id), 'r', encoding='utf-8') as f:
+                return self._parse(user_id, f.read(), after_seq)
+        except FileNotFoundError:
+            if self._migrate_legacy(user_id):
+                return self.read(user_id, after_seq)
+            return []
+        except Exception as e:
+            logger.error(f"Error reading context events: {e}")
+            return []
+
+    def _migrate_legacy(self, user_id: str) -> bool:
+        legacy_path = legacy_flat_path(self.data_dir, user_id, ".jsonl")
+        if legacy_path is None or not legacy_path.exists():
+            return False
+        return move_without_clobber(legacy_path, self.get_user_file_path(user_id)) != "missing"
+
+    async def aread(self, user_id: str, after_seq: int = 0) -> List[Dict[str, Any]]:
+        try:
+            async with aiofiles.open(self.get_user_file_path(user_id), 'r', encoding='utf-8') as f:
+                return self._parse(user_id, await f.read(), after_seq)
+        except FileNotFoundError:
+            if await asyncio.to_thread(self._migrate_legacy, user_id):
+                return await self.aread(user_id, after_seq)
+            return []
+        except Exception as e:
+            logger.error(f"Error reading context events: {e}")
+            return []
+
+    @staticmethod
+    def _parse(user_id: str, data: str, after_seq: int) -> List[Dict[str, Any]]:
+        events = []
+        for line in data.splitlines():
+            try:
+                event = json.loads(line)
+            except ValueError:
+                logger.warning(f"Skipping malformed context event for {user_id}")
+                continue
+            if event.get("seq", 0) > after_seq:
+                events.append(event)
+        # Async appends may land slightly out of order
+        events.sort(key=lambda event: event["seq"])
+        return events
+
+    def truncate(self, user_id: str, upto_seq: int):
+        """Drop events with seq <= upto_seq, now covered by a snapshot"""
+        remaining = self.read(user_id, after_seq=upto_seq)
+        try:
+            file_path = self.get_user_file_path(user_id)
+            if not remaining:
+                file_path.unlink(missing_ok=True)
+                return
+            tmp_path = file_path.with_suffix(".jsonl.tmp")
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                for event in remaining:
+                    f.write(json.dumps(event, ensure_ascii=False, separators=(",", ":")) + "\n")
+            os.replace(tmp_path, file_path)
+        except Exception as e:
+            logger.error(f"Error compacting context events: {e}")
+
+
+def create_context_store(backend: Optional[str] = None, data_dir: str = "data/user_context"):
+    """Build the context store selected by CONTEXT_STORE (json or sqlite)"""
+    backend = (backend or os.getenv("CONTEXT_STORE", "json")).lower()
+    if backend == "sqlite":
+        return SQLiteContextStore(os.getenv("CONTEXT_DB_PATH", f"{data_dir}.db"))
+    if backend != "json":
+        logger.warning(f"Unknown CONTEXT_STORE '{backend}', using JSON files")
+    return JsonFileContextStore(
+        data_dir,
+        pretty=os.getenv("CONTEXT_PRETTY_JSON", "false").lower() == "true",
+        fsync=os.getenv("CONTEXT_FSYNC", "false").lower() == "true"
+    )
@@ -0,0 +1,245 @@
+import os
+import math
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Lock stripes for the bucket tables, as in the rate limiter
+DEFAULT_STRIPES = 64
+
+# Hard cap on tracked buckets per scope; past it the least recently used go
+DEFAULT_MAX_KEYS = 100000
+
+COST_UNITS = ("tokens", "calls")
+
+
+class LLMCostMeter:
+    """LLM calls and tokens spent while handling one request"""
+
+    __slots__ = ("calls", "prompt_tokens", "completion_tokens", "lock", "parent", "on_late")
+
+    def __init__(self, parent: Optional["LLMCostMeter"] = None):
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        # Pipeline nodes may call the model from worker threads
+        self.lock = threading.Lock()
+        # Meter of the enclosing block, which is charged as well
+        self.parent = parent
+        # Set by settle(): receives cost that arrives after the meter was read
+        self.on_late: Optional[Callable[["LLMCostMeter"], None]] = None
+
+    def add(self, prompt_tokens: int, completion_tokens: int):
+        with self.lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.completion_tokens += completion_tokens
+            on_late = self.on_late
+        if on_late is not None:
+            late = LLMCostMeter()
+            late.add(prompt_tokens, completion_tokens)
+            on_late(late)
+        if self.parent is not None:
+            self.parent.add(prompt_tokens, completion_tokens)
+
+    def settle(self, on_late: Callable[["LLMCostMeter"], None]) -> "LLMCostMeter":
+        """Totals so far; calls still in flight (abandoned or speculative)
+        that finish later are passed to on_late one by one instead"""
+        spent = LLMCostMeter()
+        with self.lock:
+            spent.calls = self.calls
+            spent.prompt_tokens = self.prompt_tokens
+            spent.completion_tokens = self.completion_tokens
+            self.on_late = on_late
+        return spent
+
+    @property
+    def tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    def cost(self, unit: str) -> int:
+        return self.calls if unit == "calls" else self.tokens
+
+
+# The meter of the request being handled. Context copies made for worker
+# threads share the meter object, so calls made there are counted too
+_current_meter: ContextVar[Optional[LLMCostMeter]] = ContextVar("llm_cost_meter", default=None)
+
+
+def current_meter() -> Optional[LLMCostMeter]:
+    return _current_meter.get()
+
+
+@contextmanager
+def metered_request(meter: Optional[LLMCostMeter] = None):
+    """Collect the LLM cost of everything the block runs; a nested block's
+    cost also counts toward the enclosing one"""
+    if meter is None:
+        meter = LLMCostMeter(parent=_current_meter.get())
+    token = _current_meter.set(meter)
+    try:
+        yield meter
+    finally:
+        _current_meter.reset(token)
+
+
+def record_llm_cost(prompt_tokens: int, completion_tokens: int):
+    """Charge one LLM call to the current request, if one is being metered"""
+    meter = _current_meter.get()
+    if meter is not None:
+        meter.add(prompt_tokens, completion_tokens)
+
+
+class CostQuota:
+    """Token-bucket quotas on LLM spend, per user_id and per client IP.
+
+    Each bucket holds up to `capacity` cost units and refills at a steady
+    rate. A request is admitted while both of its buckets are positive,
+    and is charged its actual LLM cost once the pipeline has run, so a
+    bucket can go into debt. admit() refuses requests while either bucket
+    is in debt; the chat endpoint still answers those, from curated
+    content without the LLM, so they cost nothing until the bucket refills.
+
+    Buckets live in process memory and are not shared between workers:
+    with N workers a client can spend up to N times the configured limits.
+    """
+
+    def __init__(
+        self,
+        unit: str = "tokens",
+        user_capacity: float = 30000,
+        user_per_hour: float = 60000,
+        ip_capacity: float = 120000,
+        ip_per_hour: float = 240000,
+        stripes: int = DEFAULT_STRIPES,
+        max_keys: int = DEFAULT_MAX_KEYS
+    ):
+        if unit not in COST_UNITS:
+            raise ValueError(f"Unknown quota unit '{unit}', expected one of {COST_UNITS}")
+        self.unit = unit
+        # scope -> (capacity, refill per second)
+        self.limits = {
+            "user": (float(user_capacity), user_per_hour / 3600.0),
+            "ip": (float(ip_capacity), ip_per_hour / 3600.0),
+        }
+        self.max_keys = max_keys
+        self._stripe_capacity = max(1, -(-max_keys // stripes))
+        # Buckets, striped by (scope, key): (lock, {(scope, key): [level, updated]}),
+        # in least recently used order
+        self._stripes: List[Tuple[threading.Lock, "OrderedDict[Tuple[str, str], List[float]]"]] = [
+            (threading.Lock(), OrderedDict()) for _ in range(stripes)
+        ]
+        self._counters_lock = threading.Lock()
+        self.admitted = 0
+        self.over_quota = 0
+        self.charged = 0
+
+    def _level(self, scope: str, key: str, now: float, cost: float = 0.0) -> float:
+        """Refill a bucket to now, subtract cost and return its level"""
+        capacity, rate = self.limits[scope]
+        lock, buckets = self._stripes[hash((scope, key)) % len(self._stripes)]
+        with lock:
+            bucket = buckets.get((scope, key))
+            if bucket is None:
+                if not cost:
+                    return capacity
+                if len(buckets) >= self._stripe_capacity:
+                    buckets.popitem(last=False)
+                bucket = buckets[(scope, key)] = [capacity, now]
+            else:
+                buckets.move_to_end((scope, key))
+                bucket[0] = min(capacity, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            bucket[0] -= cost
+            level = bucket[0]
+
+            # A bucket that has refilled completely is the same as none;
+            # drop the least recently used one if so, keeping the table to
+            # clients with recent spend
+            if buckets:
+                oldest_key, oldest = next(iter(buckets.items()))
+                oldest_capacity, oldest_rate = self.limits[oldest_key[0]]
+                if oldest[0] + (now - oldest[1]) * oldest_rate >= oldest_capacity:
+                    del buckets[oldest_key]
+            return level
+
+    def _retry_after(self, scope: str, level: float) -> int:
+        rate = self.limits[scope][1]
+        if rate <= 0:
+            return 3600
+        return max(1, math.ceil((1.0 - level) / rate))
+
+    def admit(self, user_id: Optional[str], client_ip: Optional[str],
+              now: Optional[float] = None) -> Tuple[bool, int]:
+        """Whether a request may start: (allowed, retry_after seconds)"""
+        if now is None:
+            now = time.time()
+        retry_after = 0
+        for scope, key in (("user", user_id), ("ip", client_ip)):
+            if not key:
+                continue
+            level = self._level(scope, key, now)
+            if level <= 0:
+                retry_after = max(retry_after, self._retry_after(scope, level))
+        with self._counters_lock:
+            if retry_after:
+                self.over_quota += 1
+            else:
+                self.admitted += 1
+        return retry_after == 0, retry_after
+
+    def charge(self, user_id: Optional[str], client_ip: Optional[str], meter: LLMCostMeter,
+               now: Optional[float] = None) -> float:
+        """Charge a finished request its LLM cost; return the user's remaining quota.
+
+        Calls the request left running (abandoned at its deadline, or a
+        discarded speculation) are charged as they finish.
+        """
+        if now is None:
+            now = time.time()
+        cost = meter.settle(lambda late: self.charge(user_id, client_ip, late)).cost(self.unit)
+        remaining = self.limits["user"][0]
+        if user_id:
+            remaining = self._level("user", user_id, now, cost)
+        if client_ip:
+            self._level("ip", client_ip, now, cost)
+        with self._counters_lock:
+            self.charged += cost
+        return remaining
+
+    def remaining(self, user_id: str, now: Optional[float] = None) -> float:
+        if now is None:
+            now = time.time()
+        return self._level("user", user_id, now)
+
+    def get_stats(self) -> Dict[str, Any]:
+        buckets = 0
+        for lock, table in self._stripes:
+            with lock:
+                buckets += len(table)
+        with self._counters_lock:
+            return {
+                "unit": self.unit,
+                "user_capacity": self.limits["user"][0],
+                "user_per_hour": round(self.limits["user"][1] * 3600),
+                "ip_capacity": self.limits["ip"][0],
+                "ip_per_hour": round(self.limits["ip"][1] * 3600),
+                "buckets": buckets,
+                "admitted": self.admitted,
+                "over_quota": self.over_quota,
+                f"charged_{self.unit}": self.charged,
+            }
+
+
+# Global instance
+cost_quota = CostQuota(
+    unit=os.getenv("QUOTA_UNIT", "tokens"),
+    user_capacity=float(os.getenv("QUOTA_USER_CAPACITY", "30000")),
+    user_per_hour=float(os.getenv("QUOTA_USER_PER_HOUR", "60000")),
+    ip_capacity=float(os.getenv("QUOTA_IP_CAPACITY", "120000")),
+    ip_per_hour=float(os.getenv("QUOTA_IP_PER_HOUR", "240000")),
+    max_keys=int(os.getenv("QUOTA_MAX_KEYS", str(DEFAULT_MAX_KEYS)))
+)
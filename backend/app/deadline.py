@@ -0,0 +1,175 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import weakref
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Awaitable, Callable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# Default end-to-end budget for a /chat request
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "25"))
+
+# How often a waiting request checks whether its client is still there
+DISCONNECT_POLL_SECONDS = 0.25
+
+# Past the deadline by this much, a request still running is cancelled
+# outright; nodes normally notice expiry themselves and answer early
+DEADLINE_GRACE_SECONDS = 2.0
+
+
+class DeadlineExceeded(TimeoutError):
+    pass
+
+
+class RequestCancelled(BaseException):
+    """The request was abandoned (client gone, or hard deadline).
+
+    A BaseException, like asyncio.CancelledError, so the pipeline's
+    `except Exception` fallbacks let it through instead of answering a
+    client that is no longer there.
+    """
+
+
+# Runs calls that a deadline may abandon; an abandoned call keeps its
+# worker only until its own timeout (set from the same deadline) fires
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("DEADLINE_WORKERS", "32")),
+                thread_name_prefix="deadline-call"
+            )
+        return _executor
+
+
+class Deadline:
+    """Point in time a request (or one stage of it) must finish by.
+
+    child() derives a sub-budget that never outlives its parent and
+    shares its cancellation, so cancelling the request stops every stage.
+    A child with its own cancel scope can also be cancelled alone, e.g. a
+    speculative stage that turned out not to be needed.
+    run() executes a blocking call and gives up on it as soon as the
+    deadline passes or the request is cancelled.
+    """
+
+    def __init__(self, timeout: float, parent: Optional["Deadline"] = None, name: str = "request",
+                 cancel_scope: bool = False):
+        self.name = name
+        self.expires_at = time.monotonic() + timeout
+        if parent is not None:
+            self.expires_at = min(self.expires_at, parent.expires_at)
+        if parent is not None and not cancel_scope:
+            self._scope = parent._scope
+            return
+
+        self._scope = self
+        self._lock = threading.Lock()
+        self._waiters: Set[threading.Event] = set()
+        self._cancel_reason: Optional[str] = None
+        # Nested scopes, cancelled along with this one
+        self._children: "weakref.WeakSet[Deadline]" = weakref.WeakSet()
+        if parent is not None:
+            outer = parent._scope
+            with outer._lock:
+                outer._children.add(self)
+                self._cancel_reason = outer._cancel_reason
+
+    def child(self, name: str, budget: float, cancel_scope: bool = False) -> "Deadline":
+        return Deadline(budget, parent=self, name=name, cancel_scope=cancel_scope)
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    @property
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    @property
+    def cancel_reason(self) -> Optional[str]:
+        return self._scope._cancel_reason
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel this deadline's scope (the whole request unless it has its
+        own), waking every call waiting on it or on a nested scope"""
+        scope = self._scope
+        with scope._lock:
+            if scope._cancel_reason is not None:
+                return
+            scope._cancel_reason = reason
+            waiters = list(scope._waiters)
+            children = list(scope._children)
+        for waiter in waiters:
+            waiter.set()
+        for child in children:
+            child.cancel(reason)
+
+    def check(self, stage: str = ""):
+        """Raise if the request was cancelled or this deadline has passed"""
+        reason = self.cancel_reason
+        if reason is not None:
+            raise RequestCancelled(reason)
+        if self.expired:
+            raise DeadlineExceeded(f"{stage or self.name} exceeded its deadline")
+
+    def run(self, fn: Callable[..., Any], *args: Any, stage: str = "", **kwargs: Any) -> Any:
+        """Call fn on a worker thread and wait at most until the deadline"""
+        self.check(stage)
+        future = _get_executor().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+        done = threading.Event()
+        future.add_done_callback(lambda _: done.set())
+        scope = self._scope
+        with scope._lock:
+            scope._waiters.add(done)
+        try:
+            # Re-check after registering, so a cancel in between is not missed
+            if scope._cancel_reason is None:
+                done.wait(self.remaining())
+        finally:
+            with scope._lock:
+                scope._waiters.discard(done)
+
+        if future.done() and scope._cancel_reason is None:
+            return future.result()
+        # Not started yet: drop it from the queue. Running: abandon it
+        future.cancel()
+        self.check(stage)
+        raise DeadlineExceeded(f"{stage or self.name} exceeded its deadline")
+
+
+async def run_until_disconnected(
+    deadline: Deadline,
+    is_disconnected: Callable[[], Awaitable[bool]],
+    fn: Callable[..., Any],
+    *args: Any,
+    run_in_thread: Callable[..., Awaitable[Any]] = asyncio.to_thread,
+    poll_interval: float = DISCONNECT_POLL_SECONDS
+) -> Any:
+    """Run a blocking pipeline in a thread while watching the client.
+
+    The deadline is cancelled when the client disconnects, or when the
+    pipeline is still running well past its deadline; the pipeline then
+    stops at its next deadline-aware call with RequestCancelled.
+    """
+    task = asyncio.ensure_future(run_in_thread(fn, *args))
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=poll_interval)
+        if done:
+            return task.result()
+        if deadline.cancel_reason is not None:
+            continue
+        if await is_disconnected():
+            logger.info("Client disconnected, cancelling request")
+            deadline.cancel("client_disconnected")
+        elif deadline.expires_at + DEADLINE_GRACE_SECONDS < time.monotonic():
+            logger.warning("Request still running past its deadline, cancelling")
+            deadline.cancel("deadline_exceeded")
@@ -0,0 +1,206 @@
+import os
+import re
+import time
+import random
+import logging
+import threading
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Iterable, List, Optional, Sequence, Union
+
+from app.load_monitor import LoadMonitor, load_monitor as default_load_monitor
+
+logger = logging.getLogger(__name__)
+
+# Time allowed for assembling a degraded reply
+DEGRADED_BUDGET_SECONDS = 0.05
+
+# Recently retrieved RAG excerpts kept per emotion for degraded replies
+EXCERPTS_PER_EMOTION = 8
+EXCERPT_CHARS = 200
+
+# Keyword fallback for emotion detection when the classifier is unavailable;
+# checked in order, so distress outranks positive emotions
+EMOTION_KEYWORDS = {
+    "hopeless": ["hopeless", "give up", "no hope", "worthless", "pointless", "no way out"],
+    "anxious": ["anxious", "anxiety", "worried", "worry", "nervous", "panic", "scared", "afraid", "fear", "pareshan"],
+    "sad": ["sad", "cry", "crying", "grief", "grieving", "heartbroken", "depressed", "udaas", "dukhi"],
+    "lonely": ["lonely", "alone", "isolated", "nobody", "no one cares", "akela"],
+    "guilty": ["guilty", "guilt", "ashamed", "shame", "regret", "sinned"],
+    "angry": ["angry", "anger", "furious", "rage", "irritated", "frustrated", "gussa"],
+    "overwhelmed": ["overwhelmed", "too much", "stressed", "stress", "pressure"],
+    "tired": ["tired", "exhausted", "drained", "burnt out", "burned out", "thak gaya", "thak gayi"],
+    "empty": ["empty", "numb", "hollow", "meaningless"],
+    "confused": ["confused", "unsure", "don't know what to do"],
+    "grateful": ["grateful", "thankful", "blessed"],
+    "happy": ["happy", "glad", "excited"],
+    "peaceful": ["peaceful", "calm", "at peace"],
+}
+
+GREETING_TEMPLATES = [
+    "Wa alaikum assalam {name}! It's good to hear from you. How is your heart feeling today?",
+    "Hello {name}, peace be upon you. I'm here for you — what's on your mind?",
+    "Assalamu alaikum {name}. May Allah fill your day with ease. How are you really doing?",
+]
+
+CLOSING_TEMPLATES = [
+    "Take one slow breath with me and remember: Allah does not burden a soul beyond what it can bear (Quran 2:286). I'm here whenever you want to share more.",
+    "Be gentle with yourself today. Even a few minutes of dhikr can soften a heavy heart — and you can tell me more whenever you're ready.",
+    "You don't have to carry this alone. Turn to Allah in a quiet moment, and come back and talk to me whenever you need.",
+]
+
+GENERIC_EXCERPT = "Islamic teachings remind us that Allah is always with those who seek Him. Verily, in the remembrance of Allah do hearts find rest (Quran 13:28)."
+
+
+def format_haram_template(template: Dict[str, Any]) -> str:
+    """Render a curated haram-guidance template as a reply"""
+    reply = template["opening"] + "\n\n" + template["story"] + "\n\nHere are steps to heal:\n\n"
+    for i, technique in enumerate(template["techniques"], 1):
+        reply += f"{i}. {technique}\n\n"
+    dua = template["dua"]
+    return reply + f"{dua['arabic']}\n{dua['transliteration']}\n\"{dua['translation']}\""
+
+
+def _trim_excerpt(text: str) -> str:
+    return text[:EXCERPT_CHARS] + "..." if len(text) > EXCERPT_CHARS else text
+
+
+class DegradedMode:
+    """Replies assembled from curated content when the LLM should not be used.
+
+    Switches on automatically while the LLM circuit breaker is open or the
+    LLM queue is full (DEGRADED_MODE=auto), or can be forced on or off.
+    Replies combine the curated openings, greetings and haram-guidance
+    templates with emotion-matched RAG excerpts remembered from recent
+    retrievals or taken from the local sample documents, so assembling one
+    involves no network calls.
+    """
+
+    def __init__(
+        self,
+        openings: Sequence[str],
+        haram_templates: Sequence[Dict[str, Any]],
+        local_documents: Union[Iterable[Dict[str, Any]], Callable[[], Iterable[Dict[str, Any]]]] = (),
+        mode: str = "auto",
+        load_monitor: Optional[LoadMonitor] = None
+    ):
+        self.openings = list(openings)
+        self.haram_templates = list(haram_templates)
+        self.mode = mode
+        self.load_monitor = load_monitor if load_monitor is not None else default_load_monitor
+
+        self._keywords = [
+            (emotion, re.compile(r"\b(?:" + "|".join(re.escape(word) for word in words) + r")\b"))
+            for emotion, words in EMOTION_KEYWORDS.items()
+        ]
+
+        # emotion -> excerpts: local documents are the floor, recent
+        # retrievals are preferred. A callable is only called when a
+        # degraded reply first needs the floor
+        self._local_documents = local_documents
+        self._local: Optional[Dict[str, List[str]]] = None
+        self._recent: Dict[str, Deque[str]] = {}
+        self._lock = threading.Lock()
+
+        self.served: Dict[str, int] = {}
+        self.max_build_ms = 0.0
+
+    # --- TRIGGER --- #
+    def reason(self) -> Optional[str]:
+        """Why replies should be degraded right now, or None"""
+        if self.mode == "on":
+            return "forced"
+        if self.mode == "off":
+            return None
+        if self.load_monitor.breaker_open():
+            return "llm_breaker_open"
+        if self.load_monitor.llm_saturated():
+            return "llm_queue_full"
+        return None
+
+    def active(self) -> bool:
+        return self.reason() is not None
+
+    # --- LOCAL SIGNALS --- #
+    def detect_emotion(self, text: str) -> str:
+        text = text.lower()
+        for emotion, pattern in self._keywords:
+            if pattern.search(text):
+                return emotion
+        return "neutral"
+
+    def matching_emotions(self, text: str) -> List[str]:
+        """Every emotion whose keywords appear in text, in priority order"""
+        text = text.lower()
+        return [emotion for emotion, pattern in self._keywords if pattern.search(text)]
+
+    def remember_excerpts(self, emotion: str, docs: Iterable[Dict[str, Any]]):
+        """Keep excerpts from a successful retrieval for later degraded replies"""
+        with self._lock:
+            recent = self._recent.get(emotion)
+            if recent is None:
+                recent = self._recent[emotion] = deque(maxlen=EXCERPTS_PER_EMOTION)
+            for doc in docs:
+                excerpt = _trim_excerpt(doc.get("content", ""))
+                if excerpt and excerpt not in recent:
+                    recent.append(excerpt)
+
+    def _local_excerpts(self) -> Dict[str, List[str]]:
+        """Excerpts of the local documents per emotion (lock held)"""
+        if self._local is None:
+            documents = self._local_documents
+            if callable(documents):
+                documents = documents()
+            self._local = {}
+            for doc in documents:
+                for emotion in doc.get("emotion_relevance", []):
+                    self._local.setdefault(emotion, []).append(_trim_excerpt(doc["text"]))
+            self._local_documents = ()
+        return self._local
+
+    def excerpt(self, emotion: str) -> str:
+        with self._lock:
+            recent = list(self._recent.get(emotion, ()))
+            candidates = recent or self._local_excerpts().get(emotion) or []
+        return random.choice(candidates) if candidates else GENERIC_EXCERPT
+
+    # --- REPLIES --- #
+    def respond(self, name: str, emotion: str, reason: str = "forced", haram: bool = False) -> Dict[str, str]:
+        """Assemble a reply; returns response, response_type and degraded_reason"""
+        start = time.perf_counter()
+        if haram and self.haram_templates:
+            reply = format_haram_template(random.choice(self.haram_templates))
+            response_type = "haram_guidance"
+        elif emotion == "greeting":
+            reply = random.choice(GREETING_TEMPLATES).format(name=name)
+            response_type = "greeting"
+        else:
+            opening = random.choice(self.openings).format(name=name, emotion=emotion) if self.openings else f"{name},"
+            reply = f"{opening}\n\n{self.excerpt(emotion)}\n\n{random.choice(CLOSING_TEMPLATES)}"
+            response_type = "template"
+
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        with self._lock:
+            self.served[reason] = self.served.get(reason, 0) + 1
+            self.max_build_ms = max(self.max_build_ms, elapsed_ms)
+        if elapsed_ms > DEGRADED_BUDGET_SECONDS * 1000:
+            logger.warning(f"Degraded reply took {elapsed_ms:.1f}ms (budget {DEGRADED_BUDGET_SECONDS * 1000:.0f}ms)")
+        return {"response": reply, "response_type": response_type, "degraded_reason": reason}
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "mode": self.mode,
+                "active_reason": self.reason(),
+                "served": dict(self.served),
+                "max_build_ms": round(self.max_build_ms, 3),
+                "cached_excerpt_emotions": len(self._recent),
+            }
+
+
+def degraded_mode_setting() -> str:
+    """DEGRADED_MODE: auto (default), on or off"""
+    mode = os.getenv("DEGRADED_MODE", "auto").lower()
+    if mode not in ("auto", "on", "off"):
+        logger.warning(f"Unknown DEGRADED_MODE '{mode}', using auto")
+        return "auto"
+    return mode
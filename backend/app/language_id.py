@@ -0,0 +1,199 @@
+import math
+import struct
+import logging
+import zlib
+from array import array
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Languages the identifier can return, in table row order
+LANGUAGES = ["english", "roman_urdu", "urdu"]
+
+# Number of hashed n-gram buckets per language row
+NUM_BUCKETS = 4096
+
+# Character n-gram orders used as features
+NGRAM_ORDERS = (1, 2, 3)
+
+MODEL_MAGIC = b"QLID"
+MODEL_VERSION = 1
+MODEL_PATH = Path(__file__).parent / "language_id_model.bin"
+
+
+def _is_arabic_script(ch: str) -> bool:
+    """Arabic, Arabic Supplement and presentation forms (covers Urdu script)"""
+    code = ord(ch)
+    return (
+        0x0600 <= code <= 0x06FF
+        or 0x0750 <= code <= 0x077F
+        or 0xFB50 <= code <= 0xFDFF
+        or 0xFE70 <= code <= 0xFEFF
+    )
+
+
+def word_features(word: str, num_buckets: int = NUM_BUCKETS) -> List[int]:
+    """Hash the padded character n-grams of a single word into bucket indices"""
+    features = []
+    padded = f" {word} "
+    length = len(padded)
+    for n in NGRAM_ORDERS:
+        for i in range(length - n + 1):
+            gram = padded[i:i + n]
+            if gram == " ":
+                continue
+            features.append(zlib.crc32(gram.encode("utf-8")) % num_buckets)
+    return features
+
+
+def extract_features(text: str, num_buckets: int = NUM_BUCKETS) -> List[int]:
+    """Hash padded character n-grams of each word into bucket indices"""
+    features = []
+    for word in text.lower().split():
+        features.extend(word_features(word, num_buckets))
+    return features
+
+
+def train_table(samples: Iterable[Tuple[str, str]], num_buckets: int = NUM_BUCKETS,
+                alpha: float = 0.5) -> Tuple[array, array]:
+    """Train a multinomial naive Bayes table from (text, language) samples.
+
+    Returns (log_priors, log_probs) where log_probs is a flat row-major
+    float32 array of shape (len(LANGUAGES), num_buckets).
+    """
+    counts = [[0] * num_buckets for _ in LANGUAGES]
+    doc_counts = [0] * len(LANGUAGES)
+
+    for text, language in samples:
+        row = LANGUAGES.index(language)
+        doc_counts[row] += 1
+        for bucket in extract_features(text, num_buckets):
+            counts[row][bucket] += 1
+
+    total_docs = sum(doc_counts)
+    log_priors = array("f", (math.log((c + 1) / (total_docs + len(LANGUAGES))) for c in doc_counts))
+
+    log_probs = array("f")
+    for row_counts in counts:
+        denominator = sum(row_counts) + alpha * num_buckets
+        log_probs.extend(math.log((c + alpha) / denominator) for c in row_counts)
+
+    return log_priors, log_probs
+
+
+def save_table(path: Path, log_priors: array, log_probs: array, num_buckets: int = NUM_BUCKETS):
+    """Write a trained table as a small binary file"""
+    with open(path, "wb") as f:
+        f.write(MODEL_MAGIC)
+        f.write(struct.pack("<HHI", MODEL_VERSION, len(LANGUAGES), num_buckets))
+        f.write(log_priors.tobytes())
+        f.write(log_probs.tobytes())
+
+
+def load_table(path: Path) -> Tuple[int, array, array]:
+    """Read a table written by save_table"""
+    with open(path, "rb") as f:
+        if f.read(4) != MODEL_MAGIC:
+            raise ValueError(f"{path} is not a language ID model")
+        version, num_languages, num_buckets = struct.unpack("<HHI", f.read(8))
+        if version != MODEL_VERSION or num_languages != len(LANGUAGES):
+            raise ValueError(f"Unsupported language ID model version {version}")
+        log_priors = array("f")
+        log_priors.frombytes(f.read(4 * num_languages))
+        log_probs = array("f")
+        log_probs.frombytes(f.read(4 * num_languages * num_buckets))
+    return num_buckets, log_priors, log_probs
+
+
+class LanguageIdentifier:
+    """Character n-gram naive Bayes language identifier.
+
+    Distinguishes English, Roman Urdu and Urdu (Arabic script) using a
+    pre-trained hashed n-gram table produced by scripts/train_language_id.py.
+    """
+
+    def __init__(self, model_path: Path = MODEL_PATH, min_margin: float = 2.0,
+                 single_word_margin: float = 15.0):
+        # Roman Urdu must beat English by this many nats; ties stay English
+        self.min_margin = min_margin
+        # One word is little evidence, and short greetings ("hi", "acha")
+        # share most of their n-grams with Roman Urdu, so a one-word
+        # message needs a clear Urdu word ("shukriya") to switch language
+        self.single_word_margin = single_word_margin
+        self.num_buckets = NUM_BUCKETS
+        self.log_priors = None
+        self.log_probs = None
+        # Roman Urdu minus English log-probability per bucket, the only
+        # comparison classify() needs once Arabic script is ruled out
+        self.urdu_delta = None
+
+        try:
+            self.num_buckets, self.log_priors, self.log_probs = load_table(model_path)
+            english = LANGUAGES.index("english") * self.num_buckets
+            roman_urdu = LANGUAGES.index("roman_urdu") * self.num_buckets
+            self.urdu_delta = array("f", (
+                self.log_probs[roman_urdu + i] - self.log_probs[english + i]
+                for i in range(self.num_buckets)
+            ))
+            self._prior_delta = (self.log_priors[LANGUAGES.index("roman_urdu")]
+                                 - self.log_priors[LANGUAGES.index("english")])
+            logger.info(f"Loaded language ID model ({self.num_buckets} buckets)")
+        except Exception as e:
+            logger.warning(f"Language ID model unavailable, using script-only detection: {e}")
+
+        # Words repeat heavily across messages, so memoize their contribution
+        self._word_delta = lru_cache(maxsize=8192)(self._compute_word_delta)
+
+    def _compute_word_delta(self, word: str) -> float:
+        delta = self.urdu_delta
+        return sum(delta[bucket] for bucket in word_features(word, self.num_buckets))
+
+    def scores(self, text: str) -> Dict[str, float]:
+        """Return the log-probability score of each language"""
+        if self.log_probs is None:
+            return {language: 0.0 for language in LANGUAGES}
+
+        log_probs = self.log_probs
+        num_buckets = self.num_buckets
+        totals = list(self.log_priors)
+        offsets = [row * num_buckets for row in range(len(LANGUAGES))]
+
+        for bucket in extract_features(text, num_buckets):
+            for row, offset in enumerate(offsets):
+                totals[row] += log_probs[offset + bucket]
+
+        return dict(zip(LANGUAGES, totals))
+
+    def classify(self, text: str) -> str:
+        """Classify text as "english", "roman_urdu" or "urdu"."""
+        text = text.strip()
+        if not text:
+            return "english"
+
+        # Arabic-script text is unambiguous; no need to consult the table
+        letters = [ch for ch in text if ch.isalpha()]
+        if letters:
+            arabic = sum(1 for ch in letters if _is_arabic_script(ch))
+            if arabic * 2 > len(letters):
+                return "urdu"
+
+        if self.urdu_delta is None:
+            return "english"
+
+        word_delta = self._word_delta
+        words = text.lower().split()
+        margin = self._prior_delta + sum(word_delta(word) for word in words)
+        if margin >= (self.single_word_margin if len(words) == 1 else self.min_margin):
+            return "roman_urdu"
+        return "english"
+
+
+# Global instance
+language_identifier = LanguageIdentifier()
+
+
+def detect_language(text: str) -> str:
+    """Detect the language of a user message"""
+    return language_identifier.classify(text)
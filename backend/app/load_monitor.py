@@ -0,0 +1,220 @@
+import os
+import time
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional
+
+
+class RollingCounter:
+    """Event count over the last `window` seconds in fixed time buckets.
+
+    Adding and reading are O(1) amortized: buckets that fall out of the
+    window are cleared as time moves forward, and the total is kept
+    incrementally instead of being summed per read.
+    """
+
+    def __init__(self, window: float = 60.0, buckets: int = 60):
+        self.resolution = window / buckets
+        self.counts: List[int] = [0] * buckets
+        self.total = 0
+        self.epoch = 0
+
+    def _advance(self, now: float):
+        epoch = int(now / self.resolution)
+        if epoch <= self.epoch:
+            return
+        buckets = len(self.counts)
+        if epoch - self.epoch >= buckets:
+            self.counts = [0] * buckets
+            self.total = 0
+        else:
+            for e in range(self.epoch + 1, epoch + 1):
+                self.total -= self.counts[e % buckets]
+                self.counts[e % buckets] = 0
+        self.epoch = epoch
+
+    def add(self, now: float, amount: int = 1):
+        self._advance(now)
+        self.counts[self.epoch % len(self.counts)] += amount
+        self.total += amount
+
+    def count(self, now: float) -> int:
+        self._advance(now)
+        return self.total
+
+
+class LoadMonitor:
+    """Current service load from in-flight work and recent latency.
+
+    Tracks in-flight /chat requests, in-flight LLM calls (requests queued
+    on or being served by the model) and an exponentially weighted LLM
+    latency, plus rolling counts of accepted and rejected requests. All
+    updates are O(1), so checking the load on every request is cheap.
+
+    The latency average only changes when a call finishes, so it also
+    decays with time: it halves every `latency_half_life` seconds without
+    a sample, and older averages weigh less against a new sample. One
+    slow burst followed by silence does not keep the load high.
+
+    LLM failures also drive a circuit breaker: after `failure_threshold`
+    consecutive failed calls it opens for `breaker_cooldown` seconds, then
+    lets calls through again and closes on the first success.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 32,
+        max_llm_in_flight: int = 16,
+        latency_threshold: float = 8.0,
+        load_threshold: float = 0.8,
+        latency_alpha: float = 0.2,
+        latency_half_life: float = 15.0,
+        window: float = 60.0,
+        failure_threshold: int = 5,
+        breaker_cooldown: float = 30.0
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_llm_in_flight = max_llm_in_flight
+        self.latency_threshold = latency_threshold
+        self.load_threshold = load_threshold
+        self.latency_alpha = latency_alpha
+        self.latency_half_life = latency_half_life
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.breaker_cooldown = breaker_cooldown
+
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.llm_in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self.latency_updated_at: Optional[float] = None
+        self.accepted = RollingCounter(window)
+        self.rejected = RollingCounter(window)
+        self.consecutive_failures = 0
+        self.breaker_opened_at: Optional[float] = None
+
+    @contextmanager
+    def track_request(self):
+        """Count a /chat request as in flight while the block runs"""
+        with self.lock:
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+    @contextmanager
+    def track_llm_call(self):
+        """Count an LLM call as queued/in flight, fold its latency into the average
+        and feed its outcome to the circuit breaker"""
+        with self.lock:
+            self.llm_in_flight += 1
+        start = time.perf_counter()
+        # None when interrupted by something other than an error (e.g. cancellation)
+        failed = None
+        try:
+            yield
+            failed = False
+        except Exception:
+            failed = True
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            now = time.time()
+            with self.lock:
+                self.llm_in_flight -= 1
+                if self.latency_ewma is None:
+                    self.latency_ewma = latency
+                else:
+                    # The older the average, the more the new sample counts
+                    alpha = 1.0 - (1.0 - self.latency_alpha) * self._latency_decay(now)
+                    self.latency_ewma += alpha * (latency - self.latency_ewma)
+                self.latency_updated_at = now
+                if failed:
+                    self.consecutive_failures += 1
+                    if self.consecutive_failures >= self.failure_threshold:
+                        # Opens, or reopens after a failed probe
+                        self.breaker_opened_at = time.time()
+                elif failed is False:
+                    self.consecutive_failures = 0
+                    self.breaker_opened_at = None
+
+    def record_decision(self, allowed: bool, now: Optional[float] = None):
+        """Count a rate limit decision in the rolling window"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            (self.accepted if allowed else self.rejected).add(now)
+
+    def _latency_decay(self, now: float) -> float:
+        """Weight left on the latency average since its last sample"""
+        if self.latency_updated_at is None or self.latency_half_life <= 0:
+            return 1.0
+        age = max(0.0, now - self.latency_updated_at)
+        return 0.5 ** (age / self.latency_half_life)
+
+    def _latency(self, now: float) -> Optional[float]:
+        if self.latency_ewma is None:
+            return None
+        return self.latency_ewma * self._latency_decay(now)
+
+    def load_ratio(self, now: Optional[float] = None) -> float:
+        """Highest utilization among the load signals (1.0 = at capacity)"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            ratios = [
+                self.in_flight / self.max_in_flight if self.max_in_flight > 0 else 0.0,
+                self.llm_in_flight / self.max_llm_in_flight if self.max_llm_in_flight > 0 else 0.0,
+            ]
+            latency = self._latency(now)
+            if latency is not None and self.latency_threshold > 0:
+                ratios.append(latency / self.latency_threshold)
+        return max(ratios)
+
+    def is_high_load(self, now: Optional[float] = None) -> bool:
+        return self.load_ratio(now) >= self.load_threshold
+
+    def breaker_open(self, now: Optional[float] = None) -> bool:
+        """Whether recent LLM failures mean calls should not be attempted"""
+        if now is None:
+            now = time.time()
+        with self.lock:
+            opened_at = self.breaker_opened_at
+        return opened_at is not None and now - opened_at < self.breaker_cooldown
+
+    def llm_saturated(self) -> bool:
+        """Whether the LLM queue is full"""
+        with self.lock:
+            return self.max_llm_in_flight > 0 and self.llm_in_flight >= self.max_llm_in_flight
+
+    def snapshot(self) -> Dict[str, Any]:
+        now = time.time()
+        ratio = self.load_ratio(now)
+        with self.lock:
+            latency = self._latency(now)
+            return {
+                "in_flight_requests": self.in_flight,
+                "llm_in_flight": self.llm_in_flight,
+                "llm_latency_ewma_seconds": round(latency, 3) if latency is not None else None,
+                "accepted_last_window": self.accepted.count(now),
+                "rejected_last_window": self.rejected.count(now),
+                "window_seconds": self.window,
+                "load_ratio": round(ratio, 3),
+                "is_high_load": ratio >= self.load_threshold,
+                "llm_consecutive_failures": self.consecutive_failures,
+                "llm_breaker_open": self.breaker_opened_at is not None and now - self.breaker_opened_at < self.breaker_cooldown,
+            }
+
+
+# Global instance
+load_monitor = LoadMonitor(
+    max_in_flight=int(os.getenv("LOAD_MAX_IN_FLIGHT", "32")),
+    max_llm_in_flight=int(os.getenv("LOAD_MAX_LLM_IN_FLIGHT", "16")),
+    latency_threshold=float(os.getenv("LOAD_LATENCY_THRESHOLD", "8.0")),
+    latency_half_life=float(os.getenv("LOAD_LATENCY_HALF_LIFE", "15")),
+    load_threshold=float(os.getenv("LOAD_THRESHOLD", "0.8")),
+    failure_threshold=int(os.getenv("LLM_BREAKER_FAILURES", "5")),
+    breaker_cooldown=float(os.getenv("LLM_BREAKER_COOLDOWN", "30"))
+)
@@ -1,6 +1,7 @@
-from fastapi import FastAPI, HTTPException, BackgroundTasks
+from fastapi import FastAPI, HTTPException, BackgroundTasks, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 import asyncio
 import logging
@@ -13,17 +14,34 @@ from dotenv import load_dotenv
 load_dotenv()
 
 # Import rate limiter
-from app.rate_limiter import rate_limit_middleware
+from app.rate_limiter import get_client_ip, rate_limit_middleware, rate_limiter
+from app.cost_quota import cost_quota, metered_request
+from app.deadline import REQUEST_DEADLINE_SECONDS, Deadline, DeadlineExceeded, RequestCancelled, run_until_disconnected
+
+# Import load monitor, LLM usage accounting, user memory store and background job runner
+from app.load_monitor import load_monitor
+from app.prompt_builder import token_usage
+from app.classification import classification_stats
+from app.user_memory import user_memory
+from app.context_manager import context_manager
+from app.background_jobs import background_jobs
 
 # Import with error handling
 try:
-    from app.therapy_agent import langgraph_app
+    from app.therapy_agent import (
+        degraded_mode, langgraph_app, post_response_jobs, response_bank, speculation_stats, unanswered_request_jobs
+    )
     from app.rag_system import rag_manager
     RAG_AVAILABLE = True
 except Exception as e:
     logging.error(f"Error importing RAG components: {e}")
     RAG_AVAILABLE = False
     langgraph_app = None
+    post_response_jobs = None
+    unanswered_request_jobs = None
+    degraded_mode = None
+    response_bank = None
+    speculation_stats = None
     rag_manager = None
 
 app = FastAPI(
@@ -80,7 +98,7 @@ if os.getenv("ENVIRONMENT") != "production":
         allow_credentials=False,
         allow_methods=["GET", "POST", "OPTIONS", "HEAD", "PUT", "DELETE"],
         allow_headers=["*"],
-        expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"]
+        expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-Quota-Remaining", "X-Quota-Retry-After"]
     )
 else:
     app.add_middleware(
@@ -89,7 +107,7 @@ else:
         allow_credentials=False,
         allow_methods=["GET", "POST", "OPTIONS", "HEAD", "PUT", "DELETE"],
         allow_headers=["*"],
-        expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset"]
+        expose_headers=["X-RateLimit-Limit", "X-RateLimit-Remaining", "X-RateLimit-Reset", "X-Quota-Remaining", "X-Quota-Retry-After"]
     )
 
 # Add middleware to log requests for debugging
@@ -129,6 +147,14 @@ class UserMessage(BaseModel):
             }
         }
 
+@app.on_event("shutdown")
+def flush_user_memory():
+    """Spill resident user memory, flush cached user contexts and stop sweepers"""
+    if user_memory.spill_backend is not None:
+        user_memory.flush()
+    context_manager.close()
+    rate_limiter.close()
+
 @app.get("/")
 def root():
     return {"message": "QalbCare Islamic Therapy API is running", "status": "healthy"}
@@ -176,13 +202,51 @@ def search_by_emotion(emotion: str, limit: int = 5):
         logging.error(f"Emotion search error: {e}")
         raise HTTPException(status_code=500, detail="Internal server error")
 
+@app.get("/metrics")
+def metrics():
+    """Service metrics, for development:
+    - llm: prompt/completion tokens, latency and largest prompt per pipeline node
+    - cost_quota: LLM spend charged against the per-user and per-IP quotas
+    - classification: classifier answers and why unusable ones fell back
+    - speculation: speculative counseling drafts kept, discarded and wasted
+    - response_bank / degraded_mode: replies served without a generation call
+    - load, rate_limiter, user_memory, context_sessions, background_jobs:
+      load signals, rate limit decisions, caches and post-response jobs
+    """
+    # Only allow in development mode
+    if os.getenv("ENVIRONMENT") == "production":
+        raise HTTPException(status_code=404, detail="Not found")
+    
+    return {
+        "llm": token_usage.snapshot(),
+        "user_memory": user_memory.get_stats(),
+        "context_sessions": context_manager.get_session_stats(),
+        "background_jobs": background_jobs.snapshot(),
+        "rate_limiter": rate_limiter.get_stats(),
+        "cost_quota": cost_quota.get_stats(),
+        "classification": classification_stats.get_stats(),
+        "load": load_monitor.snapshot(),
+        "degraded_mode": degraded_mode.get_stats() if degraded_mode else None,
+        "response_bank": response_bank.get_stats() if response_bank else None,
+        "speculation": speculation_stats.get_stats() if speculation_stats else None
+    }
+
 @app.options("/chat")
 def chat_options():
     """Handle OPTIONS requests for CORS preflight"""
     return {"message": "OK"}
 
+def keep_unanswered_message(state):
+    """The user's message is kept even when no reply was sent"""
+    if state is None or unanswered_request_jobs is None:
+        return
+    for job_name, job in unanswered_request_jobs(state["user_id"], state["name"], state["message"]):
+        background_jobs.spawn(job_name, job)
+
 @app.post("/chat")
-def chat(data: UserMessage):
+async def chat(data: UserMessage, background_tasks: BackgroundTasks, request: Request):
+    # Set once the pipeline starts; failures after that keep the message
+    state = None
     try:
         # Validate input
         if not data.message or not data.message.strip():
@@ -191,34 +255,79 @@ def chat(data: UserMessage):
         if not data.user_id or not data.user_id.strip():
             raise HTTPException(status_code=400, detail="User ID is required")
         
+        # LLM spend quota, per user and per client IP
+        client_ip = get_client_ip(request)
+        allowed, retry_after = cost_quota.admit(data.user_id, client_ip)
+        
+        # The request deadline starts here and is passed to every node; a
+        # client disconnect cancels whatever is still outstanding
+        deadline = Deadline(REQUEST_DEADLINE_SECONDS)
+        
         # Process the message
         state = {
             "user_id": data.user_id,
             "name": data.name,
-            "message": data.message.strip()
+            "message": data.message.strip(),
+            "deadline": deadline
         }
+        if not allowed:
+            # Over quota: still answered, from curated content without the LLM
+            state["degraded_reason"] = "quota_exceeded"
         
-        result = langgraph_app.invoke(state)
+        # Charge the quota what the pipeline actually spent, even if it failed
+        with metered_request() as meter:
+            try:
+                result = await run_until_disconnected(
+                    deadline, request.is_disconnected, langgraph_app.invoke, state,
+                    run_in_thread=run_in_threadpool
+                )
+            finally:
+                quota_remaining = cost_quota.charge(data.user_id, client_ip, meter)
         
         # Ensure we have a response
         if not result.get("response"):
+            keep_unanswered_message(state)
             raise HTTPException(status_code=500, detail="Failed to generate response")
         
+        quota_headers = {"X-Quota-Remaining": str(max(0, int(quota_remaining)))}
+        if not allowed:
+            quota_headers["X-Quota-Retry-After"] = str(retry_after)
+        
+        # Memory, story and context bookkeeping run after the response is sent
+        for job_name, job in post_response_jobs(result):
+            background_jobs.schedule(background_tasks, job_name, job)
+        
         return JSONResponse(
             content={
                 "name": result.get("name", "Friend"),
                 "emotion": result.get("emotion", "neutral"),
                 "message": result["response"],
                 "dua": result.get("dua"),
+                # True when served from curated templates without the LLM
+                "degraded": bool(result.get("degraded_reason")),
                 "success": True
             },
-            media_type="application/json; charset=utf-8"
+            media_type="application/json; charset=utf-8",
+            headers=quota_headers
         )
         
     except HTTPException:
         raise
+    except RequestCancelled as e:
+        # Nobody is waiting for this response any more
+        logging.info(f"Chat request cancelled: {e}")
+        keep_unanswered_message(state)
+        return JSONResponse(status_code=499, content={"detail": "Request cancelled", "error": "request_cancelled"})
+    except DeadlineExceeded as e:
+        logging.warning(f"Chat request timed out: {e}")
+        keep_unanswered_message(state)
+        raise HTTPException(
+            status_code=504,
+            detail="This is taking longer than expected. Please try again in a moment."
+        )
     except Exception as e:
         logging.error(f"Error in chat endpoint: {str(e)}")
+        keep_unanswered_message(state)
         raise HTTPException(
             status_code=500, 
             detail="An error occurred while processing your message. Please try again."
@@ -0,0 +1,175 @@
+import logging
+import threading
+import time
+from string import Formatter
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from app.cost_quota import record_llm_cost
+from app.deadline import Deadline
+from app.load_monitor import load_monitor
+
+logger = logging.getLogger(__name__)
+
+# Rough Gemini tokenizer ratio for English and Roman Urdu text
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate used for budgets when no tokenizer is available"""
+    if not text:
+        return 0
+    return max(1, (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN)
+
+
+def trim_text(text: str, max_tokens: int, marker: str = "...") -> str:
+    """Trim text to a token budget, cutting at a line or word boundary"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    if len(text) <= max_chars:
+        return text
+
+    cut = text.rfind("\n", 0, max_chars)
+    if cut < max_chars // 2:
+        cut = text.rfind(" ", 0, max_chars)
+    if cut <= 0:
+        cut = max_chars
+    return text[:cut].rstrip() + marker
+
+
+def join_within_budget(items: Iterable[str], max_tokens: int, separator: str = ", ") -> str:
+    """Join items in order, dropping the ones that would exceed the budget"""
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    kept: List[str] = []
+    used = 0
+    for item in items:
+        extra = len(item) + (len(separator) if kept else 0)
+        if used + extra > max_chars:
+            break
+        kept.append(item)
+        used += extra
+    return separator.join(kept)
+
+
+class PromptTemplate:
+    """Prompt with its static text rendered once and budgeted dynamic sections.
+
+    Fields passed as keyword arguments at construction are substituted
+    immediately; the remaining fields are filled per request by render(),
+    with each field listed in budgets trimmed to its token budget.
+    """
+
+    def __init__(self, name: str, template: str, budgets: Optional[Dict[str, int]] = None, **static: Any):
+        self.name = name
+        self.budgets = budgets or {}
+
+        # Alternating literal text and dynamic field names
+        self._parts: List[Tuple[str, Optional[str]]] = []
+        literal = ""
+        for text, field, spec, conversion in Formatter().parse(template):
+            literal += text
+            if field is None:
+                continue
+            if spec or conversion:
+                raise ValueError(f"Prompt '{name}' uses unsupported format spec on '{field}'")
+            if field in static:
+                literal += str(static[field])
+            else:
+                self._parts.append((literal, field))
+                literal = ""
+        self._parts.append((literal, None))
+
+        self.fields = list(dict.fromkeys(field for _, field in self._parts if field is not None))
+        self.static_chars = sum(len(text) for text, _ in self._parts)
+        self.static_tokens = (self.static_chars + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+    def render(self, **values: Any) -> str:
+        """Fill the dynamic fields, trimming budgeted sections"""
+        out = []
+        for text, field in self._parts:
+            out.append(text)
+            if field is None:
+                continue
+            value = str(values[field])
+            budget = self.budgets.get(field)
+            if budget is not None:
+                value = trim_text(value, budget)
+            out.append(value)
+        return "".join(out)
+
+
+class TokenUsageTracker:
+    """Per-node LLM call accounting: prompt/completion tokens and latency"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.nodes: Dict[str, Dict[str, float]] = {}
+
+    def record(self, node: str, prompt_tokens: int, completion_tokens: int, latency: float):
+        with self.lock:
+            stats = self.nodes.get(node)
+            if stats is None:
+                stats = self.nodes[node] = {
+                    "calls": 0,
+                    "prompt_tokens": 0,
+                    "completion_tokens": 0,
+                    "latency_seconds": 0.0,
+                    "max_prompt_tokens": 0,
+                }
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["latency_seconds"] += latency
+            stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+
+    def record_response(self, node: str, prompt: str, response: Any, latency: float) -> Tuple[int, int]:
+        """Record a Gemini response, preferring its reported usage over estimates"""
+        usage = getattr(response, "usage_metadata", None)
+        prompt_tokens = getattr(usage, "prompt_token_count", 0) or estimate_tokens(prompt)
+        completion_tokens = getattr(usage, "candidates_token_count", 0)
+        if not completion_tokens:
+            try:
+                completion_tokens = estimate_tokens(response.text)
+            except Exception:
+                completion_tokens = 0
+        self.record(node, prompt_tokens, completion_tokens, latency)
+        return prompt_tokens, completion_tokens
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Return totals and per-call averages for each node"""
+        with self.lock:
+            result = {}
+            for node, stats in self.nodes.items():
+                calls = stats["calls"] or 1
+                result[node] = {
+                    **stats,
+                    "avg_prompt_tokens": round(stats["prompt_tokens"] / calls, 1),
+                    "avg_completion_tokens": round(stats["completion_tokens"] / calls, 1),
+                    "avg_latency_seconds": round(stats["latency_seconds"] / calls, 3),
+                }
+            return result
+
+
+# Global instance
+token_usage = TokenUsageTracker()
+
+
+def timed_generate(model: Any, node: str, prompt: str, deadline: Optional[Deadline] = None, **kwargs: Any) -> Any:
+    """Call model.generate_content and record its token usage under node and the request's cost.
+
+    With a deadline the call is abandoned once it passes or the request is
+    cancelled; the SDK timeout is set from the same deadline, so an
+    abandoned call releases its connection by then too.
+    """
+    def call():
+        start = time.perf_counter()
+        with load_monitor.track_llm_call():
+            response = model.generate_content(prompt, **kwargs)
+        latency = time.perf_counter() - start
+        prompt_tokens, completion_tokens = token_usage.record_response(node, prompt, response, latency)
+        record_llm_cost(prompt_tokens, completion_tokens)
+        logger.info(f"LLM call [{node}]: {prompt_tokens} prompt / {completion_tokens} completion tokens in {latency:.2f}s")
+        return response
+
+    if deadline is None:
+        return call()
+    kwargs.setdefault("request_options", {"timeout": max(deadline.remaining(), 0.001)})
+    return deadline.run(call, stage=node)
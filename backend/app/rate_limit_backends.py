@@ -0,0 +1,538 @@
+import os
+import mmap
+import time
+import socket
+import struct
+import hashlib
+import logging
+import threading
+import socketserver
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+# (period name, window seconds, limit), checked in order
+Limits = Sequence[Tuple[str, int, int]]
+
+# Shared backends count a burst as requests within the same wall-clock second
+BURST_WINDOW = 1
+
+
+def _key_hash(client_ip: str) -> int:
+    """Stable 64-bit client key; unlike hash(), identical in every worker"""
+    key = int.from_bytes(hashlib.blake2b(client_ip.encode("utf-8"), digest_size=8).digest(), "little")
+    return key or 1
+
+
+def sliding_estimate(previous: int, current: int, now: float, window: int) -> float:
+    """Requests in the last `window` seconds from two fixed-window counters.
+
+    The previous window's count is weighted by how much of it still
+    overlaps the sliding window; exact when requests are evenly spread
+    and within one previous-window share of it otherwise.
+    """
+    elapsed = (now % window) / window
+    return previous * (1.0 - elapsed) + current
+
+
+class SharedRateLimitBackend(ABC):
+    """State shared by every worker that points at the same backend.
+
+    Shared backends keep two fixed-window counters per period instead of
+    a request log, so a check is a constant number of reads and writes
+    regardless of the limits, and the state fits a fixed-size record.
+    """
+
+    name = "shared"
+
+    @abstractmethod
+    def check_and_count(self, client_ip: str, now: float, limits: Limits, burst_size: int) -> Tuple[Optional[str], int]:
+        """Check and record one request: (exceeded period or None, the
+        client's requests in the last minute, this one included if allowed)"""
+
+    @abstractmethod
+    def minute_count(self, client_ip: str, now: float) -> int:
+        """The client's requests in the last minute"""
+
+    def check(self, client_ip: str, now: float, limits: Limits, burst_size: int) -> Optional[str]:
+        """Check and record one request; return the exceeded period or None"""
+        return self.check_and_count(client_ip, now, limits, burst_size)[0]
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name}
+
+    def close(self):
+        pass
+
+
+# --- MMAP TABLE (single host, many workers) --- #
+# A fixed-size file of buckets, each holding a few client records; a client
+# lives in the bucket its key hashes to and a full bucket reuses its least
+# recently seen record. Workers lock only the bucket they touch: an fcntl
+# byte-range lock across processes plus a striped lock across threads,
+# since fcntl locks are owned by the process
+
+MMAP_MAGIC = b"QCRL"
+MMAP_VERSION = 1
+MMAP_HEADER = struct.Struct("<4sII")
+MMAP_HEADER_SIZE = 64
+# key, last_seen, (window id, current, previous) per period, burst second, burst count
+MMAP_RECORD = struct.Struct("<Qd" + "qII" * 3 + "qI4x")
+SLOTS_PER_BUCKET = 8
+BUCKET_SIZE = MMAP_RECORD.size * SLOTS_PER_BUCKET
+MMAP_PERIODS = 3
+
+
+class MmapRateLimitBackend(SharedRateLimitBackend):
+    """Rate limit table in a memory-mapped file shared by all local workers"""
+
+    name = "mmap"
+
+    def __init__(self, path: str, buckets: int = 8192, stripes: int = 64):
+        if not FCNTL_AVAILABLE:
+            raise RuntimeError("The mmap rate limit backend needs fcntl (POSIX)")
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+
+        # The first worker sizes the file; the rest adopt its layout
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, MMAP_HEADER_SIZE, 0)
+        try:
+            header = os.pread(self._fd, MMAP_HEADER.size, 0)
+            if len(header) < MMAP_HEADER.size or header[:4] != MMAP_MAGIC:
+                os.ftruncate(self._fd, MMAP_HEADER_SIZE + buckets * BUCKET_SIZE)
+                os.pwrite(self._fd, MMAP_HEADER.pack(MMAP_MAGIC, MMAP_VERSION, buckets), 0)
+            else:
+                magic, version, buckets = MMAP_HEADER.unpack(header)
+                if version != MMAP_VERSION:
+                    raise ValueError(f"Rate limit table {path} has layout version {version}")
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, MMAP_HEADER_SIZE, 0)
+
+        self.buckets = buckets
+        self._map = mmap.mmap(self._fd, MMAP_HEADER_SIZE + buckets * BUCKET_SIZE)
+        self._locks = [threading.Lock() for _ in range(stripes)]
+        self._stats_lock = threading.Lock()
+        self.shed = 0
+
+    def _find(self, offset: int, key: int) -> Tuple[int, List]:
+        """Offset and fields of the client's record, reusing a slot if absent"""
+        free = None
+        oldest = None
+        oldest_seen = None
+        for slot in range(offset, offset + BUCKET_SIZE, MMAP_RECORD.size):
+            fields = MMAP_RECORD.unpack_from(self._map, slot)
+            if fields[0] == key:
+                return slot, list(fields)
+            if fields[0] == 0:
+                if free is None:
+                    free = slot
+            elif oldest_seen is None or fields[1] < oldest_seen:
+                oldest, oldest_seen = slot, fields[1]
+        if free is None:
+            free = oldest
+            with self._stats_lock:
+                self.shed += 1
+        return free, [key, 0.0] + [0] * (MMAP_PERIODS * 3 + 2)
+
+    def _locked(self, client_ip: str, now: float, update):
+        key = _key_hash(client_ip)
+        bucket = key % self.buckets
+        offset = MMAP_HEADER_SIZE + bucket * BUCKET_SIZE
+        with self._locks[bucket % len(self._locks)]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, BUCKET_SIZE, offset)
+            try:
+                slot, fields = self._find(offset, key)
+                result, write = update(fields)
+                if write:
+                    fields[1] = now
+                    MMAP_RECORD.pack_into(self._map, slot, *fields)
+                return result
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, BUCKET_SIZE, offset)
+
+    @staticmethod
+    def _roll(fields: List, index: int, window_id: int):
+        """Move a period's counters forward to window_id"""
+        stored = fields[index]
+        if stored == window_id:
+            return
+        fields[index + 2] = fields[index + 1] if stored == window_id - 1 else 0
+        fields[index + 1] = 0
+        fields[index] = window_id
+
+    def check_and_count(self, client_ip: str, now: float, limits: Limits, burst_size: int) -> Tuple[Optional[str], int]:
+        def update(fields):
+            minute = 0
+            for i, (period, window, limit) in enumerate(limits[:MMAP_PERIODS]):
+                index = 2 + i * 3
+                self._roll(fields, index, int(now // window))
+                estimate = sliding_estimate(fields[index + 2], fields[index + 1], now, window)
+                if period == "minute":
+                    minute = int(estimate)
+                if estimate >= limit:
+                    return (period, minute), True
+            second = int(now // BURST_WINDOW)
+            if fields[11] != second:
+                fields[11], fields[12] = second, 0
+            if fields[12] >= burst_size:
+                return ("burst", minute), True
+            for i in range(min(len(limits), MMAP_PERIODS)):
+                fields[3 + i * 3] += 1
+            fields[12] += 1
+            return (None, minute + 1), True
+
+        return self._locked(client_ip, now, update)
+
+    def minute_count(self, client_ip: str, now: float) -> int:
+        def read(fields):
+            if fields[1] == 0.0:
+                return 0, False
+            self._roll(fields, 2, int(now // 60))
+            return int(sliding_estimate(fields[4], fields[3], now, 60)), False
+
+        return self._locked(client_ip, now, read)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            shed = self.shed
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "slots": self.buckets * SLOTS_PER_BUCKET,
+            "shed_lru": shed,
+        }
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            os.close(self._fd)
+            self._map = None
+
+
+# --- REDIS PROTOCOL (many hosts) --- #
+# Each period is a pair of counter keys, <prefix><ip>:<period>:<window id>,
+# that expire on their own. A check is one pipelined round trip that counts
+# the request and reads the previous windows; a rejected request takes a
+# second round trip to uncount itself. Any server speaking the Redis
+# protocol works, including RespStandIn below
+
+class RespError(Exception):
+    pass
+
+
+def _encode_command(args: Sequence[Any]) -> bytes:
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        if not isinstance(arg, bytes):
+            arg = str(arg).encode("utf-8")
+        parts.append(b"$%d\r\n%s\r\n" % (len(arg), arg))
+    return b"".join(parts)
+
+
+class RespConnection:
+    """Blocking Redis-protocol connection that sends commands in pipelines"""
+
+    def __init__(self, host: str, port: int, db: int = 0, timeout: float = 0.5):
+        self.sock = socket.create_connection((host, port), timeout=timeout)
+        self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.reader = self.sock.makefile("rb")
+        if db:
+            self.pipeline([("SELECT", db)])
+
+    def _read(self):
+        line = self.reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, rest = line[:1], line[1:-2]
+        if prefix == b"+":
+            return rest.decode("utf-8")
+        if prefix == b"-":
+            return RespError(rest.decode("utf-8"))
+        if prefix == b":":
+            return int(rest)
+        if prefix == b"$":
+            length = int(rest)
+            return None if length < 0 else self.reader.read(length + 2)[:-2]
+        if prefix == b"*":
+            length = int(rest)
+            return None if length < 0 else [self._read() for _ in range(length)]
+        raise ConnectionError(f"Unexpected reply {line!r}")
+
+    def pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        """Send all commands in one write and read their replies in order"""
+        self.sock.sendall(b"".join(_encode_command(command) for command in commands))
+        replies = [self._read() for _ in commands]
+        for reply in replies:
+            if isinstance(reply, RespError):
+                raise reply
+        return replies
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        except OSError:
+            pass
+
+
+class RespRateLimitBackend(SharedRateLimitBackend):
+    """Rate limit counters in Redis (or any server speaking its protocol).
+
+    Connections are per thread. If the server is unreachable the check
+    fails open, so an outage of the limiter never takes chat down with it.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = "redis://127.0.0.1:6379/0", prefix: str = "qalbcare:rl:",
+                 timeout: float = 0.5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "127.0.0.1"
+        self.port = parsed.port or 6379
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.prefix = prefix
+        self.timeout = timeout
+        self._local = threading.local()
+        self._connections: List[RespConnection] = []
+        self._lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.round_trips = 0
+        self.errors = 0
+
+    def _pipeline(self, commands: Sequence[Sequence[Any]]) -> List[Any]:
+        connection = getattr(self._local, "connection", None)
+        try:
+            if connection is None:
+                connection = RespConnection(self.host, self.port, self.db, self.timeout)
+                self._local.connection = connection
+                with self._lock:
+                    self._connections.append(connection)
+            with self._stats_lock:
+                self.round_trips += 1
+            return connection.pipeline(commands)
+        except (OSError, RespError, ValueError):
+            with self._stats_lock:
+                self.errors += 1
+            if connection is not None:
+                connection.close()
+                with self._lock:
+                    if connection in self._connections:
+                        self._connections.remove(connection)
+            self._local.connection = None
+            raise
+
+    def _key(self, client_ip: str, period: str, window_id: int) -> str:
+        return f"{self.prefix}{client_ip}:{period}:{window_id}"
+
+    def check_and_count(self, client_ip: str, now: float, limits: Limits, burst_size: int) -> Tuple[Optional[str], int]:
+        counted = []
+        commands = []
+        for period, window, _ in limits:
+            window_id = int(now // window)
+            key = self._key(client_ip, period, window_id)
+            counted.append(key)
+            commands += [
+                ("INCR", key),
+                ("PEXPIRE", key, window * 2000),
+                ("GET", self._key(client_ip, period, window_id - 1)),
+            ]
+        burst_key = self._key(client_ip, "burst", int(now // BURST_WINDOW))
+        counted.append(burst_key)
+        commands += [("INCR", burst_key), ("PEXPIRE", burst_key, BURST_WINDOW * 2000)]
+
+        try:
+            replies = self._pipeline(commands)
+        except (OSError, RespError, ValueError) as e:
+            logger.warning(f"Shared rate limit check failed, allowing request: {e}")
+            return None, 0
+
+        exceeded = None
+        minute = 0
+        for i, (period, window, limit) in enumerate(limits):
+            current, previous = replies[i * 3], int(replies[i * 3 + 2] or 0)
+            # The counters already include this request
+            estimate = sliding_estimate(previous, current - 1, now, window)
+            if period == "minute":
+                minute = int(estimate)
+            if estimate >= limit:
+                exceeded = period
+                break
+        if exceeded is None and replies[-2] > burst_size:
+            exceeded = "burst"
+
+        if exceeded is not None:
+            # Rejected requests do not count against the client
+            try:
+                self._pipeline([("DECR", key) for key in counted])
+            except (OSError, RespError, ValueError) as e:
+                logger.warning(f"Could not uncount rejected request: {e}")
+            return exceeded, minute
+        return None, minute + 1
+
+    def minute_count(self, client_ip: str, now: float) -> int:
+        window_id = int(now // 60)
+        try:
+            current, previous = self._pipeline([
+                ("GET", self._key(client_ip, "minute", window_id)),
+                ("GET", self._key(client_ip, "minute", window_id - 1)),
+            ])
+        except (OSError, RespError, ValueError):
+            return 0
+        return int(sliding_estimate(int(previous or 0), int(current or 0), now, 60))
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                "backend": self.name,
+                "server": f"{self.host}:{self.port}/{self.db}",
+                "round_trips": self.round_trips,
+                "errors": self.errors,
+            }
+
+    def close(self):
+        with self._lock:
+            for connection in self._connections:
+                connection.close()
+            self._connections.clear()
+
+
+# --- LOCAL STAND-IN SERVER --- #
+class _RespHandler(socketserver.StreamRequestHandler):
+    def setup(self):
+        super().setup()
+        # Pipelined replies go out as they are produced
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def _read_command(self) -> Optional[List[bytes]]:
+        line = self.rfile.readline()
+        if not line:
+            return None
+        if line[:1] != b"*":
+            # Inline command, as sent by telnet or redis-cli --no-raw
+            return line.split()
+        args = []
+        for _ in range(int(line[1:-2])):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def handle(self):
+        while True:
+            try:
+                command = self._read_command()
+            except (OSError, ValueError):
+                return
+            if command is None:
+                return
+            if not command:
+                continue
+            self.wfile.write(self.server.standin.execute(command))
+
+
+class RespStandIn:
+    """In-process server for the Redis-protocol subset the backend uses.
+
+    For tests and for trying a multi-worker setup without Redis:
+    GET, SET, INCR, DECR, PEXPIRE, DEL, PING, SELECT and FLUSHALL, with
+    key expiry.
+    """
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0):
+        self._data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self._lock = threading.Lock()
+        self._server = socketserver.ThreadingTCPServer((host, port), _RespHandler, bind_and_activate=False)
+        self._server.allow_reuse_address = True
+        self._server.daemon_threads = True
+        self._server.server_bind()
+        self._server.server_activate()
+        self._server.standin = self
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"redis://{host}:{port}/0"
+
+    def start(self) -> "RespStandIn":
+        self._thread = threading.Thread(target=self._server.serve_forever, name="resp-standin", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _get(self, key: bytes, now: float) -> Optional[bytes]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[1] is not None and entry[1] <= now:
+            del self._data[key]
+            return None
+        return entry[0]
+
+    def execute(self, command: List[bytes]) -> bytes:
+        name = command[0].upper()
+        now = time.monotonic()
+        with self._lock:
+            if name == b"PING":
+                return b"+PONG\r\n"
+            if name in (b"SELECT", b"FLUSHALL"):
+                if name == b"FLUSHALL":
+                    self._data.clear()
+                return b"+OK\r\n"
+            if name == b"GET" and len(command) == 2:
+                value = self._get(command[1], now)
+                return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+            if name == b"SET" and len(command) == 3:
+                self._data[command[1]] = (command[2], None)
+                return b"+OK\r\n"
+            if name in (b"INCR", b"DECR") and len(command) == 2:
+                value = self._get(command[1], now)
+                try:
+                    number = int(value or 0) + (1 if name == b"INCR" else -1)
+                except ValueError:
+                    return b"-ERR value is not an integer or out of range\r\n"
+                expires = self._data[command[1]][1] if value is not None else None
+                self._data[command[1]] = (str(number).encode(), expires)
+                return b":%d\r\n" % number
+            if name == b"PEXPIRE" and len(command) == 3:
+                value = self._get(command[1], now)
+                if value is None:
+                    return b":0\r\n"
+                self._data[command[1]] = (value, now + int(command[2]) / 1000)
+                return b":1\r\n"
+            if name == b"DEL":
+                removed = sum(1 for key in command[1:] if self._data.pop(key, None) is not None)
+                return b":%d\r\n" % removed
+        return b"-ERR unknown command '%s'\r\n" % command[0]
+
+
+def create_rate_limit_backend(backend: Optional[str] = None) -> Optional[SharedRateLimitBackend]:
+    """Build the shared backend selected by RATE_LIMIT_BACKEND (local, mmap or redis).
+
+    None means per-process windows, which is right for a single worker.
+    """
+    backend = (backend or os.getenv("RATE_LIMIT_BACKEND", "local")).lower()
+    if backend == "mmap":
+        return MmapRateLimitBackend(
+            os.getenv("RATE_LIMIT_MMAP_PATH", "data/rate_limits.bin"),
+            buckets=int(os.getenv("RATE_LIMIT_MMAP_BUCKETS", "8192"))
+        )
+    if backend == "redis":
+        return RespRateLimitBackend(
+            os.getenv("RATE_LIMIT_REDIS_URL", "redis://127.0.0.1:6379/0"),
+            prefix=os.getenv("RATE_LIMIT_REDIS_PREFIX", "qalbcare:rl:")
+        )
+    if backend != "local":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}', using per-process limits")
+    return None
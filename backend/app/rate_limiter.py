@@ -1,10 +1,82 @@
 from fastapi import HTTPException, Request, Response
 from fastapi.responses import JSONResponse
+import sys
 import time
-from collections import defaultdict, deque
-from typing import Dict, Deque, Tuple
 import asyncio
-from datetime import datetime, timedelta
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.load_monitor import LoadMonitor, load_monitor as default_load_monitor
+from app.rate_limit_backends import SharedRateLimitBackend, create_rate_limit_backend
+
+# Lock stripes for per-client state; clients in different stripes never
+# contend, and a check holds its stripe only for a few arithmetic steps
+DEFAULT_STRIPES = 64
+
+# Hard cap on tracked clients; past it the least recently active are shed
+DEFAULT_MAX_CLIENTS = 100000
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+
+
+class ClientWindow:
+    """Sliding-window request log for one client with O(1) amortized checks.
+
+    Accepted request times are kept once, in a ring sized for the largest
+    limit; the minute, hour and day windows are absolute start indices
+    into it that only move forward, so counting a window is a subtraction
+    and each timestamp is expired at most once per window.
+    """
+
+    __slots__ = ("times", "capacity", "count", "minute_start", "hour_start", "day_start",
+                 "burst_count", "burst_start", "last_seen")
+
+    def __init__(self, capacity: int):
+        self.times = array("d")
+        self.capacity = capacity
+        self.count = 0
+        self.minute_start = 0
+        self.hour_start = 0
+        self.day_start = 0
+        self.burst_count = 0
+        self.burst_start = 0.0
+        self.last_seen = 0.0
+
+    def _expire(self, start: int, cutoff: float) -> int:
+        """Advance a window start past requests at or before cutoff"""
+        times, capacity = self.times, self.capacity
+        while start < self.count and times[start % capacity] <= cutoff:
+            start += 1
+        return start
+
+    def advance(self, current_time: float):
+        self.day_start = self._expire(self.day_start, current_time - DAY)
+        self.hour_start = self._expire(max(self.hour_start, self.day_start), current_time - HOUR)
+        self.minute_start = self._expire(max(self.minute_start, self.hour_start), current_time - MINUTE)
+
+    def minute_count(self) -> int:
+        return self.count - self.minute_start
+
+    def hour_count(self) -> int:
+        return self.count - self.hour_start
+
+    def day_count(self) -> int:
+        return self.count - self.day_start
+
+    def record(self, current_time: float):
+        # Limits keep the day window below capacity, so the slot being
+        # overwritten has always expired
+        slot = self.count % self.capacity
+        if slot == len(self.times):
+            self.times.append(current_time)
+        else:
+            self.times[slot] = current_time
+        self.count += 1
+
 
 class RateLimiter:
     def __init__(
@@ -12,117 +84,141 @@ class RateLimiter:
         requests_per_minute: int = 30,
         requests_per_hour: int = 500,
         requests_per_day: int = 200,
-        burst_size: int = 10
+        burst_size: int = 10,
+        stripes: int = DEFAULT_STRIPES,
+        max_clients: int = DEFAULT_MAX_CLIENTS,
+        sweep_interval: float = 60.0,
+        load_monitor: Optional[LoadMonitor] = None,
+        backend: Optional[SharedRateLimitBackend] = None
     ):
         self.requests_per_minute = requests_per_minute
         self.requests_per_hour = requests_per_hour
         self.requests_per_day = requests_per_day
         self.burst_size = burst_size
+        self.limits = (
+            ("minute", MINUTE, requests_per_minute),
+            ("hour", HOUR, requests_per_hour),
+            ("day", DAY, requests_per_day),
+        )
         
-        # Store request timestamps for each IP
-        # Maxlen should be able to hold a day's worth of requests
-        self.request_times: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=max(requests_per_day, requests_per_hour)))
+        # Shared state across workers/hosts; None keeps per-process windows
+        self.backend = backend
         
-        # Store burst tracking
-        self.burst_tracking: Dict[str, Tuple[int, float]] = {}
+        # Ring size that holds every request still inside any window
+        self.window_capacity = max(requests_per_minute, requests_per_hour, requests_per_day, 1)
         
-        # Lock for thread-safe operations
-        self.lock = asyncio.Lock()
+        # Per-client windows, striped by client: (lock, {client_ip: ClientWindow},
+        # [evicted idle, shed]). Each table is kept in least recently active
+        # order, so idle clients are always at its front
+        self._stripes: List[Tuple[threading.Lock, "OrderedDict[str, ClientWindow]", List[int]]] = [
+            (threading.Lock(), OrderedDict(), [0, 0]) for _ in range(stripes)
+        ]
         
-        # Track if system is under heavy load
-        self.system_load_threshold = 0.8  # 80% of capacity
-        self.is_high_load = False
+        # A client idle for the longest window has nothing left to count
+        self.idle_ttl = DAY
+        self.max_clients = max_clients
+        self._stripe_capacity = max(1, -(-max_clients // stripes))
+        
+        self._stop_sweeper = threading.Event()
+        self._sweeper = None
+        self.sweep_interval = sweep_interval
+        if sweep_interval > 0 and backend is None:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name="rate-limiter-sweeper", daemon=True)
+            self._sweeper.start()
+        
+        # Service load (in-flight requests, LLM calls, latency) for load-aware messages
+        self.load_monitor = load_monitor if load_monitor is not None else default_load_monitor
+    
+    def _stripe(self, client_ip: str) -> Tuple[threading.Lock, "OrderedDict[str, ClientWindow]", List[int]]:
+        return self._stripes[hash(client_ip) % len(self._stripes)]
         
-    async def check_rate_limit(self, client_ip: str) -> Tuple[bool, str]:
+    async def check_rate_limit(self, client_ip: str) -> Tuple[bool, str, dict]:
         """
         Check if the client has exceeded rate limits
-        Returns: (is_allowed, error_message)
+        Returns: (is_allowed, error_message, rate limit headers)
         """
-        async with self.lock:
+        current_time = time.time()
+        if self.backend is not None:
+            # Shared backends do blocking I/O (sockets, file locks); keep it
+            # off the event loop
+            allowed, message, minute_count = await asyncio.to_thread(self.check_and_count, client_ip, current_time)
+        else:
+            allowed, message, minute_count = self.check_and_count(client_ip, current_time)
+        self.load_monitor.record_decision(allowed)
+        return allowed, message, self.rate_limit_headers(minute_count, current_time)
+    
+    def check(self, client_ip: str, current_time: Optional[float] = None) -> Tuple[bool, str]:
+        """Synchronous check-and-record; safe to call from any thread"""
+        allowed, message, _ = self.check_and_count(client_ip, current_time)
+        return allowed, message
+    
+    def check_and_count(self, client_ip: str, current_time: Optional[float] = None) -> Tuple[bool, str, int]:
+        """check(), plus the client's requests in the last minute after it"""
+        if current_time is None:
             current_time = time.time()
+        if self.backend is not None:
+            exceeded, minute_count = self.backend.check_and_count(client_ip, current_time, self.limits, self.burst_size)
+            if exceeded is None:
+                return True, "", minute_count
+            if exceeded == "burst":
+                return False, "Too many requests in a short time. Please slow down your requests.", minute_count
+            limit = next(limit for period, _, limit in self.limits if period == exceeded)
+            return False, self._get_rate_limit_message(exceeded, limit), minute_count
+        lock, windows, counters = self._stripe(client_ip)
+        with lock:
+            window = windows.get(client_ip)
+            if window is None:
+                if len(windows) >= self._stripe_capacity:
+                    # Shed the least recently active client of this stripe
+                    windows.popitem(last=False)
+                    counters[1] += 1
+                window = windows[client_ip] = ClientWindow(self.window_capacity)
+            else:
+                windows.move_to_end(client_ip)
+            window.last_seen = current_time
+            window.advance(current_time)
             
-            # Clean old entries
-            self._clean_old_entries(client_ip, current_time)
-            
-            # Get request history
-            request_history = self.request_times[client_ip]
-            
-            # Check minute rate limit
-            minute_ago = current_time - 60
-            recent_requests = sum(1 for t in request_history if t > minute_ago)
-            
-            if recent_requests >= self.requests_per_minute:
-                self._update_load_status()
-                return False, self._get_rate_limit_message("minute", self.requests_per_minute)
-            
-            # Check hourly rate limit
-            hour_ago = current_time - 3600
-            hourly_requests = sum(1 for t in request_history if t > hour_ago)
-            
-            if hourly_requests >= self.requests_per_hour:
-                self._update_load_status()
-                return False, self._get_rate_limit_message("hour", self.requests_per_hour)
-            
-            # Check daily rate limit
-            day_ago = current_time - 86400  # 24 hours in seconds
-            daily_requests = sum(1 for t in request_history if t > day_ago)
-            
-            if daily_requests >= self.requests_per_day:
-                self._update_load_status()
-                return False, self._get_rate_limit_message("day", self.requests_per_day)
+            # Check minute, hourly and daily rate limits
+            minute_count = window.minute_count()
+            if minute_count >= self.requests_per_minute:
+                return False, self._get_rate_limit_message("minute", self.requests_per_minute), minute_count
+            if window.hour_count() >= self.requests_per_hour:
+                return False, self._get_rate_limit_message("hour", self.requests_per_hour), minute_count
+            if window.day_count() >= self.requests_per_day:
+                return False, self._get_rate_limit_message("day", self.requests_per_day), minute_count
             
             # Check burst limit
-            if not self._check_burst_limit(client_ip, current_time):
-                return False, "Too many requests in a short time. Please slow down your requests."
+            if not self._check_burst_limit(window, current_time):
+                return False, "Too many requests in a short time. Please slow down your requests.", minute_count
             
             # Record the request
-            request_history.append(current_time)
-            self._update_load_status()
-            
-            return True, ""
-    
-    def _clean_old_entries(self, client_ip: str, current_time: float):
-        """Remove entries older than 24 hours"""
-        day_ago = current_time - 86400  # 24 hours
-        request_history = self.request_times[client_ip]
-        
-        # Remove old entries
-        while request_history and request_history[0] < day_ago:
-            request_history.popleft()
+            window.record(current_time)
+            return True, "", minute_count + 1
     
-    def _check_burst_limit(self, client_ip: str, current_time: float) -> bool:
+    def _check_burst_limit(self, window: ClientWindow, current_time: float) -> bool:
         """Check if client is making burst requests"""
-        if client_ip not in self.burst_tracking:
-            self.burst_tracking[client_ip] = (1, current_time)
+        if window.burst_count == 0:
+            window.burst_count, window.burst_start = 1, current_time
             return True
         
-        count, last_time = self.burst_tracking[client_ip]
-        
         # Reset burst tracking if more than 10 seconds have passed
-        if current_time - last_time > 10:
-            self.burst_tracking[client_ip] = (1, current_time)
+        if current_time - window.burst_start > 10:
+            window.burst_count, window.burst_start = 1, current_time
             return True
         
         # Check if within burst window (1 second)
-        if current_time - last_time <= 1:
-            if count >= self.burst_size:
+        if current_time - window.burst_start <= 1:
+            if window.burst_count >= self.burst_size:
                 return False
-            self.burst_tracking[client_ip] = (count + 1, last_time)
+            window.burst_count += 1
         else:
-            self.burst_tracking[client_ip] = (1, current_time)
+            window.burst_count, window.burst_start = 1, current_time
         
         return True
     
-    def _update_load_status(self):
-        """Update system load status based on current request volume"""
-        total_recent_requests = sum(
-            len(requests) for requests in self.request_times.values()
-        )
-        max_capacity = len(self.request_times) * self.requests_per_minute
-        
-        if max_capacity > 0:
-            load_ratio = total_recent_requests / max_capacity
-            self.is_high_load = load_ratio >= self.system_load_threshold
+    @property
+    def is_high_load(self) -> bool:
+        return self.load_monitor.is_high_load()
     
     def _get_rate_limit_message(self, period: str, limit: int) -> str:
         """Generate appropriate rate limit message based on system load"""
@@ -140,12 +236,23 @@ class RateLimiter:
     def get_rate_limit_headers(self, client_ip: str) -> dict:
         """Get rate limit headers for response"""
         current_time = time.time()
-        minute_ago = current_time - 60
-        
-        request_history = self.request_times.get(client_ip, deque())
-        recent_requests = sum(1 for t in request_history if t > minute_ago)
         
-        remaining = max(0, self.requests_per_minute - recent_requests)
+        if self.backend is not None:
+            recent_requests = self.backend.minute_count(client_ip, current_time)
+        else:
+            lock, windows, _ = self._stripe(client_ip)
+            with lock:
+                window = windows.get(client_ip)
+                if window is None:
+                    recent_requests = 0
+                else:
+                    window.advance(current_time)
+                    recent_requests = window.minute_count()
+        return self.rate_limit_headers(recent_requests, current_time)
+    
+    def rate_limit_headers(self, minute_count: int, current_time: float) -> dict:
+        """Headers for a client that has made minute_count requests in the last minute"""
+        remaining = max(0, self.requests_per_minute - minute_count)
         
         # Calculate reset time (next minute boundary)
         reset_time = int(current_time) + (60 - int(current_time) % 60)
@@ -155,7 +262,66 @@ class RateLimiter:
             "X-RateLimit-Remaining": str(remaining),
             "X-RateLimit-Reset": str(reset_time),
         }
-
+    
+    # --- IDLE CLIENT EVICTION --- #
+    def sweep(self, current_time: Optional[float] = None) -> int:
+        """Evict clients idle for longer than the longest window; return how many"""
+        if current_time is None:
+            current_time = time.time()
+        cutoff = current_time - self.idle_ttl
+        evicted = 0
+        for lock, windows, counters in self._stripes:
+            with lock:
+                # Least recently active first, so stop at the first live client
+                while windows:
+                    client_ip, window = next(iter(windows.items()))
+                    if window.last_seen > cutoff:
+                        break
+                    del windows[client_ip]
+                    counters[0] += 1
+                    evicted += 1
+        return evicted
+    
+    def _sweep_loop(self):
+        while not self._stop_sweeper.wait(self.sweep_interval):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"❌ Rate limiter sweep failed: {e}")
+    
+    def close(self):
+        """Stop the background sweeper and release the shared backend"""
+        self._stop_sweeper.set()
+        if self._sweeper is not None:
+            self._sweeper.join(timeout=5)
+        if self.backend is not None:
+            self.backend.close()
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """Tracked client count, approximate memory footprint and eviction counts"""
+        if self.backend is not None:
+            return {**self.backend.stats(), "is_high_load": self.is_high_load}
+        clients = 0
+        memory_bytes = 0
+        evicted_idle = 0
+        shed = 0
+        for lock, windows, counters in self._stripes:
+            with lock:
+                clients += len(windows)
+                memory_bytes += sys.getsizeof(windows) + sum(
+                    sys.getsizeof(client_ip) + sys.getsizeof(window) + sys.getsizeof(window.times)
+                    for client_ip, window in windows.items()
+                )
+                evicted_idle += counters[0]
+                shed += counters[1]
+        return {
+            "clients": clients,
+            "max_clients": self.max_clients,
+            "memory_bytes": memory_bytes,
+            "evicted_idle": evicted_idle,
+            "shed_lru": shed,
+            "is_high_load": self.is_high_load
+        }
 
 import os
 
@@ -165,19 +331,24 @@ rate_limiter = RateLimiter(
     requests_per_minute=int(os.getenv("RATE_LIMIT_PER_MINUTE", "10")),  # Allow more requests per minute
     requests_per_hour=int(os.getenv("RATE_LIMIT_PER_HOUR", "100")),    # Generous hourly limit
     requests_per_day=int(os.getenv("RATE_LIMIT_PER_DAY", "500")),      # Higher daily limit
-    burst_size=int(os.getenv("RATE_LIMIT_BURST_SIZE", "5"))           # Allow more burst requests
+    burst_size=int(os.getenv("RATE_LIMIT_BURST_SIZE", "5")),          # Allow more burst requests
+    max_clients=int(os.getenv("RATE_LIMIT_MAX_CLIENTS", str(DEFAULT_MAX_CLIENTS))),
+    sweep_interval=float(os.getenv("RATE_LIMIT_SWEEP_INTERVAL", "60")),
+    backend=create_rate_limit_backend()                                # RATE_LIMIT_BACKEND: local, mmap or redis
 )
 
 
-async def rate_limit_middleware(request: Request, call_next):
-    """Middleware to enforce rate limiting"""
-    # Get client IP
-    client_ip = request.client.host
-    
-    # Use forwarded IP if behind proxy
+def get_client_ip(request: Request) -> str:
+    """Client IP, preferring the forwarded address when behind a proxy"""
     forwarded_for = request.headers.get("X-Forwarded-For")
     if forwarded_for:
-        client_ip = forwarded_for.split(",")[0].strip()
+        return forwarded_for.split(",")[0].strip()
+    return request.client.host
+
+
+async def rate_limit_middleware(request: Request, call_next):
+    """Middleware to enforce rate limiting"""
+    client_ip = get_client_ip(request)
     
     # Debug logging
     print(f"🔍 Rate limiter: {request.method} {request.url.path} from {client_ip}")
@@ -187,11 +358,10 @@ async def rate_limit_middleware(request: Request, call_next):
         print(f"⚡ Skipping rate limit for: {request.url.path}")
         return await call_next(request)
     
-    # Check rate limit
-    is_allowed, error_message = await rate_limiter.check_rate_limit(client_ip)
+    # Check rate limit; the headers come from the same check
+    is_allowed, error_message, headers = await rate_limiter.check_rate_limit(client_ip)
     
     if not is_allowed:
-        headers = rate_limiter.get_rate_limit_headers(client_ip)
         return JSONResponse(
             status_code=429,
             content={
@@ -202,11 +372,14 @@ async def rate_limit_middleware(request: Request, call_next):
             headers=headers
         )
     
-    # Process request
-    response = await call_next(request)
+    # Process request, counting chat requests as in flight for load tracking
+    if request.url.path == "/chat":
+        with rate_limiter.load_monitor.track_request():
+            response = await call_next(request)
+    else:
+        response = await call_next(request)
     
     # Add rate limit headers to response
-    headers = rate_limiter.get_rate_limit_headers(client_ip)
     for key, value in headers.items():
         response.headers[key] = value
     
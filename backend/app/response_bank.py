@@ -0,0 +1,203 @@
+import os
+import json
+import math
+import time
+import zlib
+import random
+import struct
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- FILE LAYOUT --- #
+# header (magic, version, index length) | JSON index | entry table | payload
+# The index maps "emotion/language" to a [first entry, count] range of the
+# entry table; each entry is (id, payload offset, length) and its payload is
+# the zlib-compressed reply text. Only the header, index and table are
+# parsed on open; replies are decompressed when picked
+BANK_MAGIC = b"QCRB"
+BANK_VERSION = 1
+BANK_HEADER = struct.Struct("<4sHI")
+BANK_ENTRY = struct.Struct("<QII")
+
+# Replies carry this placeholder where the user's name goes
+NAME_PLACEHOLDER = "{name}"
+
+# Entries closer than this (cosine similarity) to a kept one are duplicates
+DEFAULT_DEDUP_THRESHOLD = 0.9
+
+Vector = List[float]
+Bucket = Tuple[str, str]
+
+
+def bucket_key(emotion: str, language: str) -> str:
+    return f"{emotion}/{language}"
+
+
+def entry_id(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def personalize(text: str, name: str) -> str:
+    """Fill a bank reply in for one user"""
+    return text.replace(NAME_PLACEHOLDER, name or "Friend")
+
+
+class ResponseBank:
+    """Read side of a pre-generated reply bank file"""
+
+    def __init__(self, data: bytes, path: str = ""):
+        magic, version, index_length = BANK_HEADER.unpack_from(data, 0)
+        if magic != BANK_MAGIC or version != BANK_VERSION:
+            raise ValueError(f"Not a version {BANK_VERSION} response bank: {path or 'data'}")
+        index_start = BANK_HEADER.size
+        self.index: Dict[str, Any] = json.loads(data[index_start:index_start + index_length])
+        self.buckets: Dict[str, List[int]] = self.index["buckets"]
+        self.entry_count = self.index["entries"]
+        self._table_start = index_start + index_length
+        self._payload_start = self._table_start + self.entry_count * BANK_ENTRY.size
+        self._data = data
+        self.path = path
+
+    @classmethod
+    def open(cls, path: str) -> Optional["ResponseBank"]:
+        """Load a bank file; None if it is missing or unreadable"""
+        try:
+            data = Path(path).read_bytes()
+        except FileNotFoundError:
+            return None
+        try:
+            bank = cls(data, path)
+        except (ValueError, struct.error) as e:
+            logger.error(f"Ignoring unreadable response bank {path}: {e}")
+            return None
+        logger.info(f"Loaded response bank {path}: {bank.entry_count} replies in {len(bank.buckets)} buckets")
+        return bank
+
+    def count(self, emotion: str, language: str) -> int:
+        return self.buckets.get(bucket_key(emotion, language), (0, 0))[1]
+
+    def entry(self, index: int) -> Tuple[int, str]:
+        """(id, text) of one entry"""
+        ident, offset, length = BANK_ENTRY.unpack_from(self._data, self._table_start + index * BANK_ENTRY.size)
+        start = self._payload_start + offset
+        return ident, zlib.decompress(self._data[start:start + length]).decode("utf-8")
+
+    def pick(self, emotion: str, language: str, exclude: Optional[Callable[[str], bool]] = None,
+             rng: Optional[random.Random] = None) -> Optional[Tuple[int, str]]:
+        """A random entry of the bucket that exclude() does not reject, or None.
+
+        Entries are tried from a random position onward, so a pick
+        decompresses only as many replies as it has to skip.
+        """
+        first, count = self.buckets.get(bucket_key(emotion, language), (0, 0))
+        if not count:
+            return None
+        start = (rng or random).randrange(count)
+        for step in range(count):
+            ident, text = self.entry(first + (start + step) % count)
+            if exclude is None or not exclude(text):
+                return ident, text
+        return None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            "path": self.path,
+            "entries": self.entry_count,
+            "buckets": {key: count for key, (_, count) in self.buckets.items()},
+            "bytes": len(self._data),
+            "created": self.index.get("created"),
+        }
+
+
+def write_bank(path: str, buckets: Dict[Bucket, Sequence[str]], meta: Optional[Dict[str, Any]] = None) -> int:
+    """Write replies grouped by (emotion, language); returns the file size"""
+    table = []
+    payload = []
+    offset = 0
+    index_buckets = {}
+    for (emotion, language), texts in sorted(buckets.items()):
+        index_buckets[bucket_key(emotion, language)] = [len(table), len(texts)]
+        for text in texts:
+            blob = zlib.compress(text.encode("utf-8"), 9)
+            table.append(BANK_ENTRY.pack(entry_id(text), offset, len(blob)))
+            payload.append(blob)
+            offset += len(blob)
+
+    index = json.dumps(
+        {"buckets": index_buckets, "entries": len(table), "created": time.time(), **(meta or {})},
+        separators=(",", ":")
+    ).encode("utf-8")
+    data = BANK_HEADER.pack(BANK_MAGIC, BANK_VERSION, len(index)) + index + b"".join(table) + b"".join(payload)
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temp_path = f"{path}.tmp"
+    with open(temp_path, "wb") as f:
+        f.write(data)
+    os.replace(temp_path, path)
+    return len(data)
+
+
+# --- OFFLINE GENERATION --- #
+def generate_replies(generate: Callable[[str], str], jobs: Sequence[Tuple[Bucket, str]],
+                     concurrency: int = 4, retries: int = 2,
+                     progress: Optional[Callable[[int, int], None]] = None) -> Dict[Bucket, List[str]]:
+    """Run (bucket, prompt) jobs through generate() with at most `concurrency`
+    calls in flight; failed jobs are retried with backoff, then skipped"""
+
+    def run(prompt: str) -> Optional[str]:
+        for attempt in range(retries + 1):
+            try:
+                return generate(prompt)
+            except Exception as e:
+                if attempt == retries:
+                    logger.warning(f"Bank generation failed: {e}")
+                    return None
+                time.sleep(2 ** attempt)
+        return None
+
+    results: Dict[Bucket, List[str]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        futures = {executor.submit(run, prompt): bucket for bucket, prompt in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            text = future.result()
+            if text:
+                results.setdefault(futures[future], []).append(text)
+            if progress is not None:
+                progress(done, len(futures))
+    return results
+
+
+def hashed_embedding(text: str, dims: int = 256) -> Vector:
+    """Character-trigram hashing embedding; a dependency-free stand-in for
+    a sentence embedding model when deduplicating"""
+    vector = [0.0] * dims
+    text = " ".join(text.lower().split())
+    for i in range(len(text) - 2):
+        digest = hashlib.blake2b(text[i:i + 3].encode("utf-8"), digest_size=4).digest()
+        vector[int.from_bytes(digest, "little") % dims] += 1.0
+    return vector
+
+
+def _normalized(vector: Iterable[float]) -> Vector:
+    vector = [float(x) for x in vector]
+    norm = math.sqrt(sum(x * x for x in vector)) or 1.0
+    return [x / norm for x in vector]
+
+
+def deduplicate(texts: Sequence[str], embed: Callable[[Sequence[str]], Sequence[Iterable[float]]],
+                threshold: float = DEFAULT_DEDUP_THRESHOLD) -> List[str]:
+    """Keep texts in order, dropping any too similar to one already kept"""
+    kept: List[str] = []
+    kept_vectors: List[Vector] = []
+    for text, vector in zip(texts, embed(texts)):
+        vector = _normalized(vector)
+        if any(sum(a * b for a, b in zip(vector, other)) >= threshold for other in kept_vectors):
+            continue
+        kept.append(text)
+        kept_vectors.append(vector)
+    return kept
@@ -0,0 +1,194 @@
+import re
+from typing import Iterable, Iterator
+
+# --- PRECOMPILED CLEANING RULES --- #
+# Remove asterisks used for bold/emphasis
+EMPHASIS_RE = re.compile(r'\*+([^*]+)\*+')
+# Remove markdown-style headers (### Header, ## Header, # Header)
+HEADER_RE = re.compile(r'^#+\s*(.+)$', re.MULTILINE)
+# Remove dashes used for emphasis or bullets at start of lines
+BULLET_RE = re.compile(r'^\s*[-–—]\s*', re.MULTILINE)
+# Remove excessive underscores
+UNDERSCORE_RE = re.compile(r'_{2,}')
+# Clean up multiple spaces and newlines
+BLANK_LINES_RE = re.compile(r'\n{3,}')
+SPACES_RE = re.compile(r' {2,}')
+
+# A line holding nothing but header marks lets HEADER_RE reach into the next line
+BARE_HEADER_RE = re.compile(r'#+')
+
+# Characters that may start a line the line-level rules could still rewrite
+UNSAFE_LINE_STARTS = frozenset('#-–—_')
+
+
+def _clean_lines(text: str) -> str:
+    """Apply every rule after emphasis removal, in the original order"""
+    text = HEADER_RE.sub(r'\1', text)
+    text = BULLET_RE.sub('', text)
+    text = UNDERSCORE_RE.sub('', text)
+    text = BLANK_LINES_RE.sub('\n\n', text)
+    text = SPACES_RE.sub(' ', text)
+    return text
+
+
+def clean_ai_response(text: str) -> str:
+    """Clean AI response from formatting characters like asterisks, dashes, etc."""
+    if not text:
+        return text
+
+    text = EMPHASIS_RE.sub(r'\1', text)
+    text = _clean_lines(text)
+
+    # Remove leading/trailing whitespace
+    return text.strip()
+
+
+class StreamingResponseSanitizer:
+    """Incremental version of clean_ai_response for chunked generation.
+
+    Feed generation chunks in order with feed(); each call returns the
+    cleaned text that can no longer change, and finish() returns the rest.
+    The concatenated output is identical to clean_ai_response() on the full
+    text. Text is held back only while an emphasis span is still open or
+    while the current line (or run of header/bullet lines) is incomplete.
+    """
+
+    def __init__(self):
+        # Raw text not yet run through EMPHASIS_RE
+        self._raw = ""
+        # Emphasis scanner state for the unprocessed tail of self._raw
+        self._in_run = False
+        self._inside = False
+        # Emphasis-free text waiting for a safe line boundary, and how far
+        # back into it cut candidates have already been rejected
+        self._lines = ""
+        self._checked = 0
+        # Strip bookkeeping
+        self._started = False
+        self._pending_ws = ""
+        self._finished = False
+
+    def feed(self, chunk: str) -> str:
+        """Consume a generation chunk and return newly finalized clean text"""
+        if self._finished:
+            raise RuntimeError("Sanitizer has already been finished")
+        if not chunk:
+            return ""
+
+        scan_from = len(self._raw)
+        self._raw += chunk
+        cut = self._scan_emphasis(scan_from)
+        if cut:
+            self._lines += EMPHASIS_RE.sub(r'\1', self._raw[:cut])
+            self._raw = self._raw[cut:]
+
+        cut = self._find_line_cut()
+        if not cut:
+            return ""
+
+        block = _clean_lines(self._lines[:cut])
+        self._lines = self._lines[cut:]
+        self._checked = max(0, self._checked - cut)
+        return self._emit(block, final=False)
+
+    def finish(self) -> str:
+        """Flush all held-back text at the end of generation"""
+        if self._finished:
+            return ""
+        self._finished = True
+
+        if self._raw:
+            self._lines += EMPHASIS_RE.sub(r'\1', self._raw)
+            self._raw = ""
+
+        block = _clean_lines(self._lines)
+        self._lines = ""
+        return self._emit(block, final=True)
+
+    def _scan_emphasis(self, start: int) -> int:
+        """Advance the emphasis scanner; return the last safe cut in self._raw.
+
+        EMPHASIS_RE pairs maximal asterisk runs left to right, so a prefix is
+        final once every run in it has been closed.
+        """
+        raw = self._raw
+        cut = 0
+        in_run = self._in_run
+        inside = self._inside
+
+        for i in range(start, len(raw)):
+            if raw[i] == '*':
+                in_run = True
+                continue
+            if in_run:
+                in_run = False
+                # A finished run either opens a span or closes the open one
+                inside = not inside
+            if not inside:
+                cut = i + 1
+
+        self._in_run = in_run
+        self._inside = inside
+        return cut
+
+    def _find_line_cut(self) -> int:
+        """Return the last line start where the line-level rules can be split.
+
+        A cut before position c is safe when c starts a line whose first
+        character none of the rules can rewrite, and the preceding text does
+        not end in a bare header that HEADER_RE would extend across lines.
+        """
+        lines = self._lines
+        # Cuts need to see the character after the newline
+        c = len(lines) - 1
+        while c > self._checked:
+            newline = lines.rfind('\n', self._checked, c)
+            if newline < 0:
+                break
+            c = newline + 1
+            first = lines[c]
+            if not first.isspace() and first not in UNSAFE_LINE_STARTS and not self._ends_with_bare_header(c):
+                self._checked = len(lines) - 1
+                return c
+            c = newline
+        self._checked = max(self._checked, len(lines) - 1)
+        return 0
+
+    def _ends_with_bare_header(self, end: int) -> bool:
+        lines = self._lines
+        k = end
+        while k > 0 and lines[k - 1].isspace():
+            k -= 1
+        line_start = lines.rfind('\n', 0, k) + 1
+        return BARE_HEADER_RE.fullmatch(lines, line_start, k) is not None
+
+    def _emit(self, block: str, final: bool) -> str:
+        """Apply the final strip() across chunk boundaries"""
+        if not self._started:
+            block = block.lstrip()
+            if not block:
+                return ""
+            self._started = True
+
+        body = block.rstrip()
+        trailing = block[len(body):]
+        if not body:
+            self._pending_ws += trailing
+            return ""
+
+        out = self._pending_ws + body
+        self._pending_ws = "" if final else trailing
+        return out
+
+
+def sanitize_stream(chunks: Iterable[str]) -> Iterator[str]:
+    """Yield cleaned text from a stream of generation chunks"""
+    sanitizer = StreamingResponseSanitizer()
+    for chunk in chunks:
+        cleaned = sanitizer.feed(chunk)
+        if cleaned:
+            yield cleaned
+    tail = sanitizer.finish()
+    if tail:
+        yield tail
+
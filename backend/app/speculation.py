@@ -0,0 +1,142 @@
+import os
+import time
+import logging
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional
+
+from app.cost_quota import LLMCostMeter, current_meter, metered_request
+from app.deadline import Deadline
+
+logger = logging.getLogger(__name__)
+
+# Separate from the deadline pool: speculative work itself waits on calls
+# run there, and must never hold the workers those calls need
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=int(os.getenv("SPECULATION_WORKERS", "8")),
+                thread_name_prefix="speculation"
+            )
+        return _executor
+
+
+class SpeculationStats:
+    """What speculation buys (latency saved) and costs (tokens thrown away)"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = 0
+        self.skipped = 0
+        self.kept = 0
+        self.discarded = 0
+        self.saved_seconds = 0.0
+        self.kept_tokens = 0
+        self.wasted_calls = 0
+        self.wasted_tokens = 0
+
+    def record_started(self):
+        with self.lock:
+            self.started += 1
+
+    def record_skipped(self):
+        with self.lock:
+            self.skipped += 1
+
+    def record_kept(self, saved_seconds: float, meter: Optional[LLMCostMeter]):
+        with self.lock:
+            self.kept += 1
+            self.saved_seconds += saved_seconds
+            self.kept_tokens += meter.tokens if meter else 0
+
+    def record_discarded(self, meter: Optional[LLMCostMeter]):
+        with self.lock:
+            self.discarded += 1
+        if meter is not None:
+            self.record_wasted(meter)
+
+    def record_wasted(self, meter: LLMCostMeter):
+        with self.lock:
+            self.wasted_calls += meter.calls
+            self.wasted_tokens += meter.tokens
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            resolved = self.kept + self.discarded
+            return {
+                "started": self.started,
+                "skipped_under_load": self.skipped,
+                "kept": self.kept,
+                "discarded": self.discarded,
+                "hit_rate": round(self.kept / resolved, 3) if resolved else None,
+                "saved_seconds": round(self.saved_seconds, 3),
+                "avg_saved_seconds": round(self.saved_seconds / self.kept, 3) if self.kept else 0.0,
+                "kept_tokens": self.kept_tokens,
+                "wasted_calls": self.wasted_calls,
+                "wasted_tokens": self.wasted_tokens,
+                # Tokens thrown away per second of latency saved
+                "wasted_tokens_per_saved_second": (
+                    round(self.wasted_tokens / self.saved_seconds, 1) if self.saved_seconds else None
+                ),
+            }
+
+
+class Speculation:
+    """Work started before it is known to be needed.
+
+    fn runs on a worker thread as soon as the speculation is created, with
+    its LLM cost metered on its own (and still charged to the enclosing
+    request). Once the prediction is confirmed take() returns the result,
+    waiting for it if needed; otherwise discard() throws it away and
+    cancels `deadline`, which fn's calls should run under, in its own
+    cancel scope.
+    """
+
+    def __init__(self, prediction: Any, fn: Callable[..., Any], *args: Any,
+                 deadline: Optional[Deadline] = None, stats: Optional[SpeculationStats] = None, **kwargs: Any):
+        self.prediction = prediction
+        self.deadline = deadline
+        self.stats = stats
+        self.meter = LLMCostMeter(parent=current_meter())
+        self.started_at = time.monotonic()
+        self.finished_at: Optional[float] = None
+        if stats is not None:
+            stats.record_started()
+        self.future = _get_executor().submit(contextvars.copy_context().run, self._run, fn, args, kwargs)
+
+    def _run(self, fn: Callable[..., Any], args: tuple, kwargs: Dict[str, Any]) -> Any:
+        with metered_request(self.meter):
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.finished_at = time.monotonic()
+
+    def take(self) -> Any:
+        """The result (or exception) of fn, now that it is needed"""
+        claimed_at = time.monotonic()
+        try:
+            return self.future.result()
+        finally:
+            # The work would otherwise have started at claimed_at
+            saved = min(self.finished_at or claimed_at, claimed_at) - self.started_at
+            if self.stats is not None:
+                self.stats.record_kept(saved, self.meter)
+            logger.info(f"Speculation on {self.prediction!r} kept, saved {saved:.2f}s")
+
+    def discard(self):
+        """Throw the work away and stop it at its next deadline-aware call.
+        A model call already in flight cannot be stopped; its cost is counted
+        as wasted (and charged to the request) when it returns."""
+        logger.info(f"Speculation on {self.prediction!r} discarded")
+        self.future.cancel()
+        if self.deadline is not None:
+            self.deadline.cancel("speculation_discarded")
+        if self.stats is not None:
+            self.stats.record_discarded(self.meter.settle(self.stats.record_wasted))
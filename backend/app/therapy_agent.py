@@ -1,50 +1,31 @@
 import os
 import logging
 import random
-import time
 import json
 import hashlib
-import re
-from typing import TypedDict, Optional, Dict, List, Any
+from typing import TypedDict, Optional, Dict, List, Any, Callable, Tuple
 from datetime import datetime, timedelta
 
 from dotenv import load_dotenv
 import google.generativeai as genai
 from langgraph.graph import StateGraph
-from app.rag_system import rag_manager
+from app.rag_system import SimpleRAGDocumentManager, rag_manager
 from app.context_manager import context_manager
+from app.language_id import language_identifier
+from app.response_sanitizer import clean_ai_response
+from app.prompt_builder import PromptTemplate, join_within_budget, timed_generate
+from app.classification import CLASSIFY_OUTPUT_FORMAT, DISTRESS_EMOTIONS, ClassificationFailed, classification_stats, classify_generation_config
+from app.deadline import REQUEST_DEADLINE_SECONDS, Deadline, DeadlineExceeded
+from app.user_memory import UserSnapshot, user_memory
+from app.load_monitor import load_monitor
+from app.degraded_mode import DegradedMode, degraded_mode_setting, format_haram_template
+from app.response_bank import ResponseBank, personalize
+from app.speculation import Speculation, SpeculationStats
 
 # --- LOGGING SETUP --- #
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# --- RESPONSE CLEANING UTILITY --- #
-def clean_ai_response(text: str) -> str:
-    """Clean AI response from formatting characters like asterisks, dashes, etc."""
-    if not text:
-        return text
-    
-    # Remove asterisks used for bold/emphasis
-    text = re.sub(r'\*+([^*]+)\*+', r'\1', text)
-    
-    # Remove markdown-style headers (### Header, ## Header, # Header)
-    text = re.sub(r'^#+\s*(.+)$', r'\1', text, flags=re.MULTILINE)
-    
-    # Remove dashes used for emphasis or bullets at start of lines
-    text = re.sub(r'^\s*[-–—]\s*', '', text, flags=re.MULTILINE)
-    
-    # Remove excessive underscores
-    text = re.sub(r'_{2,}', '', text)
-    
-    # Clean up multiple spaces and newlines
-    text = re.sub(r'\n{3,}', '\n\n', text)
-    text = re.sub(r' {2,}', ' ', text)
-    
-    # Remove leading/trailing whitespace
-    text = text.strip()
-    
-    return text
-
 # --- STATE TYPE --- #
 class TherapyState(TypedDict, total=False):
     user_id: str
@@ -53,6 +34,18 @@ class TherapyState(TypedDict, total=False):
     emotion: Optional[str]
     dua: Optional[str]
     response: Optional[str]
+    response_type: Optional[str]
+    story_key: Optional[str]
+    # Set when the reply was assembled from curated templates without the LLM
+    degraded_reason: Optional[str]
+    # Request deadline from the HTTP layer; each node takes a sub-budget of it
+    deadline: Deadline
+    # Counseling reply drafted while classification runs, and the response
+    # bank coin tossed when it was started
+    speculation: Speculation
+    bank_draw: float
+    # Per-request unit of work over the user's memory entry
+    user_snapshot: UserSnapshot
 
 # --- ENV + MODEL CONFIG --- #
 load_dotenv()
@@ -86,37 +79,37 @@ for model_name in MODELS_TO_TRY:
 if model is None:
     raise EnvironmentError("None of the Gemini models could be initialized")
 
+# --- DEADLINES --- #
+# Most each node may spend of the request deadline; a node never gets more
+# than what is left of it
+NODE_BUDGETS = {
+    "handle_memory": 1.0,
+    "detect_emotion": 6.0,
+    "get_dua": 0.5,
+    "generate_reply": 20.0,
+}
+RAG_BUDGET_SECONDS = 3.0
+
+def node_deadline(state: TherapyState, node: str, cancel_scope: bool = False) -> Deadline:
+    """The node's sub-budget of the request deadline"""
+    deadline = state.get("deadline")
+    if deadline is None:
+        # Invoked without the HTTP layer (scripts, tests): the default budget
+        deadline = state["deadline"] = Deadline(REQUEST_DEADLINE_SECONDS)
+    return deadline.child(node, NODE_BUDGETS[node], cancel_scope=cancel_scope)
+
+def failure_reason(error: Exception) -> str:
+    """Degraded-reply reason for a failed generation"""
+    return "deadline" if isinstance(error, DeadlineExceeded) else "llm_error"
+
 # --- MEMORY STATE --- #
-memory = {}
+# Bounded LRU + idle-TTL store; see app/user_memory.py for limits
+memory = user_memory
 
-# --- LANGUAGE DETECTION (Conservative) --- #
+# --- LANGUAGE DETECTION --- #
 def detect_language(text: str) -> str:
-    """Conservative language detection - defaults to English for safety"""
-    text = text.strip().lower()
-    
-    # First check for clear English indicators - if found, it's definitely English
-    english_indicators = [
-        "i am", "i'm", "i feel", "i'm feeling", "feeling", "my", "me", "you", "the", "and", "or", "but", "with", "have", "has", "do", "does", "can", "will", "would", "should", "could", "to", "from", "in", "on", "at", "for", "about", "very", "really", "so", "much", "more", "most", "some", "any", "all", "no", "not", "what", "how", "why", "when", "where", "who", "which", "that", "this", "these", "those", "am", "is", "are", "was", "were", "been", "being", "sad", "happy", "angry", "anxious", "depressed", "worried", "scared", "lonely", "tired", "upset", "hurt", "pain", "help", "need", "want", "like", "love", "hate", "good", "bad", "better", "worse", "best", "worst", "hello", "hi", "hey", "thanks", "thank", "please", "sorry", "excuse", "today", "tomorrow", "yesterday", "now", "then", "here", "there", "always", "never", "sometimes", "usually", "often", "maybe", "perhaps", "probably", "definitely", "certainly", "absolutely", "exactly", "only", "just", "still", "already", "yet", "again", "back", "away", "up", "down", "over", "under", "through", "around", "between", "among", "during", "before", "after", "since", "until", "while", "although", "because", "if", "unless", "whether", "either", "neither", "both", "each", "every", "many", "few", "little", "enough", "too", "quite", "rather", "pretty", "fairly", "extremely", "incredibly", "amazingly", "surprisingly", "unfortunately", "hopefully", "actually", "basically", "generally", "specifically", "particularly", "especially", "obviously", "clearly", "apparently", "probably", "possibly", "certainly", "definitely", "absolutely", "completely", "totally", "fully", "partially", "slightly", "somewhat", "quite", "rather", "pretty", "fairly", "really", "very", "extremely", "incredibly", "amazingly", "surprisingly", "unfortunately", "hopefully", "actually", "basically", "generally", "specifically", "particularly", "especially", "obviously", "clearly", "apparently"
-    ]
-    
-    # Check if text contains clear English indicators
-    for indicator in english_indicators:
-        if indicator in text:
-            return "english"
-    
-    # Only very clear Roman Urdu indicators (must be complete words)
-    clear_urdu_words = ["mein", "hun", "hai", "kya", "nahi", "bohat", "kaise", "theek", "accha", "bura", "kaun", "kahan", "kab", "kyun", "kuch", "sab", "yeh", "woh", "aur", "lekin", "phir", "abhi", "kal", "raat", "din", "ghar", "dost", "dil", "mohabbat", "khushi", "gham", "pareshani", "masla", "madad", "chahiye", "hoga", "tha", "tha", "thi", "thay", "main", "mera", "mere", "meri", "tumhara", "tumhare", "tumhari", "uska", "uske", "uski", "humara", "humare", "humari"]
-    
-    # Split into words and check for complete word matches
-    words = text.split()
-    urdu_count = sum(1 for word in words if word in clear_urdu_words)
-    
-    # Only use Roman Urdu for very clear cases with multiple Urdu words
-    if urdu_count >= 2 and len(words) <= 10:  # At least 2 clear Urdu words
-        return "roman_urdu"
-    
-    # Default to English for everything else (much safer)
-    return "english"
+    """Detect English, Roman Urdu or Urdu script using the n-gram language identifier"""
+    return language_identifier.classify(text)
 
 # --- DYNAMIC TONE GENERATOR --- #
 def generate_prompt_flavor():
@@ -190,6 +183,30 @@ def detect_islamic_question(text: str) -> bool:
     return any(pattern in text for pattern in islamic_question_patterns)
 
 # --- GREETING DETECTION --- #
+# Words and phrases that signal emotional distress
+EMOTIONAL_INDICATORS = [
+    "depressed", "depression", "sad", "sadness", "anxious", "anxiety", "worried", "worry",
+    "scared", "fear", "angry", "frustrated", "upset", "hurt", "pain", "suffering",
+    "lonely", "alone", "hopeless", "helpless", "lost", "confused", "overwhelmed",
+    "tired", "exhausted", "guilty", "shame", "regret", "suicidal", "die", "death",
+    "cry", "crying", "tears", "broken", "empty", "numb", "stressed", "stress",
+    "feeling", "feel", "emotion", "mood", "mental", "psychological",
+    "pointless", "meaningless", "useless", "worthless", "don't get what i want",
+    "nothing works", "can't do anything", "everything seems", "nothing matters",
+    "what's the point", "no point", "give up", "can't take it", "fed up",
+    "disappointed", "devastated", "heartbroken", "miserable", "desperate",
+    "struggling", "can't cope", "falling apart", "breaking down", "can't handle",
+    "trouble", "problem", "issue", "difficult", "hard time", "tough", "rough",
+    "failed", "failure", "losing", "lost everything", "ruined", "destroyed",
+    "hate myself", "hate my life", "wish i was", "wish i could", "if only",
+    "unlucky", "cursed", "doomed", "fate", "destiny", "why me", "unfair"
+]
+
+def has_emotional_indicator(text: str) -> bool:
+    """Local distress signal: an emotional keyword or phrase in the message"""
+    text = text.lower()
+    return any(indicator in text for indicator in EMOTIONAL_INDICATORS)
+
 def is_greeting_or_small_talk(text: str) -> bool:
     """Detect if message is just greeting or small talk"""
     text = text.strip().lower()
@@ -198,29 +215,9 @@ def is_greeting_or_small_talk(text: str) -> bool:
     if detect_islamic_question(text):
         return False
     
-    # Check for emotional distress indicators - these are NOT greetings
-    emotional_indicators = [
-        "depressed", "depression", "sad", "sadness", "anxious", "anxiety", "worried", "worry",
-        "scared", "fear", "angry", "frustrated", "upset", "hurt", "pain", "suffering",
-        "lonely", "alone", "hopeless", "helpless", "lost", "confused", "overwhelmed",
-        "tired", "exhausted", "guilty", "shame", "regret", "suicidal", "die", "death",
-        "cry", "crying", "tears", "broken", "empty", "numb", "stressed", "stress",
-        "feeling", "feel", "emotion", "mood", "mental", "psychological",
-        "pointless", "meaningless", "useless", "worthless", "don't get what i want",
-        "nothing works", "can't do anything", "everything seems", "nothing matters",
-        "what's the point", "no point", "give up", "can't take it", "fed up",
-        "disappointed", "devastated", "heartbroken", "miserable", "desperate",
-        "struggling", "can't cope", "falling apart", "breaking down", "can't handle",
-        "trouble", "problem", "issue", "difficult", "hard time", "tough", "rough",
-        "failed", "failure", "losing", "lost everything", "ruined", "destroyed",
-        "hate myself", "hate my life", "wish i was", "wish i could", "if only",
-        "unlucky", "cursed", "doomed", "fate", "destiny", "why me", "unfair"
-    ]
-    
-    # If it contains emotional indicators, it's NOT a greeting
-    for indicator in emotional_indicators:
-        if indicator in text:
-            return False
+    # Emotional distress indicators - these are NOT greetings
+    if has_emotional_indicator(text):
+        return False
     
     greeting_patterns = [
         "hello", "hi", "hey", "salam", "assalam", "assalamu alaikum", "wa alaikum",
@@ -322,15 +319,19 @@ HARAM_CONTENT_EXAMPLES = {
     ]
 }
 
-# --- AI-BASED EMOTION DETECTION NODE --- #
-def classify_emotion(state: TherapyState) -> TherapyState:
-    user_msg = state["message"]
-    
-    # Use AI to comprehensively analyze the message
-    prompt = f"""
+# --- PROMPT TEMPLATES --- #
+# Static text and example lists are rendered once at import; per-request
+# sections are trimmed to these token budgets
+USER_CONTEXT_TOKEN_BUDGET = 150
+USED_STORIES_TOKEN_BUDGET = 100
+RAG_CONTEXT_TOKEN_BUDGET = 200
+
+CLASSIFY_PROMPT = PromptTemplate(
+    "classify_emotion",
+    """
 Analyze this user message and categorize it into one of these types:
 
-User message: \"{user_msg}\"
+User message: "{user_msg}"
 
 Categories:
 1. "greeting" - Casual greetings, small talk, introductions, getting to know questions, identity questions
@@ -341,10 +342,10 @@ Categories:
 
 For reference (but don't limit yourself to these examples):
 
-Greeting examples: {', '.join(GREETING_EXAMPLES[:10])}...
-Emotional distress examples: {', '.join(EMOTIONAL_DISTRESS_EXAMPLES[:10])}...
-Islamic question examples: {', '.join(ISLAMIC_QUESTION_EXAMPLES[:5])}...
-Haram content examples: {', '.join(HARAM_CONTENT_EXAMPLES['relationship'][:5])}...
+Greeting examples: {greeting_examples}...
+Emotional distress examples: {distress_examples}...
+Islamic question examples: {islamic_examples}...
+Haram content examples: {haram_examples}...
 
 IMPORTANT: Look beyond exact word matches. Understand the INTENT and CONTEXT:
 - Someone saying "I'm not feeling good" is emotional distress, not neutral
@@ -354,67 +355,208 @@ IMPORTANT: Look beyond exact word matches. Understand the INTENT and CONTEXT:
 - Consider cultural and linguistic variations
 
 First, determine the category. Then if it's "emotional_distress", also identify the specific emotion from:
-["sad", "angry", "anxious", "tired", "lonely", "guilty", "empty", "hopeless", "happy", "confused", "overwhelmed", "peaceful", "grateful"]
+{distress_emotions}
+
+{output_format}
+    """,
+    distress_emotions=json.dumps(list(DISTRESS_EMOTIONS)),
+    output_format=CLASSIFY_OUTPUT_FORMAT,
+    greeting_examples=', '.join(GREETING_EXAMPLES[:10]),
+    distress_examples=', '.join(EMOTIONAL_DISTRESS_EXAMPLES[:10]),
+    islamic_examples=', '.join(ISLAMIC_QUESTION_EXAMPLES[:5]),
+    haram_examples=', '.join(HARAM_CONTENT_EXAMPLES['relationship'][:5])
+)
 
-Return your analysis in this format:
-Category: [category]
-Emotion: [emotion if emotional_distress, otherwise "none"]
-Reasoning: [brief explanation of why you classified it this way]
+GREETING_PROMPT = PromptTemplate(
+    "greeting",
     """
+You are Mustafa, an Islamic therapist developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community, to mend and heal hearts.
+
+The user just sent a non-emotional message (small talk or casual conversation).
+
+User context from memory:
+{user_context}
+
+Current message: "{user_msg}"
+
+IMPORTANT: Respond naturally to greetings based on the context and past interactions, without always using the same format.
+
+Specific responses for identity questions:
+
+For "Who are you?" or "Tell me about yourself":
+"I'm Mustafa, an Islamic therapist created to help mend and heal hearts through Islamic guidance and counseling. I was developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community."
+
+For "Who built you?" or "Who created you?" or "Who developed you?":
+"I was developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community. He created me to help provide Islamic counseling and support to those in need."
+
+For "What can you do?":
+"I offer support through listening and drawing from the Seerah, Sunnah, and Quran 🌙"
+
+For "Do you know my name?" or "What's my name?":
+- If name is available in memory: "Of course, your name is {name}!"
+- If no name in memory: "I haven't saved your name yet. What would you like me to call you?"
+
+For general greetings like "Hello", "Hi", "Assalam":
+"I'm here to help you feel supported and heard."
+
+For "How are you?" questions:
+"I'm here to help you feel supported and heard."
+
+Respond genuinely and warmly based on their message and memory context.""",
+    budgets={"user_context": USER_CONTEXT_TOKEN_BUDGET}
+)
+
+HARAM_GUIDANCE_PROMPT = PromptTemplate(
+    "haram_guidance",
+    """
+You are Mustafa, an Islamic therapist. A user is struggling with a haram relationship. Create a compassionate Islamic counseling response following this EXACT structure:
+
+First paragraph: Acknowledge their struggle with connection to Allah's mercy (2-3 lines)
+
+Second paragraph: Reference a Prophet's story or companion's experience that relates to their situation (2-3 lines)
+
+Third paragraph: Write "Here are steps to heal:" then give 4 numbered practical steps
+
+Final paragraph: Provide authentic Arabic dua with transliteration and translation
+
+Use these themes as inspiration but create your own variation:
+- Opening theme: "{opening_theme}..."
+- Story theme: "{story_theme}..."
+- Technique examples: {technique_examples}
+- Dua theme: {dua_theme}
+
+IMPORTANT FORMATTING RULES:
+- NO asterisks (*) anywhere in your response
+- NO bold text or special formatting
+- NO headings like "Opening:" or "Islamic Story:" or "Practical Islamic CBT Techniques:"
+- Just write natural paragraphs and numbered lists
+- Use plain text only
+- Be compassionate but firm about Islamic boundaries
+- Reference specific Quranic concepts like taqwa, repentance, Allah's mercy
+- Include practical CBT techniques adapted for Islamic context
+- Use authentic Arabic dua with proper transliteration
+- Keep the tone warm but spiritually motivating
+
+User's situation: "{user_msg}"
+
+Generate a complete response following the structure above with plain text formatting only."""
+)
+
+COUNSELING_PROMPT = PromptTemplate(
+    "counseling",
+    """
+You are Mustafa, an Islamic counselor specializing in Islamic CBT techniques.
+
+User's name: {name}
+Emotion: {emotion}
+Message: "{user_msg}"
+User context: {user_context}
+{rag_context}
+
+{varied_story_guidance}
+
+Use this opening: "{random_opening}"
+
+Your response MUST follow this format:
+
+[Use the provided opening sentence]
+
+[Choose a UNIQUE Islamic story from prophets, companions, or early Islamic history that relates to {emotion} - 4-5 lines, tell it naturally without citations]
+
+[3-4 practical Islamic CBT techniques - Write them as simple numbered points: 1. [technique] 2. [technique] 3. [technique] 4. [technique]]
+
+[Hopeful closure - 1-2 lines max]
+
+CRITICAL FORMATTING RULES:
+|- No asterisks (*) or headings
+|- Use only plain text and numbered lists
+|- Each technique concise and action-oriented
+|- Keep response under 200 words total
+|- Don't write reference for what you are citing
+
+Story variety examples for {emotion}:
+- If sad: Stories of Prophet Yaqoob (AS), Prophet Ayyub (AS), Companions dealing with loss, etc.
+- If anxious: Stories of Prophet Musa (AS) at the sea, Prophet Ibrahim (AS) facing tests, etc.
+- If lonely: Stories of Prophet Yunus (AS), early Muslim converts who were isolated, etc.
+- If hopeless: Stories of Prophet Yusuf (AS) in prison, early Muslim persecutions turning to victory, etc.
+
+Techniques might include:
+- Dhikr and short du'as for mindfulness
+- Practical gratitude reflections
+- Cognitive shifts with Quranic guidance
+- Immediate actionable, faith-based steps
+
+Frame your response as heartfelt advice from someone grounded in Islamic wisdom and psychology.
+{language_instruction}""",
+    budgets={
+        "user_context": USER_CONTEXT_TOKEN_BUDGET,
+        "rag_context": RAG_CONTEXT_TOKEN_BUDGET
+    }
+)
+
+# --- GENERATION CONFIGS --- #
+# Per-node sampling and output caps: classification is a deterministic,
+# schema-constrained label; the caps on the free-text nodes sit well above
+# their prompts' length limits and only stop runaway generations
+GENERATION_CONFIGS = {
+    "classify_emotion": classify_generation_config(model.model_name),
+    "greeting": {"temperature": 0.7, "max_output_tokens": 256},
+    "haram_guidance": {"temperature": 0.9, "max_output_tokens": 1024},
+    "counseling": {"temperature": 0.9, "max_output_tokens": 1024},
+}
+
+# --- AI-BASED EMOTION DETECTION NODE --- #
+def classify_locally(text: str) -> str:
+    """Static classification from keywords, for when the LLM is unavailable"""
+    if is_greeting_or_small_talk(text):
+        return "greeting"
+    if detect_islamic_question(text):
+        return "islamic_question"
+    if detect_haram_content(text)["has_any_haram"]:
+        return "haram_content"
+    return degraded_mode.detect_emotion(text)
+
+def classify_emotion(state: TherapyState) -> TherapyState:
+    user_msg = state["message"]
+    
+    # The LLM is failing or saturated, or the user is over quota: classify
+    # locally and let generate_counseling serve a curated reply
+    degraded_reason = state.get("degraded_reason") or degraded_mode.reason()
+    if degraded_reason:
+        state["degraded_reason"] = degraded_reason
+        state["emotion"] = classify_locally(user_msg)
+        logging.info(f"Degraded mode ({degraded_reason}): local classification {state['emotion']}")
+        return state
+    
+    # Static instructions and examples are pre-rendered once in CLASSIFY_PROMPT
+    prompt = CLASSIFY_PROMPT.render(user_msg=user_msg)
+    
+    # Clear local distress signals: draft the reply while the classifier runs
+    start_speculation(state)
     
     try:
-        response = model.generate_content(prompt).text.strip()
-        logging.info(f"AI Analysis Response: {response}")
-        
-        # Parse the AI response
-        lines = response.split('\n')
-        category = "neutral"
-        emotion = "neutral"
-        
-        for line in lines:
-            if line.lower().startswith('category:'):
-                category = line.split(':', 1)[1].strip().lower()
-            elif line.lower().startswith('emotion:'):
-                emotion = line.split(':', 1)[1].strip().lower()
-        
-        # Handle different categories
-        if category == "greeting":
-            state["emotion"] = "greeting"
-            logging.info("AI detected as greeting/small talk")
-        elif category == "islamic_question":
-            state["emotion"] = "islamic_question"
-            logging.info("AI detected Islamic question")
-        elif category == "haram_content":
-            state["emotion"] = "haram_content"
-            logging.info("AI detected haram content")
-        elif category == "emotional_distress":
-            # Use the specific emotion detected
-            supported_emotions = ["sad", "angry", "anxious", "tired", "lonely", "guilty", "empty", "hopeless", "happy", "confused", "overwhelmed", "peaceful", "grateful"]
-            
-            # Find which emotion appears in the response
-            detected_emotion = "neutral"
-            for emo in supported_emotions:
-                if emo in emotion:
-                    detected_emotion = emo
-                    break
-            
-            state["emotion"] = detected_emotion
-            logging.info(f"AI detected emotional distress: {detected_emotion}")
-        else:
-            state["emotion"] = "neutral"
-            logging.info("AI detected as neutral")
+        response = timed_generate(
+            model, "classify_emotion", prompt,
+            deadline=node_deadline(state, "detect_emotion"),
+            generation_config=GENERATION_CONFIGS["classify_emotion"]
+        )
         
+        # Category, or the specific emotion for emotional distress; empty,
+        # truncated or off-schema answers raise and fall back to local
+        # classification
+        state["emotion"] = classification_stats.read(response)
+        logging.info(f"AI classified message as {state['emotion']}")
         return state
         
+    except ClassificationFailed as e:
+        logging.warning(f"Unusable classifier answer ({e.reason}), classifying locally: {e}")
+        state["emotion"] = classify_locally(user_msg)
+        return state
     except Exception as e:
+        classification_stats.record_failure(failure_reason(e))
         logging.error(f"Error in AI emotion detection: {e}")
         # Fallback to basic static detection
-        if is_greeting_or_small_talk(user_msg):
-            state["emotion"] = "greeting"
-        elif detect_islamic_question(user_msg):
-            state["emotion"] = "islamic_question"
-        else:
-            state["emotion"] = "neutral"
+        state["emotion"] = classify_locally(user_msg)
         return state
 
 
@@ -534,6 +676,7 @@ DUA_DATASET = {
 
 # --- DUA FETCH NODE --- #
 def fetch_dua(state: TherapyState) -> TherapyState:
+    node_deadline(state, "get_dua").check("get_dua")
     emotion = state.get("emotion")
 
     # If the emotion is neutral or positive, no dua is needed
@@ -592,447 +735,426 @@ def detect_haram_content(text: str) -> dict:
         "has_any_haram": found_haram_relationship or found_haram_general
     }
 
-# --- COUNSELOR RESPONSE NODE --- #
-def generate_counseling(state: TherapyState) -> TherapyState:
-    name = state.get("name", "Friend")
-    emotion = state.get("emotion", "neutral")
-    user_msg = state["message"]
-
-    # Handle greetings and small talk differently
-    if emotion == "greeting":
-        # Determine if greeting is necessary based on prior interactions
-        user_context = get_user_context(state["user_id"])
-
-        greeting_prompt = f"""
-You are Mustafa, an Islamic therapist developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community, to mend and heal hearts.
+# --- HARAM GUIDANCE TEMPLATES --- #
+HARAM_TEMPLATES = [
+    {
+        "opening": "Sometimes, when the heart becomes attached, it forgets its true Owner. But you are never too far gone. Allah is closer to you than your own sadness, and He loves the heart that returns.",
+        "story": "There was a man who gave up everything for a woman he loved, but then remembered his Lord and repented. And Allah raised him higher than those who never fell. Allah says: 'Evil women are for evil men, and pious women for pious men.' And, 'Whoever fears standing before Allah will be granted two gardens.' Imagine the reward when you walk away for Him.",
+        "techniques": [
+            "Write down what you truly want in life — and place Jannah at the top.",
+            "Replace emotional voids with Dhikr. Use Tasbih after Fajr and Maghrib.",
+            "Practice Cognitive Restructuring: When missing them, remind yourself what you're truly missing is nearness to Allah.",
+            "Reduce all triggers — block, unfollow, or even delete, because your soul is more precious."
+        ],
+        "dua": {
+            "arabic": "اللَّهُمَّ اكْفِنِيهِمْ بِمَا شِئْتَ",
+            "transliteration": "Allahumma ikfineehim bima shi'ta",
+            "translation": "O Allah, suffice me against them however You will."
+        }
+    },
+    {
+        "opening": "You feel something inside because your heart still beats with Imaan. Allah sees the struggle — not to be perfect, but to choose Him even with tears in your eyes.",
+        "story": "Do you remember Yusuf عليه السلام? Alone in a palace, seduced by a powerful woman, but he said, 'O Allah, prison is dearer to me than this.' That one choice elevated him — not just spiritually, but in status. If you leave for Allah, He promises far better in return.",
+        "techniques": [
+            "List what this relationship has cost you spiritually, mentally, and emotionally.",
+            "Start journaling a letter to Allah every night — call it 'My Return Journey'.",
+            "Fast on Mondays and Thursdays — it calms desire and boosts spiritual strength.",
+            "Say 'Astaghfirullah' with intention, not repetition — 33 times with heart."
+        ],
+        "dua": {
+            "arabic": "اللَّهُمَّ اجْعَلْنِي مِنْ التَّوَّابِينَ وَاجْعَلْنِي مِنَ الْمُتَطَهِّرِينَ",
+            "transliteration": "Allahumma aj'alni min at-tawwabeen waj'alni min al-mutatahhireen",
+            "translation": "O Allah, make me among those who often repent and purify themselves."
+        }
+    },
+    {
+        "opening": "Your pain is valid. But the One who fashioned your heart knows how to mend it. Return to Him, and you'll find light no one else could give.",
+        "story": "There's a reason the Prophet ﷺ told a young man, 'Would you like it for your sister?' when he asked about zina. Not to shame him — but to awaken his dignity. That man changed forever, just from one conversation. You can too.",
+        "techniques": [
+            "Write a list titled 'If I loved Allah more than them, I would…' and complete it.",
+            "Do wudhu slowly and mindfully — it literally resets your soul and mind.",
+            "Replace time spent texting or overthinking with Qur'an recitation — even 5 verses.",
+            "Learn the 90-second rule — sit with the emotion without reacting, let it pass."
+        ],
+        "dua": {
+            "arabic": "اللَّهُمَّ أَصْلِحْ لِي دِينِيَ الَّذِي هُوَ عِصْمَةُ أَمْرِي",
+            "transliteration": "Allahumma aslih li deeni alladhi huwa 'ismatu amri",
+            "translation": "O Allah, set right for me my religion which is the safeguard of my affairs."
+        }
+    },
+    {
+        "opening": "You chose to reach out instead of falling deeper — and that alone is a victory. Allah sees that flicker of light, and He can turn it into a flame of guidance.",
+        "story": "There was once a companion addicted to sin, brought to the Prophet ﷺ again and again. People cursed him. The Prophet ﷺ said: 'Do not curse him, for he loves Allah and His Messenger.' If Allah accepted that heart, He will accept yours too.",
+        "techniques": [
+            "Sit after Fajr and imagine what your life could look like if it was built around Allah.",
+            "Use the Thought Stop Technique: when romantic thoughts appear, audibly say 'Stop' and redirect with a verse or Tasbih.",
+            "Clean your room or environment — remove anything tied to sin. This cleans your Qalb too.",
+            "Speak to your future self who made it out — what would they thank you for?"
+        ],
+        "dua": {
+            "arabic": "اللَّهُمَّ ثَبِّتْ قَلْبِي عَلَى دِينِكَ",
+            "transliteration": "Allahumma thabbit qalbi 'ala deenik",
+            "translation": "O Allah, keep my heart firm upon Your religion."
+        }
+    }
+]
 
-The user just sent a non-emotional message (small talk or casual conversation).
+# Counseling openings; {name} and {emotion} are filled per request
+OPENING_VARIATIONS = [
+    "Hi {name}, I can feel the weight you're carrying.",
+    "Hello {name}, I understand you're going through {emotion} right now.",
+    "{name}, your heart is speaking, and I'm here to listen.",
+    "Peace be upon you {name}, I sense you're struggling with {emotion}.",
+    "{name}, sometimes the heart needs space to breathe.",
+    "Hello {name}, Allah sees your struggle even when others don't.",
+    "{name}, every storm in the heart eventually finds its calm."
+]
 
-User context from memory:
-{user_context}
+# --- DEGRADED MODE --- #
+# Curated replies when the LLM is failing or saturated; see app/degraded_mode.py
+degraded_mode = DegradedMode(
+    OPENING_VARIATIONS,
+    HARAM_TEMPLATES,
+    # Sample documents, loaded the first time a degraded reply needs one
+    local_documents=lambda: SimpleRAGDocumentManager().documents,
+    mode=degraded_mode_setting()
+)
 
-Current message: "{user_msg}"
+# --- RESPONSE BANK --- #
+# Pre-generated replies per emotion x language (scripts/generate_response_bank.py)
+response_bank = ResponseBank.open(os.getenv("RESPONSE_BANK_PATH", "data/response_bank.bin"))
+# Share of emotional replies served from the bank when it has one the user hasn't seen
+RESPONSE_BANK_SHARE = float(os.getenv("RESPONSE_BANK_SHARE", "0.5"))
+
+def bank_reply(state: TherapyState, emotion: str, language: str) -> Optional[str]:
+    """A personalized bank reply whose story the user hasn't heard for this emotion"""
+    if response_bank is None:
+        return None
+    snapshot = state["user_snapshot"]
+    used = set(get_used_stories(snapshot, emotion))
+    picked = response_bank.pick(emotion, language, exclude=lambda text: extract_story_key(text) in used)
+    if picked is None:
+        return None
+    _, text = picked
+    # Marked here: record_user_memory only extracts stories from generated replies
+    story_key = state["story_key"] = extract_story_key(text)
+    if story_key:
+        mark_story_used(snapshot, emotion, story_key)
+    return personalize(text, state.get("name", "Friend"))
+
+def attach_dua(state: TherapyState, reply: str) -> str:
+    dua_info = state.get("dua")
+    if dua_info:
+        reply += f"\n\nMay this dua guide you to peace:\n\n🤲 {dua_info}"
+    return reply
 
-IMPORTANT: Respond naturally to greetings based on the context and past interactions, without always using the same format.
+def serve_degraded(state: TherapyState, reason: str) -> TherapyState:
+    """Answer from the response bank or curated templates and local RAG
+    excerpts, without the LLM"""
+    emotion = state.get("emotion", "neutral")
+    haram = emotion == "haram_content" or detect_haram_content(state["message"])["has_any_haram"]
+    reply = None
+    if not haram and emotion != "greeting":
+        reply = bank_reply(state, emotion, detect_language(state["message"]))
+    if reply is not None:
+        state.update(response=attach_dua(state, reply), response_type="bank", degraded_reason=reason)
+    else:
+        state.update(degraded_mode.respond(state.get("name", "Friend"), emotion, reason, haram=haram))
+        if state["response_type"] == "template":
+            state["response"] = attach_dua(state, state["response"])
+    logging.info(f"Degraded reply ({reason}): {state['response_type']}")
+    return state
 
-Specific responses for identity questions:
+# --- SPECULATIVE COUNSELING --- #
+# When local signals clearly point to one distress emotion, the counseling
+# reply (retrieval and generation) is drafted while the classifier runs and
+# kept only if the classifier agrees. SPECULATIVE_COUNSELING=off disables it
+SPECULATIVE_COUNSELING = os.getenv("SPECULATIVE_COUNSELING", "on") != "off"
+SPECULATIVE_EMOTIONS = {"sad", "angry", "anxious", "tired", "lonely", "guilty", "empty", "hopeless", "overwhelmed", "confused"}
+speculation_stats = SpeculationStats()
+
+def predict_distress(text: str) -> Optional[str]:
+    """The distress emotion local signals agree on, or None when unsure"""
+    if not has_emotional_indicator(text):
+        return None
+    if is_greeting_or_small_talk(text) or detect_islamic_question(text.lower()):
+        return None
+    if detect_haram_content(text)["has_any_haram"]:
+        return None
+    emotions = degraded_mode.matching_emotions(text)
+    if len(emotions) != 1 or emotions[0] not in SPECULATIVE_EMOTIONS:
+        return None
+    return emotions[0]
+
+def start_speculation(state: TherapyState):
+    """Start drafting the counseling reply for a predicted emotion"""
+    if not SPECULATIVE_COUNSELING:
+        return
+    user_msg = state["message"]
+    emotion = predict_distress(user_msg)
+    if emotion is None:
+        return
+    # A wrong guess doubles the LLM calls for the message; not when the
+    # model is already under pressure
+    if load_monitor.is_high_load() or load_monitor.llm_saturated():
+        speculation_stats.record_skipped()
+        return
+    language = detect_language(user_msg)
+    # Tossed now rather than in generate_counseling: a bank reply needs no
+    # generation, so there would be nothing to overlap
+    bank_draw = state["bank_draw"] = random.random()
+    if bank_draw < RESPONSE_BANK_SHARE and response_bank is not None and response_bank.count(emotion, language):
+        return
+    # Context as it will read once generate_counseling records the mood
+    user_context = get_user_context(state["user_snapshot"], pending_mood=emotion)
+    # Its own cancel scope: discarding the draft must not cancel the request
+    deadline = node_deadline(state, "generate_reply", cancel_scope=True)
+    state["speculation"] = Speculation(
+        emotion, draft_counseling, state, emotion, language, user_context, deadline,
+        deadline=deadline, stats=speculation_stats
+    )
+    logging.info(f"Speculatively drafting counseling for {emotion}")
+
+def draft_counseling(state: TherapyState, emotion: str, language: str, user_context: str, deadline: Deadline) -> str:
+    """Retrieve guidance and generate the counseling reply, without the dua.
+    Only reads the user's snapshot, so it can run ahead as a speculation."""
+    name = state.get("name", "Friend")
+    user_msg = state["message"]
+    
+    # Use RAG system to get relevant Islamic CBT techniques and guidance with timeout
+    relevant_docs = []
+    try:
+        logging.info("Retrieving relevant documents from RAG system...")
+        # Quick timeout for RAG retrieval to prevent hanging, within the node's budget
+        # Get documents specifically for this emotion (limit 1 for speed)
+        relevant_docs = deadline.child("rag", RAG_BUDGET_SECONDS).run(
+            rag_manager.search_by_emotion, emotion, limit=1, stage="rag"
+        )
+        logging.info(f"Retrieved {len(relevant_docs)} documents for emotion '{emotion}'")
+        # Kept for degraded replies, which cannot wait on retrieval
+        degraded_mode.remember_excerpts(emotion, relevant_docs)
+    except DeadlineExceeded:
+        logging.warning("RAG retrieval timed out, using fallback")
+        relevant_docs = []
+    except Exception as e:
+        logging.warning(f"RAG retrieval failed: {e}. Using static context.")
+        relevant_docs = []
+    if relevant_docs:
+        context_content = "\n\nBased on Islamic guidance:\n"
+        for i, doc in enumerate(relevant_docs, 1):
+            excerpt = doc['content'][:200] + "..." if len(doc['content']) > 200 else doc['content']
+            context_content += f"{excerpt}\n\n"
+    else:
+        context_content = f"\n\nIslamic teachings remind us that Allah is always with those who seek Him. The Quran and Sunnah provide guidance for all emotional states.\n"
 
-For "Who are you?" or "Tell me about yourself":
-"I'm Mustafa, an Islamic therapist created to help mend and heal hearts through Islamic guidance and counseling. I was developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community."
+    # Get previously used stories to ensure variety
+    used_stories = get_used_stories(state["user_snapshot"], emotion)
+    
+    # Create variety in response by providing different story options
+    varied_story_guidance = ""
+    if used_stories:
+        varied_story_guidance = f"""
+IMPORTANT: Avoid repeating these Islamic stories that you've already shared with this user for {emotion}:
+{join_within_budget(used_stories[:5], USED_STORIES_TOKEN_BUDGET)}
 
-For "Who built you?" or "Who created you?" or "Who developed you?":
-"I was developed by Syed Mozamil Shah as a Sadqa e Jariya for the Islamic Community. He created me to help provide Islamic counseling and support to those in need."
+Use a DIFFERENT Islamic story this time from prophets, companions, or early Islamic history that relates to {emotion}.
+"""
+    
+    
+    random_opening = random.choice(OPENING_VARIATIONS).format(name=name, emotion=emotion)
+    
+    if language == "roman_urdu":
+        language_instruction = "(Respond gently in Roman Urdu.)"
+    elif language == "urdu":
+        language_instruction = "(Respond gently in Urdu script.)"
+    else:
+        language_instruction = "(Respond warmly in English.)"
 
-For "What can you do?":
-"I offer support through listening and drawing from the Seerah, Sunnah, and Quran 🌙"
+    # Intelligent emotional response system with holistic CBT techniques
+    prompt = COUNSELING_PROMPT.render(
+        name=name,
+        emotion=emotion,
+        user_msg=user_msg,
+        user_context=user_context,
+        rag_context=context_content,
+        varied_story_guidance=varied_story_guidance,
+        random_opening=random_opening,
+        language_instruction=language_instruction
+    )
+    reply = timed_generate(model, "counseling", prompt, deadline=deadline, generation_config=GENERATION_CONFIGS["counseling"]).text.strip()
+    return clean_ai_response(reply)  # Clean formatting
 
-For "Do you know my name?" or "What's my name?":
-- If name is available in memory: "Of course, your name is {name}!"
-- If no name in memory: "I haven't saved your name yet. What would you like me to call you?"
+# --- COUNSELOR RESPONSE NODE --- #
+def generate_counseling(state: TherapyState) -> TherapyState:
+    deadline = node_deadline(state, "generate_reply")
+    name = state.get("name", "Friend")
+    emotion = state.get("emotion", "neutral")
+    user_msg = state["message"]
 
-For general greetings like "Hello", "Hi", "Assalam":
-"I'm here to help you feel supported and heard."
+    degraded_reason = state.get("degraded_reason") or degraded_mode.reason()
+    
+    # A draft started while classifying only counts if the prediction held
+    speculation = state.pop("speculation", None)
+    if speculation is not None and (speculation.prediction != emotion or degraded_reason):
+        speculation.discard()
+        speculation = None
+    
+    # Curated replies while the LLM is failing or saturated; the redirect
+    # for Islamic questions needs no LLM either way
+    if degraded_reason and emotion != "islamic_question":
+        state = serve_degraded(state, degraded_reason)
+        if state["response_type"] in ("template", "bank"):
+            update_user_emotion_history(state["user_snapshot"], emotion)
+        return state
 
-For "How are you?" questions:
-"I'm here to help you feel supported and heard."
+    # Handle greetings and small talk differently
+    if emotion == "greeting":
+        # Determine if greeting is necessary based on prior interactions
+        user_context = get_user_context(state["user_snapshot"])
 
-Respond genuinely and warmly based on their message and memory context."""
+        greeting_prompt = GREETING_PROMPT.render(
+            user_context=user_context,
+            user_msg=user_msg,
+            name=name
+        )
         
-        reply = model.generate_content(greeting_prompt).text.strip()
+        try:
+            reply = timed_generate(model, "greeting", greeting_prompt, deadline=deadline, generation_config=GENERATION_CONFIGS["greeting"]).text.strip()
+        except Exception as e:
+            logging.error(f"Greeting generation failed, serving degraded reply: {e}")
+            return serve_degraded(state, failure_reason(e))
         reply = clean_ai_response(reply)  # Clean formatting
         state["response"] = reply
+        state["response_type"] = "greeting"
         logging.info(f"Greeting response: {reply}")
         return state
     
     if emotion == "islamic_question":
         reply = f"Sorry {name}, I can't have access to those kind of questions. I am here to provide you mood-based counselling. Tell me how your heart is feeling right now."
         state["response"] = reply
+        state["response_type"] = "islamic_question"
         logging.info(f"Islamic question redirect: {reply}")
         return state
     
-    if emotion == "haram_content":
-        # Handle haram content detected by AI
-        logging.info("AI detected haram content, processing with specialized response")
-        # Continue to the haram content handling section below
-        pass
-
-    # Check for haram content
+    # Haram content detected by the classifier or by keywords
     haram_check = detect_haram_content(user_msg)
     
-    if haram_check["has_any_haram"]:
-        # Handle haram content with specific response templates
-        haram_templates = [
-            {
-                "opening": "Sometimes, when the heart becomes attached, it forgets its true Owner. But you are never too far gone. Allah is closer to you than your own sadness, and He loves the heart that returns.",
-                "story": "There was a man who gave up everything for a woman he loved, but then remembered his Lord and repented. And Allah raised him higher than those who never fell. Allah says: 'Evil women are for evil men, and pious women for pious men.' And, 'Whoever fears standing before Allah will be granted two gardens.' Imagine the reward when you walk away for Him.",
-                "techniques": [
-                    "Write down what you truly want in life — and place Jannah at the top.",
-                    "Replace emotional voids with Dhikr. Use Tasbih after Fajr and Maghrib.",
-                    "Practice Cognitive Restructuring: When missing them, remind yourself what you're truly missing is nearness to Allah.",
-                    "Reduce all triggers — block, unfollow, or even delete, because your soul is more precious."
-                ],
-                "dua": {
-                    "arabic": "اللَّهُمَّ اكْفِنِيهِمْ بِمَا شِئْتَ",
-                    "transliteration": "Allahumma ikfineehim bima shi'ta",
-                    "translation": "O Allah, suffice me against them however You will."
-                }
-            },
-            {
-                "opening": "You feel something inside because your heart still beats with Imaan. Allah sees the struggle — not to be perfect, but to choose Him even with tears in your eyes.",
-                "story": "Do you remember Yusuf عليه السلام? Alone in a palace, seduced by a powerful woman, but he said, 'O Allah, prison is dearer to me than this.' That one choice elevated him — not just spiritually, but in status. If you leave for Allah, He promises far better in return.",
-                "techniques": [
-                    "List what this relationship has cost you spiritually, mentally, and emotionally.",
-                    "Start journaling a letter to Allah every night — call it 'My Return Journey'.",
-                    "Fast on Mondays and Thursdays — it calms desire and boosts spiritual strength.",
-                    "Say 'Astaghfirullah' with intention, not repetition — 33 times with heart."
-                ],
-                "dua": {
-                    "arabic": "اللَّهُمَّ اجْعَلْنِي مِنْ التَّوَّابِينَ وَاجْعَلْنِي مِنَ الْمُتَطَهِّرِينَ",
-                    "transliteration": "Allahumma aj'alni min at-tawwabeen waj'alni min al-mutatahhireen",
-                    "translation": "O Allah, make me among those who often repent and purify themselves."
-                }
-            },
-            {
-                "opening": "Your pain is valid. But the One who fashioned your heart knows how to mend it. Return to Him, and you'll find light no one else could give.",
-                "story": "There's a reason the Prophet ﷺ told a young man, 'Would you like it for your sister?' when he asked about zina. Not to shame him — but to awaken his dignity. That man changed forever, just from one conversation. You can too.",
-                "techniques": [
-                    "Write a list titled 'If I loved Allah more than them, I would…' and complete it.",
-                    "Do wudhu slowly and mindfully — it literally resets your soul and mind.",
-                    "Replace time spent texting or overthinking with Qur'an recitation — even 5 verses.",
-                    "Learn the 90-second rule — sit with the emotion without reacting, let it pass."
-                ],
-                "dua": {
-                    "arabic": "اللَّهُمَّ أَصْلِحْ لِي دِينِيَ الَّذِي هُوَ عِصْمَةُ أَمْرِي",
-                    "transliteration": "Allahumma aslih li deeni alladhi huwa 'ismatu amri",
-                    "translation": "O Allah, set right for me my religion which is the safeguard of my affairs."
-                }
-            },
-            {
-                "opening": "You chose to reach out instead of falling deeper — and that alone is a victory. Allah sees that flicker of light, and He can turn it into a flame of guidance.",
-                "story": "There was once a companion addicted to sin, brought to the Prophet ﷺ again and again. People cursed him. The Prophet ﷺ said: 'Do not curse him, for he loves Allah and His Messenger.' If Allah accepted that heart, He will accept yours too.",
-                "techniques": [
-                    "Sit after Fajr and imagine what your life could look like if it was built around Allah.",
-                    "Use the Thought Stop Technique: when romantic thoughts appear, audibly say 'Stop' and redirect with a verse or Tasbih.",
-                    "Clean your room or environment — remove anything tied to sin. This cleans your Qalb too.",
-                    "Speak to your future self who made it out — what would they thank you for?"
-                ],
-                "dua": {
-                    "arabic": "اللَّهُمَّ ثَبِّتْ قَلْبِي عَلَى دِينِكَ",
-                    "transliteration": "Allahumma thabbit qalbi 'ala deenik",
-                    "translation": "O Allah, keep my heart firm upon Your religion."
-                }
-            }
-        ]
+    if emotion == "haram_content" or haram_check["has_any_haram"]:
         
         # Use both approaches: sometimes template, sometimes LLM-generated
         use_llm = random.choice([True, False])  # 50% chance to use LLM
+        reply = None
         
         if use_llm:
             # Select a random template for LLM guidance
-            selected_template = random.choice(haram_templates)
+            selected_template = random.choice(HARAM_TEMPLATES)
             
             # Generate varied response using LLM based on template themes
-            haram_llm_prompt = f"""
-You are Mustafa, an Islamic therapist. A user is struggling with a haram relationship. Create a compassionate Islamic counseling response following this EXACT structure:
-
-First paragraph: Acknowledge their struggle with connection to Allah's mercy (2-3 lines)
-
-Second paragraph: Reference a Prophet's story or companion's experience that relates to their situation (2-3 lines)
-
-Third paragraph: Write "Here are steps to heal:" then give 4 numbered practical steps
-
-Final paragraph: Provide authentic Arabic dua with transliteration and translation
-
-Use these themes as inspiration but create your own variation:
-- Opening theme: "{selected_template['opening'][:50]}..."
-- Story theme: "{selected_template['story'][:50]}..."
-- Technique examples: {', '.join(selected_template['techniques'][:2])}
-- Dua theme: {selected_template['dua']['translation']}
-
-IMPORTANT FORMATTING RULES:
-- NO asterisks (*) anywhere in your response
-- NO bold text or special formatting
-- NO headings like "Opening:" or "Islamic Story:" or "Practical Islamic CBT Techniques:"
-- Just write natural paragraphs and numbered lists
-- Use plain text only
-- Be compassionate but firm about Islamic boundaries
-- Reference specific Quranic concepts like taqwa, repentance, Allah's mercy
-- Include practical CBT techniques adapted for Islamic context
-- Use authentic Arabic dua with proper transliteration
-- Keep the tone warm but spiritually motivating
-
-User's situation: "{user_msg}"
-
-Generate a complete response following the structure above with plain text formatting only."""
+            haram_llm_prompt = HARAM_GUIDANCE_PROMPT.render(
+                opening_theme=selected_template['opening'][:50],
+                story_theme=selected_template['story'][:50],
+                technique_examples=', '.join(selected_template['techniques'][:2]),
+                dua_theme=selected_template['dua']['translation'],
+                user_msg=user_msg
+            )
             
-            reply = model.generate_content(haram_llm_prompt).text.strip()
-            reply = clean_ai_response(reply)  # Clean formatting
-            logging.info(f"LLM-generated haram content response: {reply}")
-        else:
+            try:
+                reply = timed_generate(model, "haram_guidance", haram_llm_prompt, deadline=deadline, generation_config=GENERATION_CONFIGS["haram_guidance"]).text.strip()
+                reply = clean_ai_response(reply)  # Clean formatting
+                logging.info(f"LLM-generated haram content response: {reply}")
+            except Exception as e:
+                logging.error(f"Haram guidance generation failed, using a template: {e}")
+        
+        if reply is None:
             # Use predefined template
-            selected_template = random.choice(haram_templates)
-            
-            # Build the response
-            reply = selected_template["opening"] + "\n\n" + selected_template["story"] + "\n\nHere are steps to heal:\n\n"
-            
-            for i, technique in enumerate(selected_template["techniques"], 1):
-                reply += f"{i}. {technique}\n\n"
-            
-            # Add the dua
-            reply += f"{selected_template['dua']['arabic']}\n{selected_template['dua']['transliteration']}\n\"{selected_template['dua']['translation']}\""
-            
+            reply = format_haram_template(random.choice(HARAM_TEMPLATES))
             logging.info(f"Template-based haram content response: {reply}")
         
         state["response"] = reply
+        state["response_type"] = "haram_guidance"
         return state
 
     # For emotional responses, use the full therapeutic approach
     # Update user's emotional history
-    update_user_emotion_history(state["user_id"], emotion)
+    update_user_emotion_history(state["user_snapshot"], emotion)
     
-    # Get user context from memory
-    user_context = get_user_context(state["user_id"])
+    # A pre-generated reply the user hasn't seen skips retrieval and generation
+    language = detect_language(user_msg)
+    if speculation is None and state.get("bank_draw", random.random()) < RESPONSE_BANK_SHARE:
+        reply = bank_reply(state, emotion, language)
+        if reply is not None:
+            state["response"] = attach_dua(state, reply)
+            state["response_type"] = "bank"
+            logging.info(f"Response bank reply for {emotion}/{language}")
+            return state
     
-    # Use RAG system to get relevant Islamic CBT techniques and guidance with timeout
-    relevant_docs = []
+    # A reply drafted while classifying is used as is; otherwise draft one now
     try:
-        logging.info("Retrieving relevant documents from RAG system...")
-        # Quick timeout for RAG retrieval to prevent hanging
-        import threading
-        import time
-        
-        def get_docs():
-            try:
-                # Get documents specifically for this emotion (limit 1 for speed)
-                emotion_docs = rag_manager.search_by_emotion(emotion, limit=1)
-                return emotion_docs
-            except Exception as e:
-                logging.warning(f"RAG retrieval failed: {e}")
-                return []
-        
-        # Use threading with timeout
-        result_container = []
-        
-        def rag_thread():
-            result_container.append(get_docs())
-        
-        thread = threading.Thread(target=rag_thread)
-        thread.daemon = True
-        thread.start()
-        thread.join(timeout=3)  # 3 second timeout
-        
-        if result_container:
-            relevant_docs = result_container[0]
-            logging.info(f"Retrieved {len(relevant_docs)} documents for emotion '{emotion}'")
+        if speculation is not None:
+            reply = speculation.take()
         else:
-            logging.warning("RAG retrieval timed out, using fallback")
-            relevant_docs = []
-            
+            user_context = get_user_context(state["user_snapshot"])
+            reply = draft_counseling(state, emotion, language, user_context, deadline)
     except Exception as e:
-        logging.warning(f"RAG retrieval failed: {e}. Using static context.")
-        relevant_docs = []
-    if relevant_docs:
-        context_content = "\n\nBased on Islamic guidance:\n"
-        for i, doc in enumerate(relevant_docs, 1):
-            excerpt = doc['content'][:200] + "..." if len(doc['content']) > 200 else doc['content']
-            context_content += f"{excerpt}\n\n"
-    else:
-        context_content = f"\n\nIslamic teachings remind us that Allah is always with those who seek Him. The Quran and Sunnah provide guidance for all emotional states.\n"
-
-    # Get previously used stories to ensure variety
-    used_stories = get_used_stories(state["user_id"], emotion)
-    
-    # Create variety in response by providing different story options
-    varied_story_guidance = ""
-    if used_stories:
-        varied_story_guidance = f"""
-IMPORTANT: Avoid repeating these Islamic stories that you've already shared with this user for {emotion}:
-{', '.join(used_stories[:5])}
-
-Use a DIFFERENT Islamic story this time from prophets, companions, or early Islamic history that relates to {emotion}.
-"""
-    
-    # Create opening variety
-    opening_variations = [
-        f"Hi {name}, I can feel the weight you're carrying.",
-        f"Hello {name}, I understand you're going through {emotion} right now.",
-        f"{name}, your heart is speaking, and I'm here to listen.",
-        f"Peace be upon you {name}, I sense you're struggling with {emotion}.",
-        f"{name}, sometimes the heart needs space to breathe.",
-        f"Hello {name}, Allah sees your struggle even when others don't.",
-        f"{name}, every storm in the heart eventually finds its calm."
-    ]
-    
-    random_opening = random.choice(opening_variations)
-    
-    # Intelligent emotional response system with holistic CBT techniques
-    prompt = f"""
-You are Mustafa, an Islamic counselor specializing in Islamic CBT techniques.
-
-User's name: {state.get('name', 'Friend')}
-Emotion: {emotion}
-Message: "{user_msg}"
-User context: {user_context}
-
-{varied_story_guidance}
-
-Use this opening: "{random_opening}"
-
-Your response MUST follow this format:
-
-[Use the provided opening sentence]
-
-[Choose a UNIQUE Islamic story from prophets, companions, or early Islamic history that relates to {emotion} - 4-5 lines, tell it naturally without citations]
-
-[3-4 practical Islamic CBT techniques - Write them as simple numbered points: 1. [technique] 2. [technique] 3. [technique] 4. [technique]]
-
-[Hopeful closure - 1-2 lines max]
-
-CRITICAL FORMATTING RULES:
-|- No asterisks (*) or headings
-|- Use only plain text and numbered lists
-|- Each technique concise and action-oriented
-|- Keep response under 200 words total
-|- Don't write reference for what you are citing
-
-Story variety examples for {emotion}:
-- If sad: Stories of Prophet Yaqoob (AS), Prophet Ayyub (AS), Companions dealing with loss, etc.
-- If anxious: Stories of Prophet Musa (AS) at the sea, Prophet Ibrahim (AS) facing tests, etc.
-- If lonely: Stories of Prophet Yunus (AS), early Muslim converts who were isolated, etc.
-- If hopeless: Stories of Prophet Yusuf (AS) in prison, early Muslim persecutions turning to victory, etc.
-
-Techniques might include:
-- Dhikr and short du'as for mindfulness
-- Practical gratitude reflections
-- Cognitive shifts with Quranic guidance
-- Immediate actionable, faith-based steps
-
-Frame your response as heartfelt advice from someone grounded in Islamic wisdom and psychology."""
-    language = detect_language(user_msg)
-    if language == "roman_urdu":
-        prompt += "\n(Respond gently in Roman Urdu.)"
-    else:
-        prompt += "\n(Respond warmly in English.)"
-    reply = model.generate_content(prompt).text.strip()
-    reply = clean_ai_response(reply)  # Clean formatting
+        logging.error(f"Counseling generation failed, serving degraded reply: {e}")
+        return serve_degraded(state, failure_reason(e))
     
-    # Extract and track the story used to prevent repetition
-    try:
-        # Simple heuristic to identify the story portion (second paragraph typically)
-        story_lines = reply.split('\n')
-        story_content = ""
-        
-        # Find the story portion (usually between first and second blank lines)
-        in_story = False
-        story_parts = []
-        for i, line in enumerate(story_lines):
-            if i > 0 and line.strip() and not in_story:  # Start of story
-                in_story = True
-                story_parts.append(line.strip()[:50])  # First 50 chars as identifier
-            elif in_story and (line.strip().startswith('1.') or line.strip() == ''):  # End of story
-                break
-            elif in_story and line.strip():
-                story_parts.append(line.strip()[:50])
-        
-        if story_parts:
-            story_key = " ".join(story_parts)[:100]  # Use first 100 chars as unique identifier
-            mark_story_used(state["user_id"], emotion, story_key)
-            logging.info(f"Marked story as used for {emotion}: {story_key[:50]}...")
-    except Exception as e:
-        logging.warning(f"Failed to track story usage: {e}")
-
     # Attach relevant dua if necessary
-    dua_info = state.get("dua")
-    if dua_info:
-        reply += f"\n\nMay this dua guide you to peace:\n\n🤲 {dua_info}"
+    reply = attach_dua(state, reply)
     
     state["response"] = reply
+    state["response_type"] = "counseling"
     logging.info(f"Therapist reply: {reply}")
     return state
 
 # --- USER MEMORY NODE --- #
 def set_user_memory(state: TherapyState) -> TherapyState:
-    uid = state["user_id"]
-    current_name = state.get("name", "Friend")
-    current_message = state.get("message", "")
+    node_deadline(state, "handle_memory").check("handle_memory")
+    # The only read of the user's memory this request; nodes work on the
+    # snapshot and record_user_memory writes it back after the response
+    snapshot = snapshot_with_message(state["user_id"], state.get("name", "Friend"), state.get("message", ""))
     
-    # Initialize user memory if not exists
-    if uid not in memory:
-        memory[uid] = {
-            "name": current_name,
-            "conversation_history": [],
-            "mood_history": [],
-            "last_seen": None,
-            "topics_discussed": [],
-            "preferences": {}
-        }
+    # Set the name in state from memory
+    state["name"] = snapshot.data.get("name", "Friend")
+    state["user_snapshot"] = snapshot
+    
+    return state
+
+def snapshot_with_message(uid: str, current_name: str, current_message: str) -> UserSnapshot:
+    """Load the user's memory snapshot and record the incoming message on it"""
+    snapshot = memory.load_snapshot(uid, default_name=current_name)
+    if snapshot.is_new:
         logging.info(f"New user registered: {current_name}")
     else:
         # Update existing user's name if provided
         if current_name and current_name != "Friend":
-            memory[uid]["name"] = current_name
+            snapshot.set_name(current_name)
         
-        stored_name = memory[uid].get("name", "Friend")
+        stored_name = snapshot.data.get("name", "Friend")
         logging.info(f"Welcome back, {stored_name}!")
     
-    # Store conversation history (last 5 messages)
-    if "conversation_history" not in memory[uid]:
-        memory[uid]["conversation_history"] = []
-    
-    memory[uid]["conversation_history"].append({
-        "message": current_message,
-        "timestamp": time.time(),
-        "detected_patterns": []
-    })
-
     # Detect and store haram or significant patterns in conversation
     haram_content_info = detect_haram_content(current_message)
-    if haram_content_info["has_any_haram"]:
-        memory[uid]["conversation_history"][-1]["detected_patterns"] = haram_content_info.get("patterns_detected", [])
-
-    # Keep only last 10 messages with comprehensive history
-    if len(memory[uid]["conversation_history"]) > 10:
-        memory[uid]["conversation_history"] = memory[uid]["conversation_history"][-10:]
-    
-    # Update last seen
-    memory[uid]["last_seen"] = time.time()
-    
-    # Set the name in state from memory
-    state["name"] = memory[uid].get("name", "Friend")
+    detected_patterns = haram_content_info.get("patterns_detected", []) if haram_content_info["has_any_haram"] else []
     
-    return state
+    # Store conversation history (keeps the last 10 messages)
+    snapshot.add_message(current_message, detected_patterns)
+    return snapshot
 
 # Add a function to track and vary responses
-def get_used_stories(user_id: str, emotion: str) -> list:
+def get_used_stories(snapshot: UserSnapshot, emotion: str) -> list:
     """Get previously used stories for this user and emotion"""
-    if user_id not in memory:
-        return []
-    # Get or create story tracking
-    if "used_stories" not in memory[user_id]:
-        memory[user_id]["used_stories"] = {}
-    if emotion not in memory[user_id]["used_stories"]:
-        memory[user_id]["used_stories"][emotion] = []
-    return memory[user_id]["used_stories"][emotion]
-
-def mark_story_used(user_id: str, emotion: str, story_key: str):
+    return snapshot.used_stories(emotion)
+
+def mark_story_used(snapshot: UserSnapshot, emotion: str, story_key: str):
     """Mark a story as used for this user and emotion"""
-    if user_id not in memory:
-        return
-    if "used_stories" not in memory[user_id]:
-        memory[user_id]["used_stories"] = {}
-    if emotion not in memory[user_id]["used_stories"]:
-        memory[user_id]["used_stories"][emotion] = []
-    memory[user_id]["used_stories"][emotion].append(story_key)
-    # Keep only last 10 used stories to allow eventual reuse
-    if len(memory[user_id]["used_stories"][emotion]) > 10:
-        memory[user_id]["used_stories"][emotion] = memory[user_id]["used_stories"][emotion][-10:]
-
-def get_user_context(user_id: str) -> str:
-    """Get user context for prompts"""
-    if user_id not in memory:
-        return "This is a new user. No previous context available."
-    
-    user_mem = memory[user_id]
+    # Only the last 10 used stories are kept to allow eventual reuse
+    snapshot.add_used_story(emotion, story_key)
+
+def get_user_context(snapshot: UserSnapshot, pending_mood: Optional[str] = None) -> str:
+    """Get user context for prompts; pending_mood is a mood about to be
+    recorded, for prompts built before update_user_emotion_history"""
+    user_mem = snapshot.data
     name = user_mem.get("name", "Friend")
     
     # Get recent conversation topics
@@ -1040,7 +1162,10 @@ def get_user_context(user_id: str) -> str:
     recent_topics = [msg["message"][:50] + "..." if len(msg["message"]) > 50 else msg["message"] for msg in recent_messages]
     
     # Get mood history
-    mood_history = user_mem.get("mood_history", [])[-2:]  # Last 2 moods
+    mood_history = user_mem.get("mood_history", [])
+    if pending_mood is not None:
+        mood_history = mood_history + [pending_mood]
+    mood_history = mood_history[-2:]  # Last 2 moods
     
     context = f"User's name: {name}\n"
     
@@ -1052,19 +1177,69 @@ def get_user_context(user_id: str) -> str:
     
     return context
 
-def update_user_emotion_history(user_id: str, emotion: str):
-    """Update user's emotional history"""
-    if user_id not in memory:
-        return
-    
-    if "mood_history" not in memory[user_id]:
-        memory[user_id]["mood_history"] = []
+def update_user_emotion_history(snapshot: UserSnapshot, emotion: str):
+    """Update user's emotional history (keeps the last 5 emotions)"""
+    snapshot.add_mood(emotion)
+
+# --- POST-RESPONSE BOOKKEEPING --- #
+# Run after the reply has been sent (see post_response_jobs and main.py)
+def extract_story_key(reply: str) -> Optional[str]:
+    """Identify the story portion of a reply to prevent repetition"""
+    # Simple heuristic to identify the story portion (second paragraph typically)
+    story_lines = reply.split('\n')
     
-    memory[user_id]["mood_history"].append(emotion)
+    # Find the story portion (usually between first and second blank lines)
+    in_story = False
+    story_parts = []
+    for i, line in enumerate(story_lines):
+        if i > 0 and line.strip() and not in_story:  # Start of story
+            in_story = True
+            story_parts.append(line.strip()[:50])  # First 50 chars as identifier
+        elif in_story and (line.strip().startswith('1.') or line.strip() == ''):  # End of story
+            break
+        elif in_story and line.strip():
+            story_parts.append(line.strip()[:50])
     
-    # Keep only last 5 emotions
-    if len(memory[user_id]["mood_history"]) > 5:
-        memory[user_id]["mood_history"] = memory[user_id]["mood_history"][-5:]
+    if not story_parts:
+        return None
+    return " ".join(story_parts)[:100]  # Use first 100 chars as unique identifier
+
+def record_user_memory(state: TherapyState):
+    """Track the story used and commit the request's memory snapshot"""
+    snapshot = state.get("user_snapshot")
+    if snapshot is None:
+        return
+    # Extract only once, so a retried commit does not mark the story twice
+    if state.get("response_type") == "counseling" and "story_key" not in state:
+        story_key = state["story_key"] = extract_story_key(state["response"])
+        if story_key:
+            emotion = state.get("emotion", "neutral")
+            mark_story_used(snapshot, emotion, story_key)
+            logging.info(f"Marked story as used for {emotion}: {story_key[:50]}...")
+    memory.commit(snapshot)
+
+def record_conversation_context(state: TherapyState):
+    context_manager.update_conversation(state["user_id"], state["message"], state.get("emotion", "neutral"), state["response"])
+
+def record_response_usage(state: TherapyState):
+    context_manager.track_response_usage(state["user_id"], state.get("emotion", "neutral"), state.get("response_type", "counseling"))
+
+def post_response_jobs(state: TherapyState) -> List[Tuple[str, Callable[[], None]]]:
+    """Bookkeeping for a finished graph run, as (job name, callable) pairs"""
+    return [
+        ("user_memory", lambda: record_user_memory(state)),
+        ("context_conversation", lambda: record_conversation_context(state)),
+        ("context_response_usage", lambda: record_response_usage(state)),
+    ]
+
+def record_unanswered_message(uid: str, name: str, message: str):
+    """Commit the message of a request that failed, timed out or was
+    cancelled before replying; the graph's own snapshot is never committed"""
+    memory.commit(snapshot_with_message(uid, name, message))
+
+def unanswered_request_jobs(uid: str, name: str, message: str) -> List[Tuple[str, Callable[[], None]]]:
+    """Bookkeeping for a request that ended without a reply"""
+    return [("user_memory_unanswered", lambda: record_unanswered_message(uid, name, message))]
 
 # --- LANGGRAPH BUILD --- #
 graph = StateGraph(TherapyState)
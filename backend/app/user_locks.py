@@ -0,0 +1,110 @@
+import asyncio
+import threading
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, List, Tuple
+
+# Number of guard stripes; only the tiny lock-table bookkeeping is striped,
+# so this bounds contention on lock creation, not on the locks themselves
+DEFAULT_STRIPES = 64
+
+
+class UserLocks:
+    """Per-user mutexes for read-modify-write sections, created on demand.
+
+    The lock table is split into stripes, each with its own guard, and a
+    user's entry lives only while someone holds or waits for it. Two
+    different users never share a mutex, so they never wait on each other
+    beyond a few dict operations. Locks are not reentrant.
+    """
+
+    def __init__(self, stripes: int = DEFAULT_STRIPES):
+        self._stripes: List[Tuple[threading.Lock, Dict[str, list]]] = [
+            (threading.Lock(), {}) for _ in range(stripes)
+        ]
+
+    def _stripe(self, user_id: str) -> Tuple[threading.Lock, Dict[str, list]]:
+        return self._stripes[hash(user_id) % len(self._stripes)]
+
+    def _ref(self, user_id: str) -> threading.Lock:
+        guard, table = self._stripe(user_id)
+        with guard:
+            # entry: [mutex, holders + waiters]
+            entry = table.get(user_id)
+            if entry is None:
+                entry = table[user_id] = [threading.Lock(), 0]
+            entry[1] += 1
+            return entry[0]
+
+    def _unref(self, user_id: str):
+        guard, table = self._stripe(user_id)
+        with guard:
+            entry = table[user_id]
+            entry[1] -= 1
+            if entry[1] == 0:
+                del table[user_id]
+
+    def acquire(self, user_id: str, blocking: bool = True, timeout: float = -1) -> bool:
+        mutex = self._ref(user_id)
+        if mutex.acquire(blocking, timeout):
+            return True
+        self._unref(user_id)
+        return False
+
+    def release(self, user_id: str):
+        guard, table = self._stripe(user_id)
+        with guard:
+            mutex = table[user_id][0]
+        mutex.release()
+        self._unref(user_id)
+
+    @contextmanager
+    def hold(self, user_id: str):
+        self.acquire(user_id)
+        try:
+            yield
+        finally:
+            self.release(user_id)
+
+    def __len__(self) -> int:
+        """Number of users currently holding or waiting for a lock"""
+        return sum(len(table) for _, table in self._stripes)
+
+
+class AsyncUserLocks:
+    """Async variant of UserLocks that also excludes threads using the same table.
+
+    Coroutines first queue on a per-user asyncio.Lock, so at most one task
+    per user and event loop contends for the thread-level mutex, which it
+    then takes by polling instead of blocking the loop. Use one instance
+    per event loop.
+    """
+
+    # Poll interval bounds while a thread holds the user's mutex
+    MIN_POLL = 0.0005
+    MAX_POLL = 0.01
+
+    def __init__(self, thread_locks: UserLocks):
+        self.thread_locks = thread_locks
+        # user_id -> [asyncio.Lock, holders + waiters]
+        self._locks: Dict[str, list] = {}
+
+    @asynccontextmanager
+    async def hold(self, user_id: str):
+        entry = self._locks.get(user_id)
+        if entry is None:
+            entry = self._locks[user_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                delay = self.MIN_POLL
+                while not self.thread_locks.acquire(user_id, blocking=False):
+                    await asyncio.sleep(delay)
+                    delay = min(delay * 2, self.MAX_POLL)
+                try:
+                    yield
+                finally:
+                    self.thread_locks.release(user_id)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del self._locks[user_id]
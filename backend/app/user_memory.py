@@ -0,0 +1,313 @@
+import os
+import copy
+import json
+import sys
+import time
+import logging
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from app.context_store import legacy_flat_path, shard_path
+from app.user_locks import UserLocks
+
+logger = logging.getLogger(__name__)
+
+
+def approximate_size(obj: Any) -> int:
+    """Approximate deep size in bytes of a JSON-like object"""
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        for key, value in obj.items():
+            size += approximate_size(key) + approximate_size(value)
+    elif isinstance(obj, (list, tuple, set)):
+        for item in obj:
+            size += approximate_size(item)
+    return size
+
+
+class DirectorySpillBackend:
+    """Persist evicted user memory entries as JSON files (sharded like user contexts)"""
+
+    def __init__(self, data_dir: str = "data/user_memory"):
+        self.data_dir = Path(data_dir)
+        self.data_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, user_id: str) -> Path:
+        return shard_path(self.data_dir, user_id, ".json")
+
+    def save(self, user_id: str, entry: Dict[str, Any]):
+        try:
+            path = self._path(user_id)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(entry, f, ensure_ascii=False)
+        except Exception as e:
+            logger.error(f"Error spilling user memory: {e}")
+
+    def load(self, user_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            path = self._path(user_id)
+        except ValueError:
+            return None
+        if not path.exists():
+            # Spilled before the sharded layout
+            path = legacy_flat_path(self.data_dir, user_id, ".json")
+            if path is None or not path.exists():
+                return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            path.unlink()
+            return entry
+        except Exception as e:
+            logger.error(f"Error loading spilled user memory: {e}")
+            return None
+
+
+# History caps applied whenever an entry is updated
+MAX_CONVERSATION_HISTORY = 10
+MAX_MOOD_HISTORY = 5
+MAX_USED_STORIES = 10
+
+
+def new_memory_entry(name: str) -> Dict[str, Any]:
+    return {
+        "name": name,
+        "conversation_history": [],
+        "mood_history": [],
+        "last_seen": None,
+        "topics_discussed": [],
+        "preferences": {}
+    }
+
+
+def apply_memory_op(entry: Dict[str, Any], op: Tuple[Any, ...]):
+    """Apply one recorded UserSnapshot change to a memory entry in place"""
+    kind = op[0]
+    if kind == "name":
+        entry["name"] = op[1]
+    elif kind == "message":
+        history = entry.setdefault("conversation_history", [])
+        history.append(op[1])
+        if len(history) > MAX_CONVERSATION_HISTORY:
+            entry["conversation_history"] = history[-MAX_CONVERSATION_HISTORY:]
+        entry["last_seen"] = op[1]["timestamp"]
+    elif kind == "mood":
+        moods = entry.setdefault("mood_history", [])
+        moods.append(op[1])
+        if len(moods) > MAX_MOOD_HISTORY:
+            entry["mood_history"] = moods[-MAX_MOOD_HISTORY:]
+    elif kind == "story":
+        stories = entry.setdefault("used_stories", {}).setdefault(op[1], [])
+        stories.append(op[2])
+        if len(stories) > MAX_USED_STORIES:
+            entry["used_stories"][op[1]] = stories[-MAX_USED_STORIES:]
+    else:
+        raise ValueError(f"Unknown memory operation {kind!r}")
+
+
+class UserSnapshot:
+    """Unit of work over one user's memory entry for a single request.
+
+    Nodes read and change the private copy in `data`; each change is also
+    recorded, and UserMemoryStore.commit() replays the changes onto the
+    current entry in one write, so concurrent requests for the same user
+    do not overwrite each other.
+    """
+
+    def __init__(self, user_id: str, data: Dict[str, Any], is_new: bool):
+        self.user_id = user_id
+        self.data = data
+        self.is_new = is_new
+        self.ops: List[Tuple[Any, ...]] = []
+
+    def _record(self, *op: Any):
+        apply_memory_op(self.data, op)
+        self.ops.append(op)
+
+    def set_name(self, name: str):
+        self._record("name", name)
+
+    def add_message(self, message: str, detected_patterns: Optional[List[str]] = None):
+        self._record("message", {
+            "message": message,
+            "timestamp": time.time(),
+            "detected_patterns": detected_patterns or []
+        })
+
+    def add_mood(self, emotion: str):
+        self._record("mood", emotion)
+
+    def add_used_story(self, emotion: str, story_key: str):
+        self._record("story", emotion, story_key)
+
+    def used_stories(self, emotion: str) -> List[str]:
+        return self.data.get("used_stories", {}).get(emotion, [])
+
+
+class UserMemoryStore(MutableMapping):
+    """Bounded in-process user memory with LRU and idle-TTL eviction.
+
+    Behaves like the plain dict it replaces. Entries idle for longer than
+    idle_ttl seconds, or least recently used beyond max_entries, are evicted
+    and handed to the optional spill backend, from which they are reloaded
+    transparently on the next access.
+    """
+
+    def __init__(self, max_entries: int = 10000, idle_ttl: float = 86400, spill_backend=None):
+        self.max_entries = max_entries
+        self.idle_ttl = idle_ttl
+        self.spill_backend = spill_backend
+
+        # user_id -> entry, ordered from least to most recently used
+        self.entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self.last_access: Dict[str, float] = {}
+
+        # Reentrant because node helpers check membership then index
+        self.lock = threading.RLock()
+        # Per-user locks for multi-step updates of one entry
+        self.user_locks = UserLocks()
+
+        self.evictions = 0
+        self.spills = 0
+        self.reloads = 0
+
+    def _touch(self, user_id: str, now: float):
+        self.entries.move_to_end(user_id)
+        self.last_access[user_id] = now
+
+    def _evict(self, user_id: str):
+        entry = self.entries.pop(user_id)
+        self.last_access.pop(user_id, None)
+        self.evictions += 1
+        if self.spill_backend is not None:
+            self.spill_backend.save(user_id, entry)
+            self.spills += 1
+
+    def _evict_expired(self, now: float):
+        """Drop idle entries; they sit at the LRU end so the scan stops early"""
+        cutoff = now - self.idle_ttl
+        while self.entries:
+            oldest = next(iter(self.entries))
+            if self.last_access.get(oldest, 0) > cutoff:
+                break
+            self._evict(oldest)
+
+    def _reload(self, user_id: str, now: float) -> bool:
+        if self.spill_backend is None:
+            return False
+        entry = self.spill_backend.load(user_id)
+        if entry is None:
+            return False
+        self.reloads += 1
+        self._insert(user_id, entry, now)
+        return True
+
+    def _insert(self, user_id: str, entry: Dict[str, Any], now: float):
+        self.entries[user_id] = entry
+        self._touch(user_id, now)
+        while len(self.entries) > self.max_entries:
+            self._evict(next(iter(self.entries)))
+
+    def __getitem__(self, user_id: str) -> Dict[str, Any]:
+        with self.lock:
+            now = time.time()
+            self._evict_expired(now)
+            if user_id not in self.entries and not self._reload(user_id, now):
+                raise KeyError(user_id)
+            self._touch(user_id, now)
+            return self.entries[user_id]
+
+    def __setitem__(self, user_id: str, entry: Dict[str, Any]):
+        with self.lock:
+            now = time.time()
+            self._evict_expired(now)
+            self._insert(user_id, entry, now)
+
+    def __delitem__(self, user_id: str):
+        with self.lock:
+            del self.entries[user_id]
+            self.last_access.pop(user_id, None)
+
+    def __contains__(self, user_id: object) -> bool:
+        with self.lock:
+            now = time.time()
+            self._evict_expired(now)
+            if user_id in self.entries:
+                return True
+            return isinstance(user_id, str) and self._reload(user_id, now)
+
+    def __iter__(self) -> Iterator[str]:
+        with self.lock:
+            return iter(list(self.entries))
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def lock_user(self, user_id: str):
+        """Hold a user's lock around a read-modify-write of their entry"""
+        return self.user_locks.hold(user_id)
+
+    def load_snapshot(self, user_id: str, default_name: str = "Friend") -> UserSnapshot:
+        """Read a user's entry once into a private snapshot for one request"""
+        with self.lock:
+            entry = self.get(user_id)
+            data = copy.deepcopy(entry) if entry is not None else None
+        if data is None:
+            return UserSnapshot(user_id, new_memory_entry(default_name), is_new=True)
+        return UserSnapshot(user_id, data, is_new=False)
+
+    def commit(self, snapshot: UserSnapshot):
+        """Apply a snapshot's changes to the current entry in a single write"""
+        if not snapshot.ops and not snapshot.is_new:
+            return
+        with self.lock_user(snapshot.user_id):
+            # Readers copy the live entry holding only self.lock, so changes
+            # are made to a private copy that is swapped in whole
+            with self.lock:
+                current = self.get(snapshot.user_id)
+                # With nothing newer to merge with, the snapshot already holds every change
+                entry = copy.deepcopy(current if current is not None else snapshot.data)
+            if current is not None:
+                for op in snapshot.ops:
+                    apply_memory_op(entry, op)
+            self[snapshot.user_id] = entry
+            # Committed; a retried commit is a no-op
+            snapshot.ops = []
+            snapshot.is_new = False
+
+    def flush(self):
+        """Spill every resident entry, e.g. at shutdown"""
+        with self.lock:
+            while self.entries:
+                self._evict(next(iter(self.entries)))
+
+    def approx_bytes(self) -> int:
+        """Approximate resident size of all entries"""
+        with self.lock:
+            return sum(approximate_size(key) + approximate_size(entry) for key, entry in self.entries.items())
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self.lock:
+            self._evict_expired(time.time())
+            return {
+                "entries": len(self.entries),
+                "max_entries": self.max_entries,
+                "idle_ttl_seconds": self.idle_ttl,
+                "approx_bytes": self.approx_bytes(),
+                "evictions": self.evictions,
+                "spills": self.spills,
+                "reloads": self.reloads,
+            }
+
+
+# Global instance with configurable bounds
+_spill_dir = os.getenv("USER_MEMORY_SPILL_DIR", "")
+user_memory = UserMemoryStore(
+    max_entries=int(os.getenv("USER_MEMORY_MAX_ENTRIES", "10000")),
+    idle_ttl=float(os.getenv("USER_MEMORY_IDLE_TTL", "86400")),
+    spill_backend=DirectorySpillBackend(_spill_dir) if _spill_dir else None
+)
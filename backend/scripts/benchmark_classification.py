@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+"""
+Emotion classification benchmark for QalbCare
+Compares latency, completion tokens and parse failures of the structured
+JSON classification call (enum schema, small output cap) against the
+original free-form "Category / Emotion / Reasoning" prompt on the same
+messages and model
+
+Usage: python scripts/benchmark_classification.py [--rounds 3]
+"""
+
+import sys
+import os
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.classification import CLASSIFY_OUTPUT_FORMAT, DISTRESS_EMOTIONS, read_classification
+from app.therapy_agent import CLASSIFY_PROMPT, GENERATION_CONFIGS, model
+
+MESSAGES = [
+    "Assalamu alaikum, how are you?",
+    "Who built you?",
+    "I feel so alone since I moved to a new city",
+    "I can't stop worrying about my exams",
+    "Nothing matters anymore, I just want to give up",
+    "I keep snapping at my family and then feel terrible",
+    "What was the first revelation to the Prophet?",
+    "Is it allowed to pray while travelling on a plane?",
+    "I have a girlfriend and I don't know how to stop",
+    "mujhe bohat udaasi mehsoos ho rahi hai",
+    "meri shaadi mein bohat pareshani hai",
+    "I'm so tired of everything, I sleep all day",
+    "Thanks, that really helped",
+    "What should I cook tonight?",
+]
+
+# The prompt's original output instruction, with the reasoning line
+LEGACY_OUTPUT_FORMAT = """Return your analysis in this format:
+Category: [category]
+Emotion: [emotion if emotional_distress, otherwise "none"]
+Reasoning: [brief explanation of why you classified it this way]"""
+
+
+def parse_legacy(response):
+    """The original prefix parser"""
+    category = "neutral"
+    emotion = "neutral"
+    for line in response.split('\n'):
+        if line.lower().startswith('category:'):
+            category = line.split(':', 1)[1].strip().lower()
+        elif line.lower().startswith('emotion:'):
+            emotion = line.split(':', 1)[1].strip().lower()
+    if category != "emotional_distress":
+        return category if category in ("greeting", "islamic_question", "haram_content") else "neutral"
+    return next((emo for emo in DISTRESS_EMOTIONS if emo in emotion), "neutral")
+
+
+def completion_tokens(response):
+    usage = getattr(response, "usage_metadata", None)
+    return getattr(usage, "candidates_token_count", 0) or 0
+
+
+def run_variant(name, build_prompt, parse, config, rounds):
+    latencies, tokens, labels, failures = [], [], {}, 0
+    for _ in range(rounds):
+        for message in MESSAGES:
+            prompt = build_prompt(message)
+            start = time.perf_counter()
+            try:
+                response = model.generate_content(prompt, generation_config=config)
+            except Exception as e:
+                print(f"   ⚠️ {name} call failed: {e}")
+                failures += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            tokens.append(completion_tokens(response))
+            try:
+                labels.setdefault(message, parse(response))
+            except ValueError:
+                failures += 1
+
+    latencies.sort()
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+    print(f"{name:>12}: p50 {statistics.median(latencies or [0]) * 1000:7.0f} ms   "
+          f"p95 {p95 * 1000:7.0f} ms   "
+          f"{statistics.mean(tokens or [0]):6.1f} completion tokens   "
+          f"{failures} failures")
+    return labels
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark structured vs free-form classification")
+    parser.add_argument("--rounds", type=int, default=3, help="Passes over the message set per variant")
+    args = parser.parse_args()
+
+    print(f"🧪 Classifying {len(MESSAGES)} messages x {args.rounds} rounds with {model.model_name}")
+
+    def legacy_prompt(message):
+        return CLASSIFY_PROMPT.render(user_msg=message).replace(CLASSIFY_OUTPUT_FORMAT, LEGACY_OUTPUT_FORMAT)
+
+    legacy = run_variant("free-form", legacy_prompt, lambda response: parse_legacy(response.text.strip()), None, args.rounds)
+    structured = run_variant(
+        "structured", lambda message: CLASSIFY_PROMPT.render(user_msg=message),
+        read_classification, GENERATION_CONFIGS["classify_emotion"], args.rounds
+    )
+
+    agree = sum(1 for message in MESSAGES if message in legacy and legacy[message] == structured.get(message))
+    print(f"✅ Labels agree on {agree}/{len(MESSAGES)} messages")
+    for message in MESSAGES:
+        if legacy.get(message) != structured.get(message):
+            print(f"   {message[:50]:<50} free-form={legacy.get(message)} structured={structured.get(message)}")
+
+
+if __name__ == "__main__":
+    main()
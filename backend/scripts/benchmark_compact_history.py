@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""
+Compact history benchmark for QalbCare
+Compares the per-user memory footprint and serialize/parse time of the
+conversation and emotional histories stored as lists of dicts (the JSON
+view, as loaded from legacy files) and as interned, array-backed rings
+
+Usage: python scripts/benchmark_compact_history.py [--ops 5000] [--users 1000]
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+import tempfile
+from array import array
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.compact_history import context_view, encode_history, inflate_histories
+from app.context_manager import AdvancedContextManager
+from app.context_store import ORJSON_AVAILABLE
+
+MESSAGES = [
+    ("I feel so anxious about my exams and my family expectations", "anxious"),
+    ("My family keeps fighting and I feel alone at home", "lonely"),
+    ("I missed my prayers again and feel guilty about it", "guilty"),
+    ("Alhamdulillah today was a bit better, I feel grateful", "hopeful"),
+]
+
+HISTORY_KEYS = ("conversation_history", "emotional_history")
+
+
+def build_context(manager, user):
+    """A context whose histories are full, with per-user message text"""
+    context = manager._create_default_context()
+    for i in range(40):
+        message, emotion = MESSAGES[i % len(MESSAGES)]
+        manager._apply_conversation(context, f"{message} ({user}, {i})", emotion, 600, time.time())
+    return context
+
+
+def deep_size(obj, seen):
+    """Bytes reachable from obj, counting shared objects once"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, array)):
+        return size
+    if isinstance(obj, dict):
+        return size + sum(deep_size(k, seen) + deep_size(v, seen) for k, v in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return size + sum(deep_size(item, seen) for item in obj)
+    for cls in type(obj).__mro__:
+        for slot in getattr(cls, "__slots__", ()):
+            size += deep_size(getattr(obj, slot), seen)
+    return size
+
+
+def per_op_us(fn, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark compact user histories")
+    parser.add_argument("--ops", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("🧮 Compact history benchmark")
+    print("=" * 60)
+
+    with tempfile.TemporaryDirectory(prefix="qalbcare_hist_") as workdir:
+        manager = AdvancedContextManager(data_dir=workdir, flush_interval=0)
+        compact = [build_context(manager, f"user{i}") for i in range(args.users)]
+        # What the old layout held in memory: a fresh parse of the record view
+        records = [json.loads(json.dumps(context_view(context))) for context in compact]
+
+    def histories(contexts):
+        return [{key: context[key] for key in HISTORY_KEYS} for context in contexts]
+
+    # Interned symbols and code tuples are shared by all users, so one seen-set
+    # over the whole population charges them once, as in the process
+    sizes = {}
+    for name, contexts in (("list of dicts", records), ("compact rings", compact)):
+        seen = set()
+        sizes[name] = sum(deep_size(h, seen) for h in histories(contexts)) / args.users
+        seen = set()
+        messages = sum(
+            deep_size(entry["message"], seen) for context in records for entry in context["conversation_history"]
+        ) / args.users
+        sizes[name + " (excl. messages)"] = sizes[name] - messages
+
+    print(f"\n{'memory per user':<34}{'bytes':>10}")
+    for name, size in sizes.items():
+        print(f"{name:<34}{size:>10.0f}")
+    print(f"{'reduction':<34}{sizes['list of dicts'] / sizes['compact rings']:>9.1f}x"
+          f"  ({sizes['list of dicts (excl. messages)'] / sizes['compact rings (excl. messages)']:.1f}x excl. messages)")
+
+    encoders = [("json", lambda obj, default=None: json.dumps(obj, separators=(",", ":"), default=default).encode("utf-8"),
+                 json.loads)]
+    if ORJSON_AVAILABLE:
+        import orjson
+        encoders.insert(0, ("orjson", lambda obj, default=None: orjson.dumps(obj, default=default), orjson.loads))
+    else:
+        print("⚠️  orjson not installed, skipping it")
+
+    # The histories alone, and the whole context they are stored in
+    scopes = {
+        "histories": (histories(records[:1])[0], histories(compact[:1])[0]),
+        "context": (records[0], compact[0]),
+    }
+    for scope, (record_obj, compact_obj) in scopes.items():
+        print(f"\n{scope + ' (one user)':<28}{'bytes':>8}{'serialize µs':>15}{'parse µs':>11}")
+        for encoder, dump, load in encoders:
+            layouts = {
+                "list of dicts": (lambda: dump(record_obj), load),
+                "compact rings": (lambda: dump(compact_obj, encode_history), lambda data: inflate_histories(load(data))),
+            }
+            for name, (serialize, parse) in layouts.items():
+                data = serialize()
+                serialize_us = per_op_us(serialize, args.ops)
+                parse_us = per_op_us(lambda: parse(data), args.ops)
+                print(f"{encoder + ', ' + name:<28}{len(data):>8}{serialize_us:>15.1f}{parse_us:>11.1f}")
+
+
+if __name__ == "__main__":
+    main()
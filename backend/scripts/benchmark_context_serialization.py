@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Context serialization benchmark for QalbCare
+Measures serialize/parse time and size of a realistic user context for the
+legacy pretty-printed JSON, compact stdlib JSON and orjson encodings, and
+the per-update cost of the JSON file store in legacy and compact mode
+
+Usage: python scripts/benchmark_context_serialization.py [--ops 5000]
+"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.compact_history import context_view
+from app.context_manager import AdvancedContextManager
+from app.context_store import ORJSON_AVAILABLE, JsonFileContextStore, dumps_context, loads_context
+
+MESSAGES = [
+    ("I feel so anxious about my exams and my family expectations", "anxious"),
+    ("My family keeps fighting and I feel alone at home", "lonely"),
+    ("I missed my prayers again and feel guilty about it", "guilty"),
+    ("Alhamdulillah today was a bit better, I feel grateful", "hopeful"),
+]
+
+
+def build_context(manager):
+    """A context that has seen enough messages to fill every capped history"""
+    context = manager._create_default_context()
+    for i in range(40):
+        message, emotion = MESSAGES[i % len(MESSAGES)]
+        manager._apply_conversation(context, message, emotion, 600, time.time())
+        manager._apply_response_usage(context, emotion, "counseling", time.time())
+    return context
+
+
+def per_op_us(fn, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark user context serialization")
+    parser.add_argument("--ops", type=int, default=5000)
+    args = parser.parse_args()
+
+    print("📦 Context serialization benchmark")
+    print("=" * 60)
+
+    workdir = Path(tempfile.mkdtemp(prefix="qalbcare_ser_"))
+    try:
+        manager = AdvancedContextManager(data_dir=str(workdir / "unused"), flush_interval=0)
+        context = build_context(manager)
+        # The legacy encodings stored histories as lists of records
+        legacy = context_view(context)
+
+        encodings = {
+            "json indent=2 (legacy)": (
+                lambda: json.dumps(legacy, ensure_ascii=False, indent=2).encode("utf-8"),
+                json.loads,
+            ),
+            "json compact": (
+                lambda: json.dumps(legacy, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                json.loads,
+            ),
+        }
+        if ORJSON_AVAILABLE:
+            encodings["orjson"] = (lambda: dumps_context(context), loads_context)
+        else:
+            print("⚠️  orjson not installed, skipping it")
+
+        print(f"\n{'encoding':<24}{'bytes':>8}{'serialize µs':>15}{'parse µs':>11}")
+        for name, (dump, load) in encodings.items():
+            data = dump()
+            serialize_us = per_op_us(dump, args.ops)
+            parse_us = per_op_us(lambda: load(data), args.ops)
+            print(f"{name:<24}{len(data):>8}{serialize_us:>15.1f}{parse_us:>11.1f}")
+
+        print(f"\n{'file store update':<24}{'ms/op':>8}")
+        for name, pretty in (("legacy pretty", True), ("compact + atomic", False)):
+            store = JsonFileContextStore(str(workdir / name.replace(" ", "_")), pretty=pretty)
+            store.save("user", context)
+            ops = max(1, args.ops // 5)
+            update_us = per_op_us(lambda: store.update("user", lambda c: None, dict), ops)
+            print(f"{name:<24}{update_us / 1000:>8.3f}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Context store benchmark for QalbCare
+Compares the JSON-file and SQLite (WAL) backends of AdvancedContextManager
+on population, per-message update, load and active-user scan costs
+
+Usage: python scripts/benchmark_context_store.py [--users 10000 1000000] [--ops 2000]
+"""
+
+import sys
+import os
+import time
+import random
+import shutil
+import argparse
+import tempfile
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.context_manager import AdvancedContextManager
+from app.context_store import JsonFileContextStore, SQLiteContextStore
+
+MESSAGES = [
+    ("I feel so anxious about my exams", "anxious"),
+    ("My family keeps fighting and I feel alone", "lonely"),
+    ("I missed my prayers again and feel guilty", "guilty"),
+    ("Work has been overwhelming this month", "overwhelmed"),
+]
+
+
+def populate(manager, users):
+    """Seed every user with a default context, inside one transaction for SQLite"""
+    context = manager._create_default_context()
+    store = manager.store
+    start = time.perf_counter()
+    if isinstance(store, SQLiteContextStore):
+        conn = store._connect()
+        conn.execute("BEGIN")
+        for i in range(users):
+            context["last_seen"] = time.time() - random.randint(0, 30 * 86400)
+            conn.execute(
+                "INSERT OR REPLACE INTO user_context (user_id, last_seen, sessions_count, context) VALUES (?, ?, ?, ?)",
+                (f"user_{i}", *store._columns(context)),
+            )
+        conn.execute("COMMIT")
+    else:
+        for i in range(users):
+            context["last_seen"] = time.time() - random.randint(0, 30 * 86400)
+            store.save(f"user_{i}", context)
+    return time.perf_counter() - start
+
+
+def timed(fn, ops):
+    start = time.perf_counter()
+    for _ in range(ops):
+        fn()
+    return (time.perf_counter() - start) / ops * 1000
+
+
+def run_backend(name, manager, users, ops):
+    populate_s = populate(manager, users)
+
+    def update():
+        message, emotion = random.choice(MESSAGES)
+        manager.update_conversation(f"user_{random.randrange(users)}", message, emotion, "x" * 600)
+
+    def load():
+        manager.load_user_context(f"user_{random.randrange(users)}")
+
+    update_ms = timed(update, ops)
+    load_ms = timed(load, ops)
+
+    start = time.perf_counter()
+    active = manager.get_active_users(time.time() - 86400)
+    scan_s = time.perf_counter() - start
+
+    print(f"{name:<8} populate {populate_s:8.1f}s  update {update_ms:7.3f} ms  load {load_ms:7.3f} ms  "
+          f"scan 24h {scan_s:8.3f}s ({len(active)} users)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark context store backends")
+    parser.add_argument("--users", type=int, nargs="+", default=[10000])
+    parser.add_argument("--ops", type=int, default=2000)
+    parser.add_argument("--backends", nargs="+", default=["json", "sqlite"])
+    args = parser.parse_args()
+
+    print("🗄️  Context store benchmark")
+    print("=" * 60)
+
+    for users in args.users:
+        print(f"\n👥 {users:,} users, {args.ops} operations")
+        for backend in args.backends:
+            workdir = Path(tempfile.mkdtemp(prefix="qalbcare_ctx_"))
+            try:
+                if backend == "sqlite":
+                    store = SQLiteContextStore(str(workdir / "user_context.db"))
+                else:
+                    store = JsonFileContextStore(str(workdir / "user_context"))
+                # Write-through so every operation reaches the backend under test
+                manager = AdvancedContextManager(data_dir=str(workdir / "user_context"), store=store, flush_interval=0)
+                run_backend(backend, manager, users, args.ops)
+            finally:
+                shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
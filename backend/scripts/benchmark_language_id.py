@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""
+Language identification benchmark for QalbCare
+Compares accuracy and speed of the n-gram identifier against the original
+substring-based detect_language on held-out messages, including short
+greetings and code-mixed lines
+
+Usage: python scripts/benchmark_language_id.py
+"""
+
+import sys
+import os
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.language_id import language_identifier
+
+HELD_OUT = [
+    ("I have been feeling down since my grandmother died", "english"),
+    ("Why can't I be happy like everyone else?", "english"),
+    ("My roommate keeps making noise at night", "english"),
+    ("I'm nervous about my interview tomorrow", "english"),
+    ("Hey, are you there?", "english"),
+    ("I miss home", "english"),
+    ("Nobody cares about me", "english"),
+    ("I got rejected from the university I wanted", "english"),
+    ("What is the point of all this?", "english"),
+    ("I keep losing my temper with my kids", "english"),
+    ("mujhe apne ghar ki yaad aati hai", "roman_urdu"),
+    ("mein kal interview ke liye bohat nervous hun", "roman_urdu"),
+    ("meri nani ka inteqal ho gaya", "roman_urdu"),
+    ("koi meri parwah nahi karta", "roman_urdu"),
+    ("mujhe university mein admission nahi mila", "roman_urdu"),
+    ("bachon par ghussa aa jata hai", "roman_urdu"),
+    ("aap wahan ho?", "roman_urdu"),
+    ("sab kuch chhod dene ka dil karta hai", "roman_urdu"),
+    ("mera roommate raat ko shor karta hai", "roman_urdu"),
+    ("mein khush kyun nahi reh sakti", "roman_urdu"),
+    ("مجھے اپنے گھر کی یاد آتی ہے", "urdu"),
+    ("میری نانی کا انتقال ہو گیا", "urdu"),
+    ("کوئی میری پرواہ نہیں کرتا", "urdu"),
+    ("میں بہت اداس ہوں", "urdu"),
+    # More full sentences
+    ("I can't forgive myself for what I did", "english"),
+    ("My brother stopped talking to the whole family", "english"),
+    ("Do you think Allah will forgive me?", "english"),
+    ("I have an exam in two days and I can't study", "english"),
+    ("My mom keeps comparing me to my cousins", "english"),
+    ("I feel like nobody would notice if I disappeared", "english"),
+    ("Can we talk for a bit?", "english"),
+    ("I've been crying since morning", "english"),
+    ("mujhe apne aap se nafrat hone lagi hai", "roman_urdu"),
+    ("mere bhai ne ghar walon se baat karna chhod diya", "roman_urdu"),
+    ("kya Allah mujhe maaf kar dega", "roman_urdu"),
+    ("do din mein paper hai aur parha nahi ja raha", "roman_urdu"),
+    ("ammi hamesha mujhe cousins se compare karti hain", "roman_urdu"),
+    ("subah se ro rahi hun", "roman_urdu"),
+    ("kya hum thori der baat kar sakte hain", "roman_urdu"),
+    ("mujhe kisi pe bharosa nahi raha", "roman_urdu"),
+    ("میں اپنے آپ کو معاف نہیں کر سکتا", "urdu"),
+    ("کیا اللہ مجھے معاف کر دے گا", "urdu"),
+    ("صبح سے رو رہی ہوں", "urdu"),
+    ("مجھے کسی پر بھروسہ نہیں رہا", "urdu"),
+    # Short greetings and words shared by both languages
+    ("hey hi", "english"),
+    ("Hi!", "english"),
+    ("hello?", "english"),
+    ("salaam alaikum", "english"),
+    ("Salaam!", "english"),
+    ("Allah help me", "english"),
+    ("acha", "english"),
+    ("ok thanks", "english"),
+    ("wa alaikum assalam", "english"),
+    ("mashallah that's nice", "english"),
+    ("alhamdulillah I'm better", "english"),
+    ("hmm okay", "english"),
+    ("shukriya", "roman_urdu"),
+    ("acha phir theek hai", "roman_urdu"),
+    ("salam kaise ho", "roman_urdu"),
+    ("Allah ka shukar", "roman_urdu"),
+    ("السلام علیکم ورحمۃ اللہ", "urdu"),
+    ("بہت شکریہ", "urdu"),
+    # Code-mixed: the reply follows the language carrying the sentence
+    ("yaar today was really bad", "english"),
+    ("I feel so akela at home", "english"),
+    ("my nana passed away last week", "english"),
+    ("I'm in so much tension about my results", "english"),
+    ("mera result acha nahi aaya", "roman_urdu"),
+    ("mujhe bohat lonely feel ho raha hai", "roman_urdu"),
+    ("boss ne sab ke samne insult kiya", "roman_urdu"),
+    ("exams ki wajah se neend nahi aa rahi", "roman_urdu"),
+    ("mera mood aaj bilkul off hai", "roman_urdu"),
+    ("yaar mujhe samajh nahi aa raha life mein kya karun", "roman_urdu"),
+]
+
+
+def baseline_detect_language(text: str) -> str:
+    """Original substring-based detector, kept here as the comparison baseline"""
+    text = text.strip().lower()
+
+    english_indicators = [
+        "i am", "i'm", "i feel", "i'm feeling", "feeling", "my", "me", "you", "the", "and", "or", "but", "with", "have", "has", "do", "does", "can", "will", "would", "should", "could", "to", "from", "in", "on", "at", "for", "about", "very", "really", "so", "much", "more", "most", "some", "any", "all", "no", "not", "what", "how", "why", "when", "where", "who", "which", "that", "this", "these", "those", "am", "is", "are", "was", "were", "been", "being", "sad", "happy", "angry", "anxious", "depressed", "worried", "scared", "lonely", "tired", "upset", "hurt", "pain", "help", "need", "want", "like", "love", "hate", "good", "bad", "better", "worse", "best", "worst", "hello", "hi", "hey", "thanks", "thank", "please", "sorry", "excuse", "today", "tomorrow", "yesterday", "now", "then", "here", "there", "always", "never", "sometimes", "usually", "often", "maybe", "perhaps", "probably", "definitely", "certainly", "absolutely", "exactly", "only", "just", "still", "already", "yet", "again", "back", "away", "up", "down", "over", "under", "through", "around", "between", "among", "during", "before", "after", "since", "until", "while", "although", "because", "if", "unless", "whether", "either", "neither", "both", "each", "every", "many", "few", "little", "enough", "too", "quite", "rather", "pretty", "fairly", "extremely", "incredibly", "amazingly", "surprisingly", "unfortunately", "hopefully", "actually", "basically", "generally", "specifically", "particularly", "especially", "obviously", "clearly", "apparently", "probably", "possibly", "certainly", "definitely", "absolutely", "completely", "totally", "fully", "partially", "slightly", "somewhat", "quite", "rather", "pretty", "fairly", "really", "very", "extremely", "incredibly", "amazingly", "surprisingly", "unfortunately", "hopefully", "actually", "basically", "generally", "specifically", "particularly", "especially", "obviously", "clearly", "apparently"
+    ]
+
+    for indicator in english_indicators:
+        if indicator in text:
+            return "english"
+
+    clear_urdu_words = ["mein", "hun", "hai", "kya", "nahi", "bohat", "kaise", "theek", "accha", "bura", "kaun", "kahan", "kab", "kyun", "kuch", "sab", "yeh", "woh", "aur", "lekin", "phir", "abhi", "kal", "raat", "din", "ghar", "dost", "dil", "mohabbat", "khushi", "gham", "pareshani", "masla", "madad", "chahiye", "hoga", "tha", "tha", "thi", "thay", "main", "mera", "mere", "meri", "tumhara", "tumhare", "tumhari", "uska", "uske", "uski", "humara", "humare", "humari"]
+
+    words = text.split()
+    urdu_count = sum(1 for word in words if word in clear_urdu_words)
+
+    if urdu_count >= 2 and len(words) <= 10:
+        return "roman_urdu"
+
+    return "english"
+
+
+def evaluate(name, detector, iterations=2000, show_misses=False):
+    correct = sum(1 for text, label in HELD_OUT if detector(text) == label)
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        for text, _ in HELD_OUT:
+            detector(text)
+    elapsed = time.perf_counter() - start
+    per_call_us = elapsed / (iterations * len(HELD_OUT)) * 1e6
+
+    print(f"{name:<24} accuracy {correct}/{len(HELD_OUT)} ({correct / len(HELD_OUT):.0%})  {per_call_us:.1f} µs/call")
+
+    for label in ("english", "roman_urdu", "urdu"):
+        subset = [(t, l) for t, l in HELD_OUT if l == label]
+        hits = sum(1 for t, l in subset if detector(t) == l)
+        print(f"    {label:<12} {hits}/{len(subset)}")
+
+    short = [(t, l) for t, l in HELD_OUT if len(t.split()) <= 2]
+    hits = sum(1 for t, l in short if detector(t) == l)
+    print(f"    {'<= 2 words':<12} {hits}/{len(short)}")
+    for text, label in HELD_OUT if show_misses else ():
+        predicted = detector(text)
+        if predicted != label:
+            print(f"      ✗ {text[:40]:<40} expected {label}, got {predicted}")
+
+
+def main():
+    print("🔤 Language identification benchmark")
+    print("=" * 60)
+    evaluate("baseline substring", baseline_detect_language)
+    evaluate("n-gram naive Bayes", language_identifier.classify, show_misses=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Shared rate limit backend benchmark for QalbCare
+Measures the cost of one check plus header lookup for the per-process
+limiter and for the shared mmap and Redis-protocol backends, and how many
+requests N worker processes admit together against one per-minute limit
+(the configured limit with a shared backend, N times it without)
+
+The Redis-protocol backend runs against REDIS_URL if set, otherwise
+against the in-process stand-in server
+
+Usage: python scripts/benchmark_rate_limit_backends.py [--ops 20000] [--workers 4]
+"""
+
+import sys
+import os
+import time
+import argparse
+import tempfile
+import multiprocessing
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.rate_limiter import RateLimiter
+from app.rate_limit_backends import MmapRateLimitBackend, RespRateLimitBackend, RespStandIn
+
+LIMIT = 100
+
+
+def build(kind, target, **limits):
+    backend = None
+    if kind == "mmap":
+        backend = MmapRateLimitBackend(target)
+    elif kind == "redis":
+        backend = RespRateLimitBackend(target)
+    return RateLimiter(sweep_interval=0, backend=backend, **limits)
+
+
+def time_checks(kind, target, ops):
+    huge = ops * 10
+    limiter = build(kind, target, requests_per_minute=huge, requests_per_hour=huge,
+                    requests_per_day=huge, burst_size=huge)
+    clients = [f"10.0.{i // 256}.{i % 256}" for i in range(1000)]
+    start = time.perf_counter()
+    for i in range(ops):
+        client = clients[i % len(clients)]
+        _, _, minute_count = limiter.check_and_count(client)
+        limiter.rate_limit_headers(minute_count, time.time())
+    elapsed = (time.perf_counter() - start) / ops * 1e6
+    limiter.close()
+    return elapsed
+
+
+def worker(kind, target, attempts, queue):
+    limiter = build(kind, target, requests_per_minute=LIMIT, requests_per_hour=LIMIT * 10,
+                    requests_per_day=LIMIT * 10, burst_size=LIMIT * 10)
+    queue.put(sum(limiter.check("203.0.113.7")[0] for _ in range(attempts)))
+    limiter.close()
+
+
+def admitted(kind, target, workers):
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    processes = [context.Process(target=worker, args=(kind, target, LIMIT, queue)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    total = sum(queue.get(timeout=60) for _ in processes)
+    for process in processes:
+        process.join()
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark shared rate limit backends")
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=4)
+    args = parser.parse_args()
+
+    standin = None
+    redis_url = os.getenv("REDIS_URL")
+    if not redis_url:
+        standin = RespStandIn().start()
+        redis_url = standin.url
+
+    print("🚦 Shared rate limit backend benchmark")
+    print("=" * 60)
+    print(f"Redis protocol server: {redis_url}{' (stand-in)' if standin else ''}")
+    print(f"\n{'backend':>10}{'check+headers µs':>20}{f'admitted by {args.workers} workers':>26}")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for kind in ("local", "mmap", "redis"):
+            if kind == "mmap":
+                timing_target = os.path.join(tmp, "timing.bin")
+                shared_target = os.path.join(tmp, "shared.bin")
+            else:
+                timing_target = shared_target = redis_url
+            if kind == "redis" and standin is not None:
+                standin.execute([b"FLUSHALL"])
+            check_us = time_checks(kind, timing_target, args.ops)
+            if kind == "redis" and standin is not None:
+                standin.execute([b"FLUSHALL"])
+            total = admitted(kind, shared_target, args.workers)
+            print(f"{kind:>10}{check_us:>20.2f}{total:>26}  (limit {LIMIT}/min)")
+
+    if standin is not None:
+        standin.close()
+
+
+if __name__ == "__main__":
+    main()
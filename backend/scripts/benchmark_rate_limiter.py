@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Rate limiter microbenchmark for QalbCare
+Measures the cost of one rate-limit check plus header lookup as a client's
+request history grows, for the sliding-window limiter and for the
+previous approach of scanning the full timestamp history on every check
+
+Usage: python scripts/benchmark_rate_limiter.py [--ops 20000]
+"""
+
+import sys
+import os
+import time
+import argparse
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.rate_limiter import RateLimiter
+
+HISTORY_SIZES = [10, 100, 1000, 10000]
+
+
+def scan_check(history, current_time, limits):
+    """The previous check: one pass over the history per window"""
+    for window, limit in limits:
+        if sum(1 for t in history if t > current_time - window) >= limit:
+            return False
+    history.append(current_time)
+    # Keep the history at its benchmark size
+    history.popleft()
+    # Header lookup scanned again
+    sum(1 for t in history if t > current_time - 60)
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark rate limit checks")
+    parser.add_argument("--ops", type=int, default=20000)
+    args = parser.parse_args()
+
+    print("🚦 Rate limiter benchmark")
+    print("=" * 60)
+    print(f"\n{'history':>10}{'sliding window µs':>20}{'full scan µs':>15}")
+
+    for size in HISTORY_SIZES:
+        # Limits high enough that nothing is rejected, so the history keeps growing
+        huge = size + args.ops + 1
+        limiter = RateLimiter(requests_per_minute=huge, requests_per_hour=huge,
+                              requests_per_day=huge, burst_size=huge, sweep_interval=0)
+        # Prefill: `size` requests inside the current minute
+        now = time.time()
+        for i in range(size):
+            limiter.check("10.0.0.1", now - 30 + i * 30 / size)
+
+        start = time.perf_counter()
+        for i in range(args.ops):
+            t = now + i * 1e-6
+            limiter.check("10.0.0.1", t)
+            limiter.get_rate_limit_headers("10.0.0.1")
+        window_us = (time.perf_counter() - start) / args.ops * 1e6
+
+        history = deque(now - 30 + i * 30 / size for i in range(size))
+        limits = [(60, huge), (3600, huge), (86400, huge)]
+        scan_ops = max(10, min(args.ops, 200_000 // size))
+        start = time.perf_counter()
+        for i in range(scan_ops):
+            scan_check(history, now + i * 1e-6, limits)
+        scan_us = (time.perf_counter() - start) / scan_ops * 1e6
+
+        print(f"{size:>10}{window_us:>20.2f}{scan_us:>15.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Speculative counseling benchmark for QalbCare
+Runs the same messages through the chat pipeline with speculative
+counseling off and on, and reports end-to-end latency next to the
+speculation stats: how often the local prediction held, the latency it
+saved and the tokens thrown away on wrong guesses
+
+Usage: python scripts/benchmark_speculation.py [--rounds 2]
+"""
+
+import sys
+import os
+import time
+import uuid
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.cost_quota import metered_request
+import app.therapy_agent as therapy_agent
+
+MESSAGES = [
+    "I feel so lonely since I moved to a new city",
+    "I'm really anxious about my exams next week",
+    "I feel hopeless, nothing I do works out",
+    "I'm so tired of everything lately",
+    "I feel guilty for shouting at my mother",
+    "I'm angry at my brother and can't calm down",
+    "Everything feels empty and pointless",
+    "I'm sad and I can't stop crying",
+    "I feel overwhelmed with work and family",
+    "I'm confused about what to do with my life",
+    "Assalamu alaikum, how are you?",
+    "What was the first revelation to the Prophet?",
+]
+
+
+def run(messages, speculative):
+    therapy_agent.SPECULATIVE_COUNSELING = speculative
+    latencies, tokens = [], 0
+    for message in messages:
+        state = {"user_id": f"bench-{uuid.uuid4().hex[:8]}", "name": "Friend", "message": message}
+        with metered_request() as meter:
+            start = time.perf_counter()
+            therapy_agent.langgraph_app.invoke(state)
+            latencies.append(time.perf_counter() - start)
+        tokens += meter.tokens
+    return latencies, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark speculative counseling generation")
+    parser.add_argument("--rounds", type=int, default=2, help="Passes over the message set per mode")
+    args = parser.parse_args()
+
+    # Compare generated replies only
+    therapy_agent.RESPONSE_BANK_SHARE = 0.0
+    messages = MESSAGES * args.rounds
+    predicted = sum(1 for message in MESSAGES if therapy_agent.predict_distress(message))
+    print(f"🧪 {len(messages)} messages per mode, {predicted}/{len(MESSAGES)} predicted locally as distress")
+
+    for label, speculative in (("sequential", False), ("speculative", True)):
+        latencies, tokens = run(messages, speculative)
+        print(f"{label:>12}: mean {statistics.mean(latencies):6.2f}s   "
+              f"median {statistics.median(latencies):6.2f}s   {tokens:>7} tokens")
+
+    stats = therapy_agent.speculation_stats.get_stats()
+    print(f"✅ Speculations: {stats['started']} started, {stats['kept']} kept, {stats['discarded']} discarded")
+    print(f"   Saved {stats['saved_seconds']:.2f}s in total ({stats['avg_saved_seconds']:.2f}s per kept reply)")
+    print(f"   Wasted {stats['wasted_tokens']} tokens in {stats['wasted_calls']} calls "
+          f"({stats['wasted_tokens_per_saved_second']} per second saved)")
+
+
+if __name__ == "__main__":
+    main()
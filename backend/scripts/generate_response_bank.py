@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Pre-generate the counseling response bank for QalbCare
+Generates many distress replies (opening, prophet or companion story, four
+CBT techniques, closure) for each emotion x language with the Gemini model,
+a bounded number of calls at a time, drops near-duplicates by embedding
+similarity and writes the compact indexed bank file the chat pipeline
+serves from (RESPONSE_BANK_PATH)
+
+Usage: python scripts/generate_response_bank.py [--per-bucket 40] [--concurrency 4] [--output data/response_bank.bin]
+"""
+
+import sys
+import os
+import random
+import argparse
+import itertools
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from dotenv import load_dotenv
+
+from app.response_bank import NAME_PLACEHOLDER, deduplicate, generate_replies, hashed_embedding, write_bank
+from app.response_sanitizer import clean_ai_response
+
+EMOTIONS = ["sad", "anxious", "hopeless", "guilty", "lonely", "angry", "tired", "empty", "overwhelmed", "confused"]
+
+LANGUAGES = {
+    "english": "Respond warmly in English.",
+    "roman_urdu": "Respond gently in Roman Urdu.",
+    "urdu": "Respond gently in Urdu script.",
+}
+
+# Story sources rotated across prompts so the bank covers many stories
+STORY_SOURCES = [
+    "Prophet Yusuf (AS)", "Prophet Yunus (AS)", "Prophet Ayyub (AS)", "Prophet Musa (AS)",
+    "Prophet Ibrahim (AS)", "Prophet Yaqub (AS)", "Maryam (AS)", "Hajar (AS)",
+    "the Prophet Muhammad ﷺ in the Year of Sorrow", "the Prophet Muhammad ﷺ at Ta'if",
+    "Abu Bakr (RA)", "Umar ibn al-Khattab (RA)", "Bilal ibn Rabah (RA)", "Khadijah (RA)",
+    "Aisha (RA)", "Salman al-Farsi (RA)", "Mus'ab ibn Umair (RA)", "Sumayyah (RA)",
+]
+
+TONES = ["gentle", "hopeful", "tender", "comforting", "reassuring", "sincere", "soft-spoken"]
+
+MODELS_TO_TRY = ["models/gemini-2.5-flash", "models/gemini-2.0-flash", "models/gemini-1.5-flash"]
+
+
+def build_prompt(emotion: str, language: str, story_source: str, tone: str) -> str:
+    return (
+        f"You are a compassionate Islamic counselor. Write a reply to someone who feels {emotion}.\n"
+        f"Address them as {NAME_PLACEHOLDER} (write exactly {NAME_PLACEHOLDER}, it is filled in later).\n\n"
+        "Structure, as plain paragraphs without headings or markdown:\n"
+        f"1. A {tone} opening of one or two sentences acknowledging the feeling.\n"
+        f"2. A short, authentic story about {story_source} that relates to feeling {emotion}.\n"
+        "3. 'Here are steps to heal:' followed by exactly four numbered techniques combining\n"
+        "   cognitive behavioral therapy with Islamic practice (dhikr, salah, dua, Quran).\n"
+        "4. A closing of one or two sentences of hope.\n\n"
+        "Do not include a dua at the end; one is added separately.\n"
+        f"{LANGUAGES[language]}"
+    )
+
+
+def load_model(model_name=None):
+    import google.generativeai as genai
+
+    genai.configure(api_key=os.environ["GOOGLE_API_KEY"])
+    for name in ([model_name] if model_name else MODELS_TO_TRY):
+        try:
+            model = genai.GenerativeModel(name)
+            model.generate_content("Hello")
+            print(f"✅ Using {name}")
+            return model
+        except Exception as e:
+            print(f"⚠️ {name} unavailable: {e}")
+    raise SystemExit("❌ No Gemini model could be initialized")
+
+
+def load_embedder():
+    """Sentence embeddings when available, character-trigram hashing otherwise"""
+    try:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer('paraphrase-MiniLM-L3-v2', device='cpu')
+        print("✅ Deduplicating with paraphrase-MiniLM-L3-v2 embeddings")
+        return lambda texts: [vector.tolist() for vector in model.encode(list(texts))]
+    except Exception as e:
+        print(f"⚠️ Sentence embeddings unavailable ({e}); using hashed trigram embeddings")
+        return lambda texts: [hashed_embedding(text) for text in texts]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate the counseling response bank")
+    parser.add_argument("--per-bucket", type=int, default=40, help="Generations per emotion x language")
+    parser.add_argument("--concurrency", type=int, default=4, help="Maximum LLM calls in flight")
+    parser.add_argument("--threshold", type=float, default=0.9, help="Cosine similarity that counts as a duplicate")
+    parser.add_argument("--emotions", nargs="+", default=EMOTIONS)
+    parser.add_argument("--languages", nargs="+", default=list(LANGUAGES), choices=list(LANGUAGES))
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--output", default=os.getenv("RESPONSE_BANK_PATH", "data/response_bank.bin"))
+    args = parser.parse_args()
+
+    load_dotenv()
+    model = load_model(args.model)
+    embed = load_embedder()
+
+    jobs = []
+    for emotion, language in itertools.product(args.emotions, args.languages):
+        sources = random.sample(STORY_SOURCES, len(STORY_SOURCES))
+        for i in range(args.per_bucket):
+            prompt = build_prompt(emotion, language, sources[i % len(sources)], random.choice(TONES))
+            jobs.append(((emotion, language), prompt))
+
+    print(f"🏦 Generating {len(jobs)} replies, {args.concurrency} at a time")
+
+    def generate(prompt):
+        text = clean_ai_response(model.generate_content(prompt).text.strip())
+        if NAME_PLACEHOLDER not in text:
+            raise ValueError("Reply does not address the user by the name placeholder")
+        return text
+
+    def progress(done, total):
+        if done % 20 == 0 or done == total:
+            print(f"   {done}/{total}")
+
+    generated = generate_replies(generate, jobs, concurrency=args.concurrency, progress=progress)
+
+    bank = {}
+    for bucket, texts in generated.items():
+        bank[bucket] = deduplicate(texts, embed, args.threshold)
+        print(f"   {bucket[0]:>12} / {bucket[1]:<11} {len(texts):>4} generated {len(bank[bucket]):>4} kept")
+
+    size = write_bank(args.output, bank, meta={"model": getattr(model, "model_name", None), "threshold": args.threshold})
+    total = sum(len(texts) for texts in bank.values())
+    print(f"✅ Wrote {total} replies to {args.output} ({size / 1024:.1f} KiB)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Online migration of QalbCare user files to the sharded layout
+Moves flat data/user_context/{user_id}.json files (and user_events/*.jsonl
+or user_memory spill files) into their hashed shard directories while the
+backend keeps running, at a bounded file and byte rate
+
+Safe to run concurrently with the server: files are moved with link+unlink,
+so a context the server already rewrote in its shard is never overwritten,
+and the server migrates any file it reads before the tool reaches it.
+
+Usage: python scripts/migrate_context_layout.py [--data-dir data/user_context]
+                                               [--suffix .json] [--files-per-sec 200]
+                                               [--mb-per-sec 5] [--dry-run]
+"""
+
+import sys
+import os
+import time
+import argparse
+from collections import Counter
+from pathlib import Path
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.context_store import move_without_clobber, shard_path
+
+
+class RateLimiter:
+    """Sleep as needed to keep both files/sec and bytes/sec under budget"""
+
+    def __init__(self, files_per_sec: float, bytes_per_sec: float):
+        self.files_per_sec = files_per_sec
+        self.bytes_per_sec = bytes_per_sec
+        self.start = time.monotonic()
+        self.files = 0
+        self.bytes = 0
+
+    def wait(self, size: int):
+        self.files += 1
+        self.bytes += size
+        elapsed = time.monotonic() - self.start
+        needed = max(
+            self.files / self.files_per_sec if self.files_per_sec > 0 else 0,
+            self.bytes / self.bytes_per_sec if self.bytes_per_sec > 0 else 0,
+        )
+        if needed > elapsed:
+            time.sleep(needed - elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat user files into the sharded layout")
+    parser.add_argument("--data-dir", default="data/user_context")
+    parser.add_argument("--suffix", default=".json", help=".json for contexts and spill files, .jsonl for event logs")
+    parser.add_argument("--files-per-sec", type=float, default=200)
+    parser.add_argument("--mb-per-sec", type=float, default=5)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    data_dir = Path(args.data_dir)
+    if not data_dir.is_dir():
+        print(f"❌ {data_dir} does not exist")
+        sys.exit(1)
+
+    print(f"🗂️  Migrating {data_dir}/*{args.suffix} to the sharded layout")
+    print(f"   limit: {args.files_per_sec:g} files/s, {args.mb_per_sec:g} MB/s{' (dry run)' if args.dry_run else ''}")
+
+    limiter = RateLimiter(args.files_per_sec, args.mb_per_sec * 1024 * 1024)
+    results = Counter()
+    started = time.monotonic()
+
+    # scandir streams entries instead of listing millions of names up front
+    with os.scandir(data_dir) as entries:
+        for entry in entries:
+            if not entry.is_file() or entry.name.startswith(".") or not entry.name.endswith(args.suffix):
+                continue
+            user_id = entry.name[:-len(args.suffix)]
+            try:
+                target = shard_path(data_dir, user_id, args.suffix)
+                size = entry.stat().st_size
+            except (ValueError, OSError) as e:
+                print(f"⚠️  Skipping {entry.name}: {e}")
+                results["skipped"] += 1
+                continue
+
+            if args.dry_run:
+                results["would move"] += 1
+            else:
+                results[move_without_clobber(Path(entry.path), target)] += 1
+            limiter.wait(size)
+
+            done = sum(results.values())
+            if done % 1000 == 0:
+                rate = done / max(time.monotonic() - started, 1e-9)
+                print(f"   {done:,} files ({rate:.0f}/s) {dict(results)}")
+
+    elapsed = time.monotonic() - started
+    print(f"✅ Done in {elapsed:.1f}s: {dict(results) or 'nothing to migrate'}")
+
+
+if __name__ == "__main__":
+    main()
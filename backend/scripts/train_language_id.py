@@ -0,0 +1,303 @@
+#!/usr/bin/env python3
+"""
+Train the QalbCare language identifier
+Builds the hashed character n-gram table shipped as app/language_id_model.bin
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app.language_id import MODEL_PATH, NUM_BUCKETS, train_table, save_table
+
+ENGLISH_SAMPLES = [
+    "I am feeling very sad today",
+    "I feel so alone and nobody understands me",
+    "I'm anxious about my exams next week",
+    "Everything is making me angry these days",
+    "I feel so depressed, nothing makes sense",
+    "How are you?",
+    "What's my name?",
+    "What can you do?",
+    "Hello, who are you?",
+    "Thank you so much for listening",
+    "I can't sleep at night because of my thoughts",
+    "My parents keep fighting and I don't know what to do",
+    "I lost my job and I feel hopeless",
+    "I feel guilty for missing my prayers",
+    "I'm tired of trying so hard and getting nothing",
+    "My friend stopped talking to me",
+    "I don't feel close to Allah anymore",
+    "Can you tell me a story about patience?",
+    "I feel empty inside",
+    "Why does this always happen to me?",
+    "I have been stressed about work for months",
+    "Nobody at school likes me",
+    "I'm scared of the future",
+    "I keep overthinking everything",
+    "Please help me, I am struggling",
+    "I feel like giving up",
+    "My heart feels heavy",
+    "Good morning, how is your day going?",
+    "I want to become a better Muslim",
+    "I am worried about my mother's health",
+    "I failed my driving test again",
+    "It's been a rough week",
+    "I feel overwhelmed by all my responsibilities",
+    "Sometimes I cry for no reason",
+    "What should I do about my situation?",
+    "I miss my father who passed away last year",
+    "I'm not feeling good",
+    "Good night, take care",
+    "My husband doesn't listen to me",
+    "My wife and I argue about money",
+    "I feel lonely even when I'm with people",
+    "I regret the things I said to my brother",
+    "I am grateful for your advice",
+    "Is it normal to feel this way?",
+    "I feel peaceful after praying",
+    "I'm confused about what to study at university",
+    "I have no motivation to do anything",
+    "My boss shouted at me in front of everyone",
+    "Tell me about yourself",
+    "Who created you?",
+    "I can't stop thinking about my mistakes",
+    "Everything seems pointless",
+    "I am happy today, alhamdulillah",
+    "I think I need someone to talk to",
+    "The exams are next month and I haven't started",
+    "My sister is sick and in the hospital",
+    "I feel worthless",
+    "I keep procrastinating and then hate myself",
+    "Nothing works out for me",
+    "I feel disconnected from my family",
+    "It hurts so much",
+    "I don't want to get out of bed",
+    "See you tomorrow",
+    "Hi there",
+    "I have so much anger inside me",
+    "I was betrayed by someone I trusted",
+    "I need help with my anxiety",
+    "My marriage is falling apart",
+    "How can I find peace?",
+    "I am so tired of everything",
+    "Please make dua for me",
+    "I moved to a new city and have no friends",
+    "My children don't respect me",
+    "I feel like a failure",
+    "I can't focus on anything",
+    "Thanks, that really helped",
+    "Do you remember what I told you yesterday?",
+    "I want to stop feeling like this",
+    "My exams went badly",
+    "I'm afraid of dying",
+    "Allah hafiz, thank you",
+    # Short greetings and Islamic phrases carry no Urdu on their own; the
+    # reply stays in English unless the rest of the message says otherwise
+    "hi",
+    "hello",
+    "hey",
+    "hii",
+    "salam",
+    "salaam",
+    "salam alaikum",
+    "assalamu alaikum",
+    "Assalamualaikum, hi",
+    "walaikum salam",
+    "Allah",
+    "ya Allah",
+    "Allah knows best",
+    "Allah is always with me",
+    "inshallah",
+    "inshallah it will get better",
+    "mashallah",
+    "alhamdulillah",
+    "subhanallah",
+    "jazakallah",
+    "jazakallah khair",
+    "ameen",
+    "ok",
+    "okay",
+    "hmm",
+    "yes",
+    "no",
+    "sure",
+    "thanks",
+    "bye",
+    "good",
+    "fine",
+    "salam, how are you?",
+    "hi, I need to talk",
+    "salaam, I had a bad day",
+    # English with a few Urdu words mixed in is still answered in English
+    "yaar I am so tired of everything",
+    "I feel so pareshan today",
+    "my ammi is sick and I am scared",
+    "my abbu shouted at me again",
+    "ok acha, thank you",
+    "acha I understand now",
+    "I miss my nani so much",
+    "bas I just want some peace",
+    "I made dua but nothing changed",
+    "I feel so much tension before exams",
+]
+
+ROMAN_URDU_SAMPLES = [
+    "mein bohat pareshan hun",
+    "mujhe bohat dukh ho raha hai",
+    "mera dil bohat udaas hai",
+    "kya haal hai",
+    "kaise ho aap",
+    "theek ho?",
+    "mujhe samajh nahi aa raha kya karun",
+    "meri ammi bemar hain",
+    "mere abbu mujh se naraz hain",
+    "mein akela mehsoos karta hun",
+    "mein akeli mehsoos karti hun",
+    "koi meri baat nahi sunta",
+    "mujhe neend nahi aati",
+    "mera imtihan kal hai aur mein dar rahi hun",
+    "meri naukri chali gayi",
+    "mujhe bohat ghussa aata hai",
+    "mein thak gaya hun",
+    "mein thak gayi hun sab se",
+    "zindagi mein kuch acha nahi ho raha",
+    "mujhe apni ghalti par sharminda hun",
+    "namaz chhoot gayi aur mujhe guilt hai",
+    "mera dost mujh se baat nahi karta",
+    "mujhe lagta hai Allah mujh se naraz hai",
+    "kya aap meri madad kar sakte hain",
+    "mujhe koi rasta nahi dikh raha",
+    "ghar mein roz jhagra hota hai",
+    "meri shaadi mein masle chal rahe hain",
+    "mera shohar meri baat nahi sunta",
+    "meri biwi mujh se naraz hai",
+    "mujhe apne mustaqbil ki fikar hai",
+    "dil bhari hai aaj",
+    "sab kuch bekar lagta hai",
+    "mein ro rahi thi raat bhar",
+    "kuch samajh nahi aata",
+    "shukriya aap ka",
+    "bohat shukriya, acha laga",
+    "aap kaun ho",
+    "aap ko kis ne banaya",
+    "mera naam kya hai",
+    "mujhe koi kahani sunao sabr ke bare mein",
+    "mein ne bohat koshish ki lekin kuch nahi hua",
+    "mujhe dua bata dein",
+    "mera dil nahi lagta kisi kaam mein",
+    "mein bohat dar gaya hun",
+    "mujhe apni zindagi se nafrat hai",
+    "sab log mujhe chhod kar chale gaye",
+    "meri behen hospital mein hai",
+    "mein fail ho gaya imtihan mein",
+    "kya karun samajh nahi aata",
+    "mujhe sukoon chahiye",
+    "mein khush hun aaj alhamdulillah",
+    "mujhe apne gunahon par afsos hai",
+    "mera kisi se baat karne ka dil nahi karta",
+    "aaj bohat bura din tha",
+    "abhi bhi dil dukhta hai",
+    "woh mujhe yaad aata hai",
+    "kal raat bohat roya",
+    "mujhe kuch acha nahi lag raha",
+    "meri madad karo please",
+    "phir se wahi masla hai",
+    "mein kamzor mehsoos karta hun",
+    "mujhe lagta hai mein kisi kaam ka nahi",
+    "ghar walon ko meri parwah nahi",
+    "mein apne walid ko yaad karta hun",
+    "wo mujhe chhod gayi",
+    "mera dimagh bohat pareshan hai",
+    "har waqt soch soch kar thak gaya hun",
+    "mein namaz parhna chahta hun lekin dil nahi karta",
+    "kya yeh normal hai",
+    "aap se baat kar ke acha laga",
+    "assalam o alaikum kya haal hain",
+    "allah hafiz phir milenge",
+    "mujhe bohat tension hai",
+    "mera beta meri izzat nahi karta",
+    "hum ne naya ghar liya lekin sukoon nahi",
+    "mein bohat akela hun is sheher mein",
+    "mujhe maaf kar do",
+    "meri koi nahi sunta ghar mein",
+    "dil karta hai sab chhod dun",
+    "mujhe Allah ke qareeb hona hai",
+    "subah se dil ghabra raha hai",
+    # Greetings with Urdu after them, and Urdu with English words mixed in
+    "salam, kya haal hai",
+    "hi, mein theek nahi hun",
+    "hello, mujhe baat karni hai",
+    "acha theek hai",
+    "acha phir kya karun",
+    "theek hai shukriya",
+    "Allah ka shukar hai",
+    "Allah mujhe maaf kar de",
+    "inshallah sab theek ho jayega",
+    "mujhe bohat stress hai exams ki wajah se",
+    "mera mood bohat off hai aaj",
+    "office mein boss ne bohat daanta",
+    "mujhe anxiety ho rahi hai",
+    "yaar mein bohat tired hun",
+    "meri family mujhe support nahi karti",
+    "mein depressed feel kar raha hun",
+    "mera breakup ho gaya hai",
+    "mujhe lagta hai mein fail ho jaunga",
+    "phone pe koi reply nahi karta",
+    "mujhe online class samajh nahi aati",
+]
+
+URDU_SAMPLES = [
+    "میں بہت پریشان ہوں",
+    "مجھے بہت دکھ ہو رہا ہے",
+    "میرا دل بہت اداس ہے",
+    "کیا حال ہے",
+    "آپ کیسے ہیں",
+    "مجھے سمجھ نہیں آ رہا کیا کروں",
+    "میری امی بیمار ہیں",
+    "میں اکیلا محسوس کرتا ہوں",
+    "مجھے نیند نہیں آتی",
+    "میری نوکری چلی گئی",
+    "مجھے بہت غصہ آتا ہے",
+    "میں تھک گیا ہوں",
+    "زندگی میں کچھ اچھا نہیں ہو رہا",
+    "شکریہ آپ کا",
+    "آپ کون ہیں",
+    "مجھے سکون چاہیے",
+    "مجھے اپنے گناہوں پر افسوس ہے",
+    "آج بہت برا دن تھا",
+    "میری مدد کریں",
+    "السلام علیکم",
+    "سلام",
+    "شکریہ",
+    "اللہ",
+    "الحمدللہ",
+    "جی",
+    "ٹھیک ہے",
+    "مجھے بہت ٹینشن ہے",
+    "میرا موڈ خراب ہے",
+]
+
+
+def labelled_samples():
+    for text in ENGLISH_SAMPLES:
+        yield text, "english"
+    for text in ROMAN_URDU_SAMPLES:
+        yield text, "roman_urdu"
+    for text in URDU_SAMPLES:
+        yield text, "urdu"
+
+
+def main():
+    print("🔤 Training language identifier...")
+    log_priors, log_probs = train_table(labelled_samples(), NUM_BUCKETS)
+    save_table(MODEL_PATH, log_priors, log_probs, NUM_BUCKETS)
+
+    size_kb = MODEL_PATH.stat().st_size / 1024
+    print(f"✅ Wrote {MODEL_PATH} ({size_kb:.1f} KB, {NUM_BUCKETS} buckets)")
+    print(f"   English: {len(ENGLISH_SAMPLES)}, Roman Urdu: {len(ROMAN_URDU_SAMPLES)}, Urdu: {len(URDU_SAMPLES)} samples")
+
+
+if __name__ == "__main__":
+    main()
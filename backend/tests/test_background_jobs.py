@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+"""
+Tests for the post-response background job runner
+"""
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.background_jobs import BackgroundJobRunner
+
+
+def test_backoff_does_not_hold_a_worker_thread():
+    runner = BackgroundJobRunner(max_attempts=2, base_delay=0.2)
+    finished = []
+
+    def flaky():
+        if not finished:
+            finished.append("flaky failed")
+            raise OSError("disk busy")
+        finished.append("flaky")
+
+    def quick():
+        finished.append("quick")
+
+    async def main():
+        # One worker: quick can only run if flaky's backoff releases it
+        asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=1))
+        flaky_job = asyncio.create_task(runner.arun("flaky", flaky))
+        await asyncio.sleep(0.05)
+        started = time.perf_counter()
+        assert await runner.arun("quick", quick)
+        assert time.perf_counter() - started < 0.15
+        assert await flaky_job
+
+    asyncio.run(main())
+    assert finished == ["flaky failed", "quick", "flaky"]
+    stats = runner.snapshot()
+    assert stats["flaky"]["retries"] == 1 and stats["flaky"]["succeeded"] == 1
+
+
+def test_spawned_jobs_run_without_a_response():
+    runner = BackgroundJobRunner(max_attempts=2, base_delay=0.01)
+
+    def failing():
+        raise OSError("disk full")
+
+    async def main():
+        runner.spawn("kept", lambda: None)
+        runner.spawn("lost", failing)
+        assert runner.snapshot()["kept"]["pending"] == 1
+        while runner._tasks:
+            await asyncio.sleep(0.01)
+
+    asyncio.run(main())
+    stats = runner.snapshot()
+    assert (stats["kept"]["succeeded"], stats["kept"]["pending"]) == (1, 0)
+    assert (stats["lost"]["failed"], stats["lost"]["last_error"]) == (1, "disk full")
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Tests for the structured emotion classification answer
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.classification import (
+    CATEGORIES, CLASSIFY_MAX_OUTPUT_TOKENS, CLASSIFY_THINKING_MAX_OUTPUT_TOKENS, DISTRESS_EMOTIONS,
+    ClassificationFailed, ClassificationStats, classify_generation_config, parse_classification
+)
+
+
+class StubResponse:
+    def __init__(self, text, finish_reason="STOP"):
+        self._text = text
+        self.candidates = [SimpleNamespace(finish_reason=SimpleNamespace(name=finish_reason))]
+
+    @property
+    def text(self):
+        if self._text is None:
+            # What the SDK does when a candidate has no text parts
+            raise ValueError("The response has no text parts")
+        return self._text
+
+
+def test_parse_returns_category_or_distress_emotion():
+    assert parse_classification('{"category": "greeting", "emotion": "none"}') == "greeting"
+    assert parse_classification('{"category": "emotional_distress", "emotion": "lonely"}') == "lonely"
+    # The emotion is ignored outside emotional_distress
+    assert parse_classification('{"category": "haram_content", "emotion": "sad"}') == "haram_content"
+
+
+@pytest.mark.parametrize("answer", [
+    "Category: greeting\nEmotion: none\nReasoning: a greeting",
+    '{"category": "emotional_distress", "emo',
+    '["greeting"]',
+    '{"category": "small_talk", "emotion": "none"}',
+    '{"category": "emotional_distress", "emotion": "none"}',
+])
+def test_parse_rejects_answers_outside_the_schema(answer):
+    with pytest.raises(ValueError):
+        parse_classification(answer)
+
+
+def test_thinking_models_get_room_for_thinking():
+    assert classify_generation_config("models/gemini-2.0-flash")["max_output_tokens"] == CLASSIFY_MAX_OUTPUT_TOKENS
+    assert classify_generation_config("models/gemini-2.5-flash")["max_output_tokens"] == CLASSIFY_THINKING_MAX_OUTPUT_TOKENS
+
+
+def test_empty_or_truncated_answers_are_counted_failures():
+    stats = ClassificationStats()
+    assert stats.read(StubResponse('{"category": "emotional_distress", "emotion": "sad"}')) == "sad"
+
+    failures = [
+        (StubResponse(None, finish_reason="MAX_TOKENS"), "truncated"),
+        (StubResponse('{"category": "gree', finish_reason="MAX_TOKENS"), "truncated"),
+        (StubResponse(None), "empty"),
+        (StubResponse("   "), "empty"),
+        (StubResponse("Category: greeting"), "invalid"),
+    ]
+    for response, reason in failures:
+        with pytest.raises(ClassificationFailed) as error:
+            stats.read(response)
+        assert error.value.reason == reason
+
+    result = stats.get_stats()
+    assert result["answered"] == 1
+    assert result["failures"] == {"truncated": 2, "empty": 2, "invalid": 1}
+    assert result["fallback_rate"] == round(5 / 6, 3)
+
+
+def test_generation_config_constrains_the_answer():
+    config = classify_generation_config(max_output_tokens=32)
+    assert config["max_output_tokens"] == 32
+    assert config["response_mime_type"] == "application/json"
+    properties = config["response_schema"]["properties"]
+    assert properties["category"]["enum"] == list(CATEGORIES)
+    assert set(DISTRESS_EMOTIONS) < set(properties["emotion"]["enum"])
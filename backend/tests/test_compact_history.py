@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Tests for the compact, array-backed user histories
+"""
+import json
+
+from app.compact_history import MAX_SYMBOLS, ConversationHistory, EmotionHistory, context_view
+from app.context_manager import AdvancedContextManager
+from app.context_store import JsonFileContextStore, dumps_context, loads_context
+
+
+def conversation(i, emotion="sad"):
+    return {
+        "timestamp": 1000.0 + i,
+        "message": f"message {i}",
+        "emotion": emotion,
+        "response_length": i,
+        "topics_detected": ["family"] if i % 2 else ["family", "work"],
+        "urgency_level": "low",
+        "spiritual_themes": [],
+    }
+
+
+def test_ring_keeps_last_rows_and_round_trips():
+    history = ConversationHistory(capacity=5)
+    for i in range(12):
+        history.append(conversation(i))
+
+    assert len(history) == 5
+    assert [record["message"] for record in history] == [f"message {i}" for i in range(7, 12)]
+    assert history[-1]["topics_detected"] == ["family"]
+    assert [record.response_length for record in history[1:3]] == [8, 9]
+
+    restored = ConversationHistory.from_json(json.loads(json.dumps(history.to_json())))
+    assert restored == history
+    assert restored.to_records() == history.to_records()
+
+
+def test_unused_symbols_are_dropped():
+    history = EmotionHistory(capacity=3)
+    for i in range(MAX_SYMBOLS + 10):
+        history.add(f"emotion{i}", float(i))
+
+    assert len(history.symbols) <= MAX_SYMBOLS
+    assert history.recent_emotions(3) == [f"emotion{i}" for i in range(MAX_SYMBOLS + 7, MAX_SYMBOLS + 10)]
+
+
+def test_dropping_codes_mid_row_keeps_the_row_intact():
+    history = ConversationHistory(capacity=300)
+    for i in range(255):
+        history.add(1000.0 + i, f"message {i}", "sad", i, [f"topic {i}"], "low", [])
+    history.add(2000.0, "new", "anxious", 1, ["new-topic"], "high", ["new-theme"])
+
+    assert history[-1].to_dict() == {
+        "timestamp": 2000.0, "message": "new", "emotion": "anxious", "response_length": 1,
+        "topics_detected": ["new-topic"], "urgency_level": "high", "spiritual_themes": ["new-theme"],
+    }
+    assert [record.topics_detected for record in history[:255]] == [[f"topic {i}"] for i in range(255)]
+
+    # Small rings keep dropping as rows roll over, with every row readable
+    history = ConversationHistory(capacity=4)
+    for i in range(3 * MAX_SYMBOLS):
+        history.add(float(i), f"m{i}", f"e{i % 7}", i, [f"t{i}", f"t{i + 1}"], f"u{i}", [f"s{i % 3}"])
+        last = history[-1]
+        assert (last.topics_detected, last.urgency_level) == ([f"t{i}", f"t{i + 1}"], f"u{i}")
+    assert len(history.symbols) <= MAX_SYMBOLS and len(history.groups) <= MAX_SYMBOLS
+
+
+def test_legacy_list_histories_are_migrated(tmp_path):
+    legacy = {
+        "name": "Friend",
+        "conversation_history": [conversation(i) for i in range(3)],
+        "emotional_history": [{"emotion": "sad", "timestamp": 1.0}, {"emotion": "hopeful", "timestamp": 2.0}],
+    }
+    store = JsonFileContextStore(str(tmp_path / "ctx"))
+    path = store.get_user_file_path("u1")
+    path.parent.mkdir(parents=True)
+    path.write_text(json.dumps(legacy, indent=2))
+
+    context = store.load("u1")
+    assert isinstance(context["conversation_history"], ConversationHistory)
+    assert context_view(context)["conversation_history"] == legacy["conversation_history"]
+    # Rewritten in columnar form on first read
+    assert "rows" in json.loads(path.read_bytes())["emotional_history"]
+    assert loads_context(dumps_context(context))["emotional_history"].recent_emotions(5) == ["sad", "hopeful"]
+
+
+def test_manager_view_is_plain_json(tmp_path):
+    manager = AdvancedContextManager(data_dir=str(tmp_path / "ctx"), flush_interval=0)
+    for _ in range(25):
+        manager.update_conversation("u1", "I feel anxious about my family", "anxious", "reply")
+
+    view = manager.get_user_context_view("u1")
+    assert len(view["conversation_history"]) == 20
+    assert len(view["emotional_history"]) == 15
+    assert view["conversation_history"][-1]["topics_detected"] == ["family"]
+    assert json.loads(json.dumps(view)) == view
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""
+Tests for the async (non-blocking) AdvancedContextManager API
+"""
+import asyncio
+import json
+import statistics
+import threading
+import time
+
+from app.context_manager import AdvancedContextManager
+from app.context_store import ContextEventLog, JsonFileContextStore, SQLiteContextStore
+
+TICK = 0.005
+
+
+async def sample_lag(stop: asyncio.Event):
+    """Collect how late each short sleep wakes up until stop is set"""
+    loop = asyncio.get_running_loop()
+    lags = []
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(TICK)
+        lags.append(loop.time() - start - TICK)
+    return lags
+
+
+def churn_files(data_dir, stop: threading.Event):
+    """Keep rewriting unrelated context files, like other workers would"""
+    payload = {"conversation_history": [{"message": "x" * 200, "emotion": "sad"}] * 20}
+    i = 0
+    while not stop.is_set():
+        with open(data_dir / f"churn_{i % 200}.json", "w", encoding="utf-8") as f:
+            json.dump(payload, f, indent=2)
+        i += 1
+
+
+def test_async_api_matches_sync(tmp_path):
+    manager = AdvancedContextManager(data_dir=str(tmp_path / "ctx"), flush_interval=0)
+
+    async def scenario():
+        await manager.aupdate_conversation("u1", "I feel anxious about my exams", "anxious", "Take a breath")
+        await manager.atrack_response_usage("u1", "anxious", "counseling")
+        return await manager.aload_user_context("u1")
+
+    context = asyncio.run(scenario())
+    assert context == manager.load_user_context("u1")
+    assert context["therapeutic_progress"]["sessions_count"] == 1
+    assert context["response_patterns"]["anxious_counseling"]["count"] == 1
+
+
+def test_corrupt_sqlite_row_is_set_aside_for_a_default_context(tmp_path):
+    store = SQLiteContextStore(str(tmp_path / "ctx.db"))
+    store._connect().execute(
+        "INSERT INTO user_context (user_id, context) VALUES (?, ?)", ("u1", '{"conversation_hist')
+    )
+    manager = AdvancedContextManager(store=store, flush_interval=0)
+
+    async def scenario():
+        context = await manager.aload_user_context("u1")
+        assert context["therapeutic_progress"]["sessions_count"] == 0
+        await manager.aupdate_conversation("u1", "I feel lonely", "lonely", "You are not alone")
+
+    asyncio.run(scenario())
+    assert manager.load_user_context("u1")["therapeutic_progress"]["sessions_count"] == 1
+    corrupt = store._connect().execute("SELECT user_id, context FROM user_context_corrupt").fetchall()
+    assert corrupt == [("u1", '{"conversation_hist')] * 2
+
+
+def test_async_api_with_session_cache_and_event_log(tmp_path):
+    store = JsonFileContextStore(str(tmp_path / "ctx"))
+    manager = AdvancedContextManager(
+        store=store, flush_interval=60, event_log=ContextEventLog(str(tmp_path / "events"))
+    )
+
+    async def scenario():
+        await asyncio.gather(*(
+            manager.aupdate_conversation(f"u{i % 5}", f"message {i}", "sad", "reply") for i in range(50)
+        ))
+        return await manager.aload_user_context("u0")
+
+    context = asyncio.run(scenario())
+    manager.close()
+
+    reloaded = AdvancedContextManager(store=store, flush_interval=0)
+    assert reloaded.load_user_context("u0") == context
+    assert context["therapeutic_progress"]["sessions_count"] == 10
+
+
+def test_active_users_include_cached_sessions_without_compacting(tmp_path):
+    store = JsonFileContextStore(str(tmp_path / "ctx"))
+    event_log = ContextEventLog(str(tmp_path / "events"))
+    manager = AdvancedContextManager(store=store, flush_interval=60, event_log=event_log)
+    since = time.time()
+    manager.update_conversation("u1", "I feel anxious", "anxious", "reply")
+    manager.update_conversation("u2", "I feel lonely", "lonely", "reply")
+    manager.flush()
+    manager.compact()
+    manager.update_conversation("u3", "I feel sad", "sad", "reply")
+
+    assert sorted(asyncio.run(manager.aget_active_users(since))) == ["u1", "u2", "u3"]
+    # Reading did not write u3's snapshot or fold its logged event
+    assert sorted(store.active_users(since)) == ["u1", "u2"]
+    assert len(event_log.read("u3")) == 1
+    assert manager.get_active_users(time.time() + 1) == []
+    manager.close()
+
+
+def test_event_loop_lag_stays_flat_under_context_churn(tmp_path):
+    data_dir = tmp_path / "ctx"
+    # Write-through, so every update does a file read and a file write
+    manager = AdvancedContextManager(data_dir=str(data_dir), flush_interval=0)
+
+    async def scenario():
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_lag(stop))
+        await asyncio.sleep(0.2)
+        stop.set()
+        baseline = await sampler
+
+        stop_churn = threading.Event()
+        churner = threading.Thread(target=churn_files, args=(data_dir, stop_churn), daemon=True)
+        churner.start()
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_lag(stop))
+        start = time.perf_counter()
+        while time.perf_counter() - start < 1.0:
+            await asyncio.gather(*(
+                manager.aupdate_conversation(f"user{i}", "I feel lonely and tired", "lonely", "reply")
+                for i in range(20)
+            ))
+        stop.set()
+        under_churn = await sampler
+        stop_churn.set()
+        churner.join()
+        return baseline, under_churn
+
+    baseline, under_churn = asyncio.run(scenario())
+
+    # The sampler keeps ticking throughout, and its typical lag stays close
+    # to the idle baseline instead of growing with the file traffic
+    assert len(under_churn) > 50
+    assert statistics.median(under_churn) < statistics.median(baseline) + 0.01
+    assert sorted(under_churn)[int(len(under_churn) * 0.95)] < 0.05
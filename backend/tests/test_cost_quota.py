@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Tests for the cost-weighted LLM spend quotas
+"""
+import threading
+from contextvars import copy_context
+from types import SimpleNamespace
+
+from app.cost_quota import CostQuota, LLMCostMeter, metered_request
+from app.prompt_builder import timed_generate
+
+
+class StubModel:
+    def generate_content(self, prompt, **kwargs):
+        usage = SimpleNamespace(prompt_token_count=100, candidates_token_count=20)
+        return SimpleNamespace(text="reply", usage_metadata=usage)
+
+
+def spent(tokens):
+    meter = LLMCostMeter()
+    meter.add(tokens, 0)
+    return meter
+
+
+def test_requests_are_charged_their_llm_cost():
+    quota = CostQuota(user_capacity=1000, user_per_hour=3600, ip_capacity=10 ** 6)
+    t = 1000.0
+    assert quota.admit("u1", "1.2.3.4", t) == (True, 0)
+    # A large request is admitted on a positive balance and leaves a debt
+    assert quota.charge("u1", "1.2.3.4", spent(1500), t) == -500
+    allowed, retry_after = quota.admit("u1", "1.2.3.4", t)
+    assert not allowed and retry_after == 501
+    # Served a curated reply without the LLM meanwhile, it adds no debt
+    assert quota.charge("u1", "1.2.3.4", LLMCostMeter(), t) == -500
+    assert quota.get_stats()["over_quota"] == 1
+
+    # One token per second refills the debt
+    assert quota.admit("u1", "1.2.3.4", t + 501)[0]
+    # Other users behind the same IP are unaffected
+    assert quota.admit("u2", "1.2.3.4", t)[0]
+
+
+def test_cheap_traffic_is_never_limited():
+    quota = CostQuota(user_capacity=1, user_per_hour=0, ip_capacity=1, ip_per_hour=0)
+    for i in range(1000):
+        assert quota.admit("u1", "1.2.3.4", 1000.0 + i)[0]
+        quota.charge("u1", "1.2.3.4", LLMCostMeter(), 1000.0 + i)
+    assert quota.get_stats()["buckets"] == 0
+
+
+def test_ip_bucket_bounds_many_user_ids():
+    quota = CostQuota(unit="calls", user_capacity=5, ip_capacity=3, ip_per_hour=0)
+    for i in range(3):
+        assert quota.admit(f"user{i}", "1.2.3.4", 1000.0)[0]
+        quota.charge(f"user{i}", "1.2.3.4", spent(10), 1000.0)
+    assert quota.admit("user9", "1.2.3.4", 1000.0) == (False, 3600)
+
+
+def test_timed_generate_reports_to_the_current_request():
+    with metered_request() as meter:
+        timed_generate(StubModel(), "test", "prompt")
+        # Calls from worker threads running a copy of the context count too
+        worker = threading.Thread(target=copy_context().run, args=(timed_generate, StubModel(), "test", "prompt"))
+        worker.start()
+        worker.join()
+    assert (meter.calls, meter.tokens) == (2, 240)
+
+    # Outside a metered request nothing is charged
+    timed_generate(StubModel(), "test", "prompt")
+    assert meter.calls == 2
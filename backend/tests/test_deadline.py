@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Tests for request deadlines and cancellation
+"""
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.cost_quota import metered_request
+from app.deadline import Deadline, DeadlineExceeded, RequestCancelled, run_until_disconnected
+from app.load_monitor import load_monitor
+from app.prompt_builder import timed_generate
+
+
+class SlowModel:
+    def __init__(self, delay):
+        self.delay = delay
+        self.kwargs = None
+
+    def generate_content(self, prompt, **kwargs):
+        self.kwargs = kwargs
+        time.sleep(self.delay)
+        usage = SimpleNamespace(prompt_token_count=100, candidates_token_count=20)
+        return SimpleNamespace(text="reply", usage_metadata=usage)
+
+
+def test_child_budget_never_outlives_parent():
+    request = Deadline(1.0)
+    assert request.child("short", 0.1).expires_at < request.expires_at
+    assert request.child("long", 60.0).expires_at == request.expires_at
+
+    # Cancelling any stage cancels the whole request
+    stage = request.child("stage", 0.5)
+    stage.cancel("client_disconnected")
+    assert request.cancel_reason == "client_disconnected"
+    with pytest.raises(RequestCancelled):
+        request.check()
+
+
+def test_run_abandons_slow_calls():
+    deadline = Deadline(0.1)
+    assert deadline.run(lambda x: x * 2, 21) == 42
+
+    start = time.monotonic()
+    with pytest.raises(DeadlineExceeded):
+        deadline.run(time.sleep, 2.0, stage="slow")
+    assert time.monotonic() - start < 1.0
+
+
+def test_cancel_wakes_a_waiting_call():
+    deadline = Deadline(10.0)
+    threading.Timer(0.05, deadline.cancel, args=("client_disconnected",)).start()
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        deadline.run(time.sleep, 2.0)
+    assert time.monotonic() - start < 1.0
+
+
+def test_disconnected_client_cancels_the_pipeline():
+    deadline = Deadline(10.0)
+    disconnected = False
+
+    async def is_disconnected():
+        return disconnected
+
+    def pipeline():
+        nonlocal disconnected
+        disconnected = True
+        deadline.run(time.sleep, 2.0)
+        return "unreachable"
+
+    start = time.monotonic()
+    with pytest.raises(RequestCancelled):
+        asyncio.run(run_until_disconnected(deadline, is_disconnected, pipeline, poll_interval=0.01))
+    assert deadline.cancel_reason == "client_disconnected"
+    assert time.monotonic() - start < 1.0
+
+
+def test_timed_generate_honours_the_deadline():
+    model = SlowModel(0.0)
+    with metered_request() as meter:
+        timed_generate(model, "test", "prompt", deadline=Deadline(5.0))
+    assert 0 < model.kwargs["request_options"]["timeout"] <= 5.0
+    assert meter.calls == 1
+
+    failures = load_monitor.consecutive_failures
+    with pytest.raises(DeadlineExceeded):
+        timed_generate(SlowModel(0.5), "test", "prompt", deadline=Deadline(0.05))
+    time.sleep(0.6)
+    # A call that was merely abandoned does not count against the breaker
+    assert load_monitor.consecutive_failures == failures
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Tests for the LLM-free degraded reply mode
+"""
+import time
+
+from app.degraded_mode import DegradedMode, format_haram_template
+from app.load_monitor import LoadMonitor
+
+TEMPLATE = {
+    "opening": "Opening.",
+    "story": "Story.",
+    "techniques": ["First step.", "Second step."],
+    "dua": {"arabic": "دعا", "transliteration": "dua", "translation": "A dua."},
+}
+DOCS = [{"text": "Hearts find rest in the remembrance of Allah.", "emotion_relevance": ["anxious"]}]
+
+
+def responder(**kwargs):
+    return DegradedMode(["Hi {name}, you feel {emotion}."], [TEMPLATE], local_documents=DOCS, **kwargs)
+
+
+def test_switches_on_with_breaker_or_full_queue():
+    monitor = LoadMonitor(max_llm_in_flight=1, failure_threshold=1)
+    degraded = responder(load_monitor=monitor)
+    assert degraded.reason() is None
+
+    with monitor.track_llm_call():
+        assert degraded.reason() == "llm_queue_full"
+    try:
+        with monitor.track_llm_call():
+            raise TimeoutError()
+    except TimeoutError:
+        pass
+    assert degraded.reason() == "llm_breaker_open"
+
+    assert responder(mode="on", load_monitor=LoadMonitor()).reason() == "forced"
+    assert responder(mode="off", load_monitor=monitor).reason() is None
+
+
+def test_replies_are_emotion_matched_and_fast():
+    degraded = responder(load_monitor=LoadMonitor())
+    assert degraded.detect_emotion("I'm so worried about my exams") == "anxious"
+    assert degraded.detect_emotion("Alhamdulillah, all good") == "neutral"
+
+    start = time.perf_counter()
+    reply = degraded.respond("Amina", "anxious", "llm_breaker_open")
+    assert time.perf_counter() - start < 0.05
+    assert reply["response_type"] == "template"
+    assert reply["response"].startswith("Hi Amina, you feel anxious.")
+    assert "remembrance of Allah" in reply["response"]
+
+    # Recent retrievals are preferred over the local documents
+    degraded.remember_excerpts("anxious", [{"content": "Recent excerpt."}])
+    assert "Recent excerpt." in degraded.respond("Amina", "anxious")["response"]
+
+    assert degraded.respond("Amina", "sad", haram=True)["response"] == format_haram_template(TEMPLATE)
+    assert degraded.respond("Amina", "greeting")["response_type"] == "greeting"
+    assert degraded.get_stats()["served"] == {"llm_breaker_open": 1, "forced": 3}
+
+
+def test_local_documents_are_loaded_on_first_use():
+    loads = []
+
+    def load_documents():
+        loads.append(1)
+        return DOCS
+
+    degraded = DegradedMode(["Hi {name}."], [TEMPLATE], local_documents=load_documents, load_monitor=LoadMonitor())
+    assert not loads
+    assert degraded.excerpt("anxious") == DOCS[0]["text"]
+    degraded.respond("Amina", "anxious")
+    assert loads == [1]
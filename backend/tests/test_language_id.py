@@ -0,0 +1,39 @@
+#!/usr/bin/env python3
+"""
+Tests for the n-gram language identifier and its shipped model
+"""
+from pathlib import Path
+
+import pytest
+
+from app.language_id import LanguageIdentifier, detect_language
+
+
+@pytest.mark.parametrize("text", ["hi", "Hi!", "hello", "salam", "Allah", "acha", "inshallah", "hmm", "ok thanks"])
+def test_short_greetings_and_shared_words_stay_english(text):
+    assert detect_language(text) == "english"
+
+
+@pytest.mark.parametrize("text, language", [
+    ("shukriya", "roman_urdu"),
+    ("acha theek hai", "roman_urdu"),
+    ("salam, kya haal hai", "roman_urdu"),
+    ("salam, how are you?", "english"),
+    # Code-mixed messages follow the language carrying the sentence
+    ("mujhe bohat stress hai exams ki wajah se", "roman_urdu"),
+    ("yaar I am so tired of everything", "english"),
+])
+def test_short_and_code_mixed_messages(text, language):
+    assert detect_language(text) == language
+
+
+@pytest.mark.parametrize("text", ["سلام", "میں بہت اداس ہوں", "ok میں ٹھیک ہوں"])
+def test_arabic_script_is_urdu(text):
+    assert detect_language(text) == "urdu"
+
+
+def test_without_a_model_only_arabic_script_is_detected(tmp_path: Path):
+    identifier = LanguageIdentifier(model_path=tmp_path / "missing.bin")
+    assert identifier.classify("میں بہت اداس ہوں") == "urdu"
+    assert identifier.classify("mein bohat pareshan hun") == "english"
+    assert identifier.classify("   ") == "english"
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Tests for incremental load tracking
+"""
+import time
+
+from app.load_monitor import LoadMonitor, RollingCounter
+
+
+def test_rolling_counter_expires_old_buckets():
+    counter = RollingCounter(window=60, buckets=60)
+    for i in range(120):
+        counter.add(1000.0 + i)
+    assert counter.count(1119.5) == 60
+    assert counter.count(1150.0) == 29
+    assert counter.count(5000.0) == 0
+
+
+def test_high_load_follows_in_flight_work():
+    monitor = LoadMonitor(max_in_flight=5, max_llm_in_flight=2, latency_threshold=10.0)
+    assert not monitor.is_high_load()
+
+    with monitor.track_request():
+        with monitor.track_llm_call():
+            assert monitor.snapshot()["llm_in_flight"] == 1
+            with monitor.track_llm_call():
+                assert monitor.is_high_load()
+    assert not monitor.is_high_load()
+    assert monitor.snapshot()["in_flight_requests"] == 0
+
+
+def test_high_load_from_slow_llm_calls():
+    monitor = LoadMonitor(latency_threshold=1.0)
+    monitor.latency_ewma, monitor.latency_updated_at = 0.9, time.time()
+    assert monitor.is_high_load()
+    monitor.record_decision(False, now=1000.0)
+    assert monitor.rejected.count(1000.0) == 1
+
+
+def test_slow_latency_fades_without_new_calls():
+    monitor = LoadMonitor(latency_threshold=1.0, latency_half_life=15.0)
+    monitor.latency_ewma, monitor.latency_updated_at = 2.0, 1000.0
+    assert monitor.is_high_load(now=1000.0)
+    # No LLM calls finish for a while: the slow average stops counting
+    assert monitor.load_ratio(now=1015.0) == 1.0
+    assert not monitor.is_high_load(now=1060.0)
+
+    # A stale average also gives way to the next sample
+    monitor.latency_updated_at = time.time() - 60
+    with monitor.track_llm_call():
+        pass
+    assert monitor.latency_ewma < 0.2
+
+
+def test_breaker_opens_on_consecutive_failures():
+    monitor = LoadMonitor(failure_threshold=2, breaker_cooldown=30.0)
+
+    def failing_call():
+        try:
+            with monitor.track_llm_call():
+                raise RuntimeError("Gemini unavailable")
+        except RuntimeError:
+            pass
+
+    failing_call()
+    assert not monitor.breaker_open()
+    failing_call()
+    assert monitor.breaker_open()
+    assert monitor.snapshot()["llm_breaker_open"]
+
+    # After the cooldown calls are let through, and one success closes it
+    assert not monitor.breaker_open(now=monitor.breaker_opened_at + 31)
+    with monitor.track_llm_call():
+        pass
+    assert monitor.breaker_opened_at is None and monitor.consecutive_failures == 0
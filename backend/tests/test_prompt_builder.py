@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Tests for prompt templates, section budgets and token accounting
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from app.prompt_builder import (
+    CHARS_PER_TOKEN, PromptTemplate, TokenUsageTracker, estimate_tokens, join_within_budget, trim_text
+)
+
+# The counseling prompt's budgets, in tokens
+USER_CONTEXT_BUDGET = 150
+USED_STORIES_BUDGET = 100
+RAG_CONTEXT_BUDGET = 200
+
+
+class CountingText:
+    """A static value that counts how often it is rendered"""
+
+    def __init__(self, text):
+        self.text = text
+        self.renders = 0
+
+    def __str__(self):
+        self.renders += 1
+        return self.text
+
+
+def test_static_portions_are_rendered_once():
+    instructions = CountingText("Answer with one word.")
+    template = PromptTemplate(
+        "test", "{instructions}\nUser: {user_msg}\n{instructions}", instructions=instructions
+    )
+    assert instructions.renders == 2
+    assert template.fields == ["user_msg"]
+    assert template.static_chars == len("Answer with one word.\nUser: \nAnswer with one word.")
+
+    for i in range(50):
+        assert template.render(user_msg=f"message {i}") == (
+            f"Answer with one word.\nUser: message {i}\nAnswer with one word."
+        )
+    # Rendering only fills the dynamic fields
+    assert instructions.renders == 2
+
+
+def test_format_specs_are_rejected():
+    with pytest.raises(ValueError):
+        PromptTemplate("test", "{user_msg!r}")
+
+
+def test_each_section_is_trimmed_to_its_budget():
+    template = PromptTemplate(
+        "counseling", "{user_context}|{rag_context}|{user_msg}",
+        budgets={"user_context": USER_CONTEXT_BUDGET, "rag_context": RAG_CONTEXT_BUDGET}
+    )
+    context = "\n".join(f"Recent topic {i}: feeling sad about work and family" for i in range(100))
+    rag = " ".join(["Hearts find rest in the remembrance of Allah."] * 100)
+    message = "x " * 1000
+
+    user_context, rag_context, user_msg = template.render(
+        user_context=context, rag_context=rag, user_msg=message
+    ).split("|")
+    assert estimate_tokens(user_context) <= USER_CONTEXT_BUDGET + 1
+    assert estimate_tokens(rag_context) <= RAG_CONTEXT_BUDGET + 1
+    # Cut at a line or word boundary and marked
+    assert user_context.endswith("family...") and context.startswith(user_context[:-3])
+    assert rag_context.endswith("...") and rag.startswith(rag_context[:-3] + " ")
+    # Unbudgeted fields are left alone
+    assert user_msg == message
+
+    short = template.render(user_context="Name: Amina", rag_context="", user_msg="hi")
+    assert short == "Name: Amina||hi"
+
+
+def test_used_stories_are_dropped_whole_past_the_budget():
+    stories = [f"Story of Prophet {name} and his patience through hardship" for name in
+               ("Yusuf", "Ayyub", "Yunus", "Musa", "Ibrahim", "Nuh", "Isa", "Dawud")]
+    joined = join_within_budget(stories, USED_STORIES_BUDGET)
+
+    assert len(joined) <= USED_STORIES_BUDGET * CHARS_PER_TOKEN
+    kept = joined.split(", ")
+    assert kept == stories[:len(kept)] and 0 < len(kept) < len(stories)
+    assert join_within_budget(stories[:2], USED_STORIES_BUDGET) == ", ".join(stories[:2])
+    assert trim_text("short", 10) == "short"
+
+
+def test_token_usage_is_recorded_per_node():
+    tracker = TokenUsageTracker()
+    usage = SimpleNamespace(prompt_token_count=120, candidates_token_count=30)
+    assert tracker.record_response("counseling", "prompt", SimpleNamespace(text="reply", usage_metadata=usage), 2.0) == (120, 30)
+    usage = SimpleNamespace(prompt_token_count=80, candidates_token_count=10)
+    tracker.record_response("counseling", "prompt", SimpleNamespace(text="reply", usage_metadata=usage), 1.0)
+    # Without reported usage the counts are estimated from the text
+    assert tracker.record_response("greeting", "p" * 40, SimpleNamespace(text="r" * 8), 0.5) == (10, 2)
+
+    stats = tracker.snapshot()
+    assert stats["counseling"]["calls"] == 2
+    assert (stats["counseling"]["prompt_tokens"], stats["counseling"]["completion_tokens"]) == (200, 40)
+    assert stats["counseling"]["max_prompt_tokens"] == 120
+    assert stats["counseling"]["avg_prompt_tokens"] == 100.0
+    assert stats["counseling"]["avg_latency_seconds"] == 1.5
+    assert (stats["greeting"]["prompt_tokens"], stats["greeting"]["completion_tokens"]) == (10, 2)
@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Tests for the shared (cross-worker) rate limit backends
+"""
+import multiprocessing
+
+import pytest
+
+from app.rate_limit_backends import (
+    MmapRateLimitBackend, RespRateLimitBackend, RespStandIn, SharedRateLimitBackend, create_rate_limit_backend
+)
+
+LIMITS = (("minute", 60, 5), ("hour", 3600, 8), ("day", 86400, 100))
+# Start of a minute, so the previous windows carry no weight
+T = 60.0 * 100000
+
+
+def run_checks(backend, count, start=T, step=0.5):
+    return [backend.check("10.0.0.1", start + i * step, LIMITS, 10) for i in range(count)]
+
+
+@pytest.fixture
+def standin():
+    server = RespStandIn().start()
+    yield server
+    server.close()
+
+
+def test_mmap_table_is_shared_between_workers_and_restarts(tmp_path):
+    path = str(tmp_path / "limits.bin")
+    worker_a = MmapRateLimitBackend(path, buckets=16)
+    worker_b = MmapRateLimitBackend(path, buckets=16)
+
+    assert run_checks(worker_a, 3) == [None] * 3
+    assert run_checks(worker_b, 3, start=T + 2) == [None, None, "minute"]
+    assert worker_a.minute_count("10.0.0.1", T + 3) == 5
+    worker_a.close()
+    worker_b.close()
+
+    # State survives a restart; the hour limit applies once the minute rolls over
+    restarted = MmapRateLimitBackend(path)
+    assert restarted.buckets == 16
+    assert run_checks(restarted, 4, start=T + 120) == [None, None, None, "hour"]
+    restarted.close()
+
+
+def _worker(path, queue):
+    backend = MmapRateLimitBackend(path)
+    queue.put(sum(backend.check("10.0.0.1", T + 1, (("minute", 60, 100),), 10 ** 6) is None for _ in range(60)))
+    backend.close()
+
+
+def test_mmap_limit_holds_across_processes(tmp_path):
+    path = str(tmp_path / "limits.bin")
+    MmapRateLimitBackend(path, buckets=16).close()
+    context = multiprocessing.get_context("fork")
+    queue = context.Queue()
+    workers = [context.Process(target=_worker, args=(path, queue)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    allowed = sum(queue.get(timeout=30) for _ in workers)
+    for worker in workers:
+        worker.join()
+    assert allowed == 100
+
+
+def test_mmap_full_bucket_reuses_least_recently_seen(tmp_path):
+    backend = MmapRateLimitBackend(str(tmp_path / "limits.bin"), buckets=1)
+    for i in range(9):
+        backend.check(f"client-{i}", T + i, LIMITS, 10)
+    assert backend.stats()["shed_lru"] == 1
+    assert backend.minute_count("client-0", T + 10) == 0
+    assert backend.minute_count("client-8", T + 10) == 1
+    backend.close()
+
+
+def test_resp_backend_with_standin(standin):
+    worker_a = RespRateLimitBackend(standin.url)
+    worker_b = RespRateLimitBackend(standin.url)
+
+    assert run_checks(worker_a, 3) == [None] * 3
+    assert run_checks(worker_b, 3, start=T + 2) == [None, None, "minute"]
+    # The rejected request was not counted
+    assert worker_b.minute_count("10.0.0.1", T + 3) == 5
+    assert worker_a.stats()["round_trips"] == 3
+
+    burst = [worker_a.check("burst", T + 0.1, LIMITS, 2) for _ in range(3)]
+    assert burst == [None, None, "burst"]
+    worker_a.close()
+    worker_b.close()
+
+
+def test_resp_backend_fails_open(standin):
+    backend = RespRateLimitBackend(standin.url, timeout=0.2)
+    standin.close()
+    assert backend.check("10.0.0.1", T, LIMITS, 10) is None
+    assert backend.stats()["errors"] == 1
+
+
+def test_backend_selection(tmp_path, monkeypatch):
+    assert create_rate_limit_backend("local") is None
+    monkeypatch.setenv("RATE_LIMIT_MMAP_PATH", str(tmp_path / "limits.bin"))
+    backend = create_rate_limit_backend("mmap")
+    assert isinstance(backend, MmapRateLimitBackend)
+    backend.close()
+    assert isinstance(create_rate_limit_backend("redis"), RespRateLimitBackend)
+
+
+def test_backends_report_the_minute_count_with_the_check(tmp_path, standin):
+    with pytest.raises(TypeError):
+        SharedRateLimitBackend()
+    for backend in (MmapRateLimitBackend(str(tmp_path / "limits.bin"), buckets=16), RespRateLimitBackend(standin.url)):
+        assert [backend.check_and_count("10.0.0.1", T + i, LIMITS, 10) for i in range(6)] == [
+            (None, 1), (None, 2), (None, 3), (None, 4), (None, 5), ("minute", 5)
+        ]
+        backend.close()
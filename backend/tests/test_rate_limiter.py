@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Tests for the sliding-window rate limiter and its client eviction
+"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.rate_limiter import DAY, RateLimiter
+
+
+def limiter(**kwargs):
+    options = dict(requests_per_minute=3, requests_per_hour=5, requests_per_day=6, burst_size=10, sweep_interval=0)
+    options.update(kwargs)
+    return RateLimiter(**options)
+
+
+def test_minute_hour_and_day_windows():
+    rate_limiter = limiter()
+    t = 1000.0
+    assert all(rate_limiter.check("a", t + i * 2)[0] for i in range(3))
+    allowed, message = rate_limiter.check("a", t + 7)
+    assert not allowed and "per minute" in message
+
+    # The minute window slides; the hour limit is next
+    assert rate_limiter.check("a", t + 61)[0]
+    assert rate_limiter.check("a", t + 63)[0]
+    allowed, message = rate_limiter.check("a", t + 125)
+    assert not allowed and "per hour" in message
+
+    assert rate_limiter.check("a", t + 3601)[0]
+    allowed, message = rate_limiter.check("a", t + 3700)
+    assert not allowed and "per day" in message
+    assert rate_limiter.check("a", t + DAY + 1)[0]
+
+
+def test_idle_clients_are_swept():
+    rate_limiter = limiter()
+    rate_limiter.check("old", 1000.0)
+    rate_limiter.check("recent", 1000.0 + DAY)
+
+    assert rate_limiter.sweep(1000.0 + DAY + 1) == 1
+    stats = rate_limiter.get_stats()
+    assert stats["clients"] == 1
+    assert stats["evicted_idle"] == 1
+
+
+def test_hard_cap_sheds_least_recently_active():
+    rate_limiter = limiter(stripes=1, max_clients=3)
+    for i, client in enumerate(["a", "b", "c"]):
+        rate_limiter.check(client, 1000.0 + i)
+    # Touching "a" makes "b" the least recently active
+    rate_limiter.check("a", 1010.0)
+    rate_limiter.check("d", 1011.0)
+
+    stats = rate_limiter.get_stats()
+    assert stats["clients"] == 3
+    assert stats["shed_lru"] == 1
+    assert stats["memory_bytes"] > 0
+    assert rate_limiter.get_rate_limit_headers("b")["X-RateLimit-Remaining"] == "3"
+
+
+def test_shared_backend_messages(tmp_path):
+    from app.rate_limit_backends import MmapRateLimitBackend
+
+    rate_limiter = limiter(backend=MmapRateLimitBackend(str(tmp_path / "limits.bin"), buckets=16))
+    t = 60.0 * 100000
+    assert all(rate_limiter.check("a", t + i)[0] for i in range(3))
+    allowed, message = rate_limiter.check("a", t + 4)
+    assert not allowed and "per minute" in message
+    assert rate_limiter.get_stats()["backend"] == "mmap"
+    rate_limiter.close()
+
+
+def test_shared_backend_check_is_one_round_trip_off_the_loop():
+    from app.rate_limit_backends import RespRateLimitBackend, RespStandIn
+
+    server = RespStandIn().start()
+    backend = RespRateLimitBackend(server.url)
+    rate_limiter = limiter(backend=backend)
+
+    async def check():
+        return await rate_limiter.check_rate_limit("a")
+
+    for expected_remaining in ("2", "1", "0"):
+        allowed, _, headers = asyncio.run(check())
+        assert allowed and headers["X-RateLimit-Remaining"] == expected_remaining
+    allowed, _, headers = asyncio.run(check())
+    assert not allowed and headers["X-RateLimit-Remaining"] == "0"
+    # Three checks, plus the check and uncount of the rejected request
+    assert backend.stats()["round_trips"] == 5
+    rate_limiter.close()
+    server.close()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Tests for the pre-generated response bank
+"""
+import random
+import threading
+import time
+
+from app.response_bank import ResponseBank, deduplicate, generate_replies, hashed_embedding, personalize, write_bank
+
+
+def test_bank_file_round_trip_and_pick(tmp_path):
+    path = str(tmp_path / "bank.bin")
+    replies = [f"Dear {{name}}, story number {i}." for i in range(5)]
+    write_bank(path, {("sad", "english"): replies, ("anxious", "urdu"): ["بسم اللہ {name}"]})
+
+    bank = ResponseBank.open(path)
+    assert bank.count("sad", "english") == 5
+    assert bank.count("sad", "urdu") == 0
+    assert bank.pick("sad", "urdu") is None
+    assert personalize(bank.pick("anxious", "urdu")[1], "Amina") == "بسم اللہ Amina"
+
+    # Only the one reply the user hasn't seen is left
+    seen = set(replies[:4])
+    for seed in range(10):
+        _, text = bank.pick("sad", "english", exclude=seen.__contains__, rng=random.Random(seed))
+        assert text == replies[4]
+    assert bank.pick("sad", "english", exclude=lambda text: True) is None
+
+    assert ResponseBank.open(str(tmp_path / "missing.bin")) is None
+    (tmp_path / "bad.bin").write_bytes(b"not a bank at all")
+    assert ResponseBank.open(str(tmp_path / "bad.bin")) is None
+
+
+def test_generation_is_bounded_and_retried():
+    lock = threading.Lock()
+    in_flight = [0, 0]
+    attempts = {}
+
+    def generate(prompt):
+        with lock:
+            in_flight[0] += 1
+            in_flight[1] = max(in_flight[1], in_flight[0])
+            attempts[prompt] = attempts.get(prompt, 0) + 1
+        time.sleep(0.01)
+        with lock:
+            in_flight[0] -= 1
+        if prompt == "flaky" and attempts[prompt] == 1:
+            raise RuntimeError("429")
+        return f"reply to {prompt}"
+
+    jobs = [(("sad", "english"), f"p{i}") for i in range(12)] + [(("sad", "english"), "flaky")]
+    results = generate_replies(generate, jobs, concurrency=3, retries=1)
+    assert len(results[("sad", "english")]) == 13
+    assert in_flight[1] <= 3
+
+
+def test_near_duplicates_are_dropped():
+    texts = [
+        "Dear {name}, remember how Prophet Yunus called on Allah from the belly of the whale.",
+        "Dear {name}, remember how Prophet Yunus called upon Allah from the belly of the whale.",
+        "Salaam {name}. Bilal held on to his faith under the burning rocks of Makkah.",
+    ]
+    embed = lambda batch: [hashed_embedding(text) for text in batch]
+    assert deduplicate(texts, embed, threshold=0.9) == [texts[0], texts[2]]
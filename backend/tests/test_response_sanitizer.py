@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Equivalence tests for the streaming response sanitizer
+"""
+import random
+import re
+
+from app.response_sanitizer import StreamingResponseSanitizer, clean_ai_response, sanitize_stream
+
+
+def reference_clean(text):
+    """The original uncompiled clean_ai_response, used as the oracle"""
+    if not text:
+        return text
+    text = re.sub(r'\*+([^*]+)\*+', r'\1', text)
+    text = re.sub(r'^#+\s*(.+)$', r'\1', text, flags=re.MULTILINE)
+    text = re.sub(r'^\s*[-–—]\s*', '', text, flags=re.MULTILINE)
+    text = re.sub(r'_{2,}', '', text)
+    text = re.sub(r'\n{3,}', '\n\n', text)
+    text = re.sub(r' {2,}', ' ', text)
+    return text.strip()
+
+
+SAMPLE_REPLY = """## Opening
+
+**Hi Ahmad**, I can feel the weight you're carrying.
+
+### The story of Prophet Yunus
+When *Yunus* was in the belly of the whale, he called out:
+- "There is no god but You"
+— and Allah answered him.
+
+1. **Dhikr**: say __SubhanAllah__ 33 times
+2. Write  down   three blessings
+3. *Pray* two rakahs
+
+
+
+May Allah ease your heart. ***"""
+
+ALPHABET = ["a", "b", " ", "  ", "\n", "\n\n", "*", "**", "#", "## ", "-", "–", "—", "_", "__", "\t", "1.", "x\n"]
+
+
+def random_text(rng, length):
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def random_chunks(rng, text):
+    chunks = []
+    i = 0
+    while i < len(text):
+        step = rng.randint(1, 8)
+        chunks.append(text[i:i + step])
+        i += step
+    return chunks
+
+
+def test_buffered_matches_reference():
+    assert clean_ai_response(SAMPLE_REPLY) == reference_clean(SAMPLE_REPLY)
+    assert clean_ai_response("") == ""
+    assert clean_ai_response(None) is None
+
+
+def test_streaming_matches_buffered_on_sample():
+    expected = reference_clean(SAMPLE_REPLY)
+    for size in range(1, 12):
+        chunks = [SAMPLE_REPLY[i:i + size] for i in range(0, len(SAMPLE_REPLY), size)]
+        assert "".join(sanitize_stream(chunks)) == expected
+
+
+def test_streaming_matches_reference_on_random_text():
+    rng = random.Random(1234)
+    for _ in range(3000):
+        text = random_text(rng, rng.randint(0, 40))
+        expected = reference_clean(text)
+        assert "".join(sanitize_stream(random_chunks(rng, text))) == expected, repr(text)
+
+
+def test_streaming_emits_before_finish():
+    sanitizer = StreamingResponseSanitizer()
+    emitted = sanitizer.feed("**Hello** there.\n\nSecond paragraph")
+    assert emitted == "Hello there."
+    assert sanitizer.finish() == "\n\nSecond paragraph"
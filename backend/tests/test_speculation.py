@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Tests for speculative work and its accounting
+"""
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from app.cost_quota import CostQuota, metered_request
+from app.deadline import Deadline, RequestCancelled
+from app.prompt_builder import timed_generate
+from app.speculation import Speculation, SpeculationStats
+
+
+class StubModel:
+    def __init__(self, delay=0.0, release=None):
+        self.delay = delay
+        self.release = release
+
+    def generate_content(self, prompt, **kwargs):
+        if self.release is not None:
+            self.release.wait(5)
+        time.sleep(self.delay)
+        usage = SimpleNamespace(prompt_token_count=100, candidates_token_count=20)
+        return SimpleNamespace(text="reply", usage_metadata=usage)
+
+
+def draft(model):
+    return timed_generate(model, "counseling", "prompt").text
+
+
+def test_kept_speculation_saves_its_head_start():
+    stats = SpeculationStats()
+    with metered_request() as meter:
+        speculation = Speculation("sad", draft, StubModel(delay=0.05), stats=stats)
+        # The classifier would be running meanwhile
+        time.sleep(0.1)
+        assert speculation.take() == "reply"
+    # The speculative call is still charged to the request
+    assert (meter.calls, meter.tokens) == (1, 120)
+
+    result = stats.get_stats()
+    assert result["kept"] == 1 and result["kept_tokens"] == 120
+    assert 0.04 < result["saved_seconds"] < 0.1
+    assert result["wasted_tokens"] == 0
+
+
+def test_discarded_speculation_is_cancelled_and_still_billed():
+    stats = SpeculationStats()
+    quota = CostQuota(user_capacity=1000, user_per_hour=0, ip_capacity=10 ** 6)
+    release = threading.Event()
+    request = Deadline(10.0)
+    draft_deadline = request.child("draft", 5.0, cancel_scope=True)
+
+    def slow_draft():
+        return timed_generate(StubModel(release=release), "counseling", "prompt", deadline=draft_deadline).text
+
+    with metered_request() as meter:
+        speculation = Speculation("anxious", slow_draft, deadline=draft_deadline, stats=stats)
+        time.sleep(0.05)
+        speculation.discard()
+        # The draft stops waiting at once; the request itself goes on
+        with pytest.raises(RequestCancelled):
+            speculation.future.result(timeout=1)
+        assert request.cancel_reason is None
+        # The request is charged before the abandoned call returns
+        assert quota.charge("u1", "1.2.3.4", meter) == 1000
+    assert stats.get_stats()["wasted_tokens"] == 0
+
+    release.set()
+    deadline = time.monotonic() + 5
+    while stats.get_stats()["wasted_tokens"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+    result = stats.get_stats()
+    assert result["discarded"] == 1 and result["hit_rate"] == 0.0
+    assert (result["wasted_calls"], result["wasted_tokens"]) == (1, 120)
+    # ...and the late call is billed to the user all the same
+    assert quota.remaining("u1") == 880
+
+
+def test_take_raises_what_the_speculation_raised():
+    def failing():
+        raise RuntimeError("Gemini unavailable")
+
+    speculation = Speculation("sad", failing)
+    with pytest.raises(RuntimeError):
+        speculation.take()
@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Stress tests for per-user locking of context and memory updates
+"""
+import asyncio
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.context_manager import AdvancedContextManager
+from app.context_store import JsonFileContextStore
+from app.user_locks import AsyncUserLocks, UserLocks
+from app.user_memory import UserMemoryStore
+
+THREADS = 8
+
+
+def sessions_count(manager, user_id):
+    return manager.load_user_context(user_id)["therapeutic_progress"]["sessions_count"]
+
+
+def hammer(manager, users, updates_per_user):
+    """Run updates for every user from THREADS threads at once; return updates/s"""
+    jobs = [user for user in users for _ in range(updates_per_user)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(lambda user: manager.update_conversation(user, "I feel sad today", "sad", "reply"), jobs))
+    return len(jobs) / (time.perf_counter() - start)
+
+
+def test_unrelated_users_never_share_a_mutex():
+    # A single stripe puts every user in the same table
+    locks = UserLocks(stripes=1)
+    with locks.hold("alice"):
+        assert locks.acquire("bob", blocking=False)
+        locks.release("bob")
+        assert not locks.acquire("alice", blocking=False)
+    assert len(locks) == 0
+
+
+def test_no_lost_updates_write_through(tmp_path):
+    manager = AdvancedContextManager(data_dir=str(tmp_path / "ctx"), flush_interval=0)
+    hot = hammer(manager, ["hot_user"], 200)
+    spread = hammer(manager, [f"user{i}" for i in range(200)], 2)
+
+    assert sessions_count(manager, "hot_user") == 200
+    assert all(sessions_count(manager, f"user{i}") == 2 for i in range(200))
+    print(f"write-through: one user {hot:.0f} updates/s, 200 users {spread:.0f} updates/s")
+
+
+def test_no_lost_updates_session_cache(tmp_path):
+    store = JsonFileContextStore(str(tmp_path / "ctx"))
+    # A tiny cache forces evictions and reloads while updates are in flight
+    manager = AdvancedContextManager(store=store, flush_interval=0.01, max_sessions=8)
+    users = [f"user{i}" for i in range(50)]
+    throughput = hammer(manager, users, 20)
+    manager.close()
+
+    reloaded = AdvancedContextManager(store=store, flush_interval=0)
+    assert all(sessions_count(reloaded, user) == 20 for user in users)
+    print(f"session cache: 50 users {throughput:.0f} updates/s")
+
+
+def test_async_and_thread_updates_exclude_each_other(tmp_path):
+    manager = AdvancedContextManager(data_dir=str(tmp_path / "ctx"), flush_interval=0)
+
+    def sync_writer():
+        for _ in range(100):
+            manager.update_conversation("shared", "Feeling anxious", "anxious", "reply")
+
+    async def scenario():
+        writer = threading.Thread(target=sync_writer)
+        writer.start()
+        await asyncio.gather(*(
+            manager.aupdate_conversation("shared", "Feeling anxious", "anxious", "reply") for _ in range(100)
+        ))
+        await asyncio.to_thread(writer.join)
+
+    asyncio.run(scenario())
+    assert sessions_count(manager, "shared") == 200
+
+
+def test_async_locks_serialize_per_user():
+    locks = AsyncUserLocks(UserLocks())
+    active = {}
+    overlaps = []
+
+    async def critical(user_id):
+        async with locks.hold(user_id):
+            active[user_id] = active.get(user_id, 0) + 1
+            overlaps.append(active[user_id])
+            await asyncio.sleep(0)
+            active[user_id] -= 1
+
+    async def scenario():
+        await asyncio.gather(*(critical(f"user{i % 4}") for i in range(200)))
+
+    asyncio.run(scenario())
+    assert max(overlaps) == 1
+
+
+def test_agent_memory_read_modify_write():
+    memory = UserMemoryStore()
+
+    def append_mood(i):
+        user_id = f"user{i % 10}"
+        with memory.lock_user(user_id):
+            entry = memory.get(user_id) or {"mood_history": []}
+            entry["mood_history"] = entry["mood_history"] + [i]
+            memory[user_id] = entry
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(append_mood, range(2000)))
+
+    assert sum(len(memory[f"user{i}"]["mood_history"]) for i in range(10)) == 2000
+
+
+def test_agent_memory_snapshots_do_not_overwrite_each_other():
+    memory = UserMemoryStore()
+
+    def request(i):
+        # One read at graph entry, one commit at exit, as in the agent
+        snapshot = memory.load_snapshot("user", default_name="Amina")
+        snapshot.add_message(f"message {i}")
+        snapshot.add_mood("sad")
+        time.sleep(0.001)
+        memory.commit(snapshot)
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(request, range(50)))
+
+    entry = memory["user"]
+    assert entry["name"] == "Amina"
+    assert len(entry["conversation_history"]) == 10
+    assert entry["mood_history"] == ["sad"] * 5
+
+
+def test_agent_memory_commits_are_never_seen_half_applied():
+    memory = UserMemoryStore()
+    # Large enough that copying it spans thread switches
+    seed = memory.load_snapshot("user")
+    for i in range(2000):
+        seed.add_used_story(f"seed {i}", "story")
+    seed.add_message("first message")
+    memory.commit(seed)
+    stop = threading.Event()
+    errors = []
+
+    def committer(i):
+        snapshot = memory.load_snapshot("user")
+        for j in range(50):
+            snapshot.add_message(f"message {i}.{j}")
+            snapshot.add_used_story(f"emotion {i}.{j}", "story")
+        memory.commit(snapshot)
+
+    def reader():
+        while not stop.is_set():
+            try:
+                data = memory.load_snapshot("user").data
+                history = data["conversation_history"]
+                if len(history) > 10 or data["last_seen"] != history[-1]["timestamp"]:
+                    errors.append("torn entry")
+                memory.get_stats()
+            except Exception as e:
+                errors.append(repr(e))
+
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    readers = [threading.Thread(target=reader) for _ in range(2)]
+    try:
+        for thread in readers:
+            thread.start()
+        with ThreadPoolExecutor(THREADS) as pool:
+            list(pool.map(committer, range(40)))
+    finally:
+        stop.set()
+        for thread in readers:
+            thread.join()
+        sys.setswitchinterval(switch_interval)
+
+    assert not errors, errors[:3]
+    assert len(memory["user"]["used_stories"]) == 2000 + 40 * 50